@@ -42,7 +42,7 @@ pip install --no-user --upgrade pip
 
 # Install ChromaDB and core dependencies
 echo "Installing ChromaDB and dependencies..."
-pip install --no-user chromadb gradio sentence-transformers requests torch bitsandbytes transformers huggingface_hub accelerate beautifulsoup4 pysqlite3-binary
+pip install --no-user chromadb gradio sentence-transformers requests torch bitsandbytes transformers huggingface_hub accelerate beautifulsoup4 lxml onnx onnxruntime pysqlite3-binary
 
 echo "Patch Chroma DB..."
 python $HOME/3_session-make-chroma-venv/setup-chromadb.py
@@ -12,6 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import subprocess
+import sys
 
-print(subprocess.run(["sh 4_job-download-models/download_models.sh"], shell=True))
\ No newline at end of file
+print(subprocess.run(["sh 4_job-download-models/download_models.sh"], shell=True))
+
+# Convert the LLM checkpoint to safetensors now so the app's first start doesn't have to
+if os.getenv("LLM_CONVERT_SAFETENSORS", "1") == "1":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import torch
+    from utils.model_registry import convert_to_safetensors
+    convert_to_safetensors("models/llm-model", torch.bfloat16)
\ No newline at end of file
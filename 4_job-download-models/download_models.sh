@@ -20,6 +20,10 @@ EMBDEDDING_MODEL_COMMIT="9e16800aed25dbd1a96dfa6949c68c4d81d5dded"
 LLM_MODEL_REPO="https://huggingface.co/h2oai/h2ogpt-oig-oasst1-512-6.9b"
 LLM_MODEL_COMMIT="4e336d947ee37d99f2af735d11c4a863c74f8541"
 
+# Optional cross-encoder used to re-rank retrieved chunks (see utils/reranker.py), skip with DOWNLOAD_RERANKER_MODEL=0
+RERANKER_MODEL_REPO="https://huggingface.co/cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANKER_MODEL_COMMIT="c5ee24cb16019beea0893ab7796b1df96625c6b8"
+
 
 download_lfs_files () {
     echo "These files must be downloaded manually since there is no git-lfs here:"
@@ -50,3 +54,12 @@ cd llm-model
 git checkout ${LLM_MODEL_COMMIT}
 download_lfs_files $LLM_MODEL_COMMIT
 cd ..
+
+# Downloading cross-encoder model for re-ranking retrieved chunks
+if [ "${DOWNLOAD_RERANKER_MODEL:-1}" = "1" ]; then
+  GIT_LFS_SKIP_SMUDGE=1 git clone ${RERANKER_MODEL_REPO} --branch main reranker-model
+  cd reranker-model
+  git checkout ${RERANKER_MODEL_COMMIT}
+  download_lfs_files $RERANKER_MODEL_COMMIT
+  cd ..
+fi
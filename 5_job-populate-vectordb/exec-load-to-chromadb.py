@@ -14,8 +14,13 @@
 
 import subprocess
 import os
+import sys
 
 venv_python = os.path.expanduser("~/chroma_venv/bin/python")
 script_path = "5_job-populate-vectordb/load-to-chromadb.py"
 
-print(subprocess.run([venv_python, script_path], check=True))
+# With MODEL_HOST=1 the job may be the first to start the shared model host, in this python rather
+# than the chroma venv's, which has the LLM's dependencies
+env = dict(os.environ, MODEL_HOST_PYTHON=os.environ.get("MODEL_HOST_PYTHON", sys.executable))
+
+print(subprocess.run([venv_python, script_path], check=True, env=env))
@@ -14,30 +14,118 @@
 
 # THIS UTILITY PARSES HTMLS TO TEXT FOR PROCESSING BY A VECTOR DATABASE
 # Use html_links.txt to update with your own URLs and run/rerun CML job.
-
-import requests
-from xml.etree import ElementTree as ET
+#
+# Pages are fetched concurrently through one pooled session, with a cap on
+# parallel requests per host and exponential backoff on failures. Responses
+# are cached with their ETag / Last-Modified headers so re-runs send
+# conditional requests and unchanged pages cost a 304 and no re-parse.
+#
+# Only the page's main content is kept (navigation, footers and scripts are
+# dropped) and paragraph / heading boundaries are written as blank lines so
+# the chunker can split on them.
 
 from bs4 import BeautifulSoup
-import re
+import hashlib
+import json
 import os
-import requests
-from requests.exceptions import ConnectionError
-from requests import exceptions
+import random
+import re
+import tempfile
+import unicodedata
+import threading
 import time
-from urllib.parse import urlparse, urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 
 visited_urls = set()
 max_retries = 5
-retry_delay_seconds = 2
+retry_base_delay_seconds = 1
+retry_max_delay_seconds = 30
+
+# Concurrency settings
+crawl_workers = int(os.getenv("CRAWL_WORKERS", "8"))
+per_host_limit = int(os.getenv("CRAWL_PER_HOST", "4"))
+request_timeout_seconds = 30
+
+# Status codes worth retrying, anything else is final
+retryable_status_codes = {429, 500, 502, 503, 504}
+
+# lxml is a C parser and much faster than BeautifulSoup's html.parser, use it when installed
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# Elements that start a new paragraph in the extracted text
+block_tags = ("p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "dt", "dd", "pre", "blockquote", "table", "tr",
+              "div", "section", "article", "header", "figcaption", "br", "hr")
+# Elements that never contain documentation text
+skip_tags = ("script", "style", "noscript", "template", "nav", "footer", "aside", "form", "button", "svg", "iframe")
+
+# Marks a block boundary while the text is being flattened, must be XML safe. It is whitespace to
+# str.split and to \s, so normalize_text must only collapse literal spaces until block_breaks has
+# turned the markers into blank lines
+block_marker = "\u2029"
+
+# One pass character cleanup: whitespace variants become spaces and common
+# typographic characters get ASCII equivalents instead of being dropped
+text_translation = str.maketrans({
+    "\n": " ", "\r": " ", "\t": " ", "\f": " ", "\v": " ", "\xa0": " ", "\u200b": "",
+    "\u2018": "'", "\u2019": "'", "\u201c": '"', "\u201d": '"', "\u2013": "-", "\u2014": "-", "\u2026": "...",
+})
+repeated_spaces = re.compile(r" {2,}")
+block_breaks = re.compile(r" *(?:\u2029 *)+")
 
 # Clean up string
 def remove_non_ascii(s):
-    return "".join(i for i in s if ord(i) < 128)
+    return s.encode("ascii", "ignore").decode("ascii")
+
+def normalize_text(text):
+    """Collapse whitespace, turn block markers into blank lines and strip non-ASCII characters."""
+    text = text.translate(text_translation)
+    text = repeated_spaces.sub(" ", text)
+    text = block_breaks.sub("\n\n", text)
+    # Decompose accented letters so only their accents get stripped (cafe, not caf)
+    return remove_non_ascii(unicodedata.normalize("NFKD", text)).strip()
+
+def extract_main_text_lxml(content):
+    # lxml assumes latin-1 for bytes without a charset declaration, the docs are utf-8
+    if isinstance(content, bytes):
+        try:
+            content = content.decode("utf-8")
+        except UnicodeDecodeError:
+            pass
+    root = lxml.html.fromstring(content)
+    main = next(iter(root.xpath("//main | //*[@role='main']")), None)
+    if main is None:
+        main = next(iter(root.xpath("//article | //body")), root)
+    lxml.etree.strip_elements(main, lxml.etree.Comment, *skip_tags, with_tail=False)
+    for element in main.iter(*block_tags):
+        element.text = block_marker + (element.text or "")
+        element.tail = block_marker + (element.tail or "")
+    return main.text_content()
+
+def extract_main_text_bs4(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    main = soup.find('main') or soup.find(attrs={"role": "main"}) or soup.find('article') or soup.body or soup
+    for element in main.find_all(skip_tags):
+        element.decompose()
+    for element in main.find_all(block_tags):
+        element.insert_before(block_marker)
+        element.insert_after(block_marker)
+    return main.get_text()
 
-def get_tld(url):
-    parsed_url = urlparse(url)
-    return f"{parsed_url.scheme}://{parsed_url.netloc}"
+def extract_main_text(content):
+    """Main content of an HTML page as plain text with blank lines between blocks."""
+    if lxml is not None:
+        try:
+            return normalize_text(extract_main_text_lxml(content))
+        except (ValueError, lxml.etree.ParserError):
+            pass  # Empty or odd documents, let the forgiving parser have a go
+    return normalize_text(extract_main_text_bs4(content))
 
 def create_directory_path_from_url(base_path, url):
     url_parts = url.strip('/').split('/')
@@ -46,30 +134,106 @@ def create_directory_path_from_url(base_path, url):
     file_path = os.path.join(directory_path, file_name)
     return directory_path, file_path
 
-def extract_and_write_text(url, base_path, tld):
-    if url in visited_urls or not url.startswith(tld):
-        return
-    visited_urls.add(url)
-    
+def create_session():
+    """One session for the whole crawl so connections are reused."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=crawl_workers, pool_maxsize=crawl_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = "CML-AMP-LLM-Chatbot/1.0 (+html-to-text)"
+    return session
+
+class HttpCache:
+    """Stores the last response body and validators per URL on disk."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".json"), os.path.join(self.cache_dir, key + ".html")
+
+    def get(self, url):
+        """Returns (validators dict, body bytes) or (None, None)."""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None, None
+
+    def put(self, url, response):
+        meta_path, body_path = self._paths(url)
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        for path, mode, data in ((body_path, "wb", response.content), (meta_path, "w", json.dumps(meta))):
+            with tempfile.NamedTemporaryFile(mode, dir=self.cache_dir, delete=False) as f:
+                f.write(data)
+            os.replace(f.name, path)
+
+class HostLimiter:
+    """Caps concurrent requests per host so one site is never hammered."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+    def __call__(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return self.semaphores[host]
+
+def fetch(session, url, cache, host_limiter):
+    """Fetch url with conditional headers and retries.
+
+    Returns (status, body) where status is "fetched", "not_modified" or "failed".
+    """
+    meta, cached_body = cache.get(url)
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
     for attempt in range(1, max_retries + 1):
         try:
-            # Your API call or any HTTP request
-            response = requests.get(url)
-            
-            # If status code is good (e.g., 200), break the loop
+            with host_limiter(url):
+                response = session.get(url, headers=headers, timeout=request_timeout_seconds)
+
+            if response.status_code == 304 and cached_body is not None:
+                return "not_modified", cached_body
             if response.status_code == 200:
-                break
+                cache.put(url, response)
+                return "fetched", response.content
+            if response.status_code not in retryable_status_codes:
+                print(f"Request for {url} failed with status {response.status_code}, skipping.")
+                return "failed", None
+            reason = f"status {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            reason = f"{type(e).__name__}"
+
+        if attempt == max_retries:
+            break
+        # Exponential backoff with jitter so retries from all workers do not line up
+        delay = min(retry_max_delay_seconds, retry_base_delay_seconds * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+        print(f"Request attempt {attempt} for {url} failed ({reason}). Retrying in {delay:.1f} seconds...")
+        time.sleep(delay)
 
-        except:
-            print(f"Request attempt {attempt} failed with connection error.")
-            
-            # Sleep for a while before retrying
-            print(f"Retrying in {retry_delay_seconds} seconds...")
-            time.sleep(retry_delay_seconds)
-            
-    soup = BeautifulSoup(response.content, 'html.parser')
+    print(f"Giving up on {url} after {max_retries} attempts.")
+    return "failed", None
 
-    main_content = soup.find('main')
+def write_text(content, url, base_path):
+    text = extract_main_text(content)
 
     if url.endswith('.html'):
         url = url[:-5]
@@ -79,10 +243,39 @@ def extract_and_write_text(url, base_path, tld):
     os.makedirs(directory_path, exist_ok=True)
     
     with open(file_path, 'w', encoding='utf-8') as f:
-        soup_text = soup.get_text()
-        soup_text = soup_text.replace('\n', ' ')
-        soup_text = remove_non_ascii(soup_text)
-        f.write(soup_text)
+        f.write(text)
+
+def output_exists(url, base_path):
+    if url.endswith('.html'):
+        url = url[:-5]
+    return os.path.exists(create_directory_path_from_url(base_path, url)[1])
+
+def extract_and_write_text(session, url, base_path, cache, host_limiter):
+    status, content = fetch(session, url, cache, host_limiter)
+    if status == "failed":
+        return status
+    # Unchanged page whose text is already on disk, nothing to parse
+    if status == "not_modified" and output_exists(url, base_path):
+        return status
+    write_text(content, url, base_path)
+    return status
+
+def crawl(urls, data_path, cache_dir):
+    """Fetch urls concurrently and write their text under data_path, returns the count of each fetch status."""
+    session = create_session()
+    cache = HttpCache(cache_dir)
+    host_limiter = HostLimiter(per_host_limit)
+    counts = {"fetched": 0, "not_modified": 0, "failed": 0}
+
+    with ThreadPoolExecutor(max_workers=crawl_workers) as pool:
+        futures = {pool.submit(extract_and_write_text, session, url, data_path, cache, host_limiter): url for url in urls}
+        for future in as_completed(futures):
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"Failed to process {futures[future]}: {e}")
+    return counts
 
 def main():
     base_path = os.getcwd()
@@ -90,12 +283,18 @@ def main():
     if "5_job-populate-vectordb" not in base_path:
         base_path = os.path.join(base_path, "5_job-populate-vectordb")
 
+    urls = []
     with open(base_path + "/html-links.txt", "r") as file:
         for line in file:
             url = line.strip()
-            if url:
-                tld = get_tld(url)
-                extract_and_write_text(url, str(base_path + "/data"), tld)
+            if url and url not in visited_urls:
+                visited_urls.add(url)
+                urls.append(url)
+
+    start = time.perf_counter()
+    counts = crawl(urls, str(base_path + "/data"), os.path.join(base_path, ".http-cache"))
+    print(f"Processed {len(urls)} URLs in {time.perf_counter() - start:.1f}s: "
+          f"{counts['fetched']} fetched, {counts['not_modified']} unchanged, {counts['failed']} failed")
 
 if __name__ == '__main__':
     main()
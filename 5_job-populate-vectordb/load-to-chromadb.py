@@ -12,112 +12,534 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+# Ingestion runs as a pipeline:
+#   worker processes read and chunk files -> the main process embeds chunks in
+#   large batches -> a writer thread bulk inserts them into ChromaDB
+# so chunking, embedding and SQLite writes overlap instead of running one
+# snippet at a time.
+#
+# By default runs are incremental: a manifest of per-file and per-chunk content
+# hashes is kept next to the collection, unchanged files are skipped, only new
+# or changed chunks are embedded and chunks whose source went away are deleted.
+# Set INGEST_MODE=full to re-embed everything.
+#
+# Near-duplicate chunks (navigation, footers and boilerplate repeated across
+# pages) are found with MinHash/LSH (utils/near_dedup.py) before embedding. Only
+# the first of them is embedded and stored; its metadata lists how many copies
+# there are and which other sources they came from.
+#
+# After a run that changed the collection it is exported to the BM25 index and,
+# unless VECTOR_INDEX=0, to the memory mapped exact search index the retrieval
+# service uses with RETRIEVAL_BACKEND=mmap (utils/vector_index.py).
+
+import hashlib
+import json
 import os
+import tempfile
+import queue
+import threading
+import time
+import sys
 import chromadb
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from chromadb.utils import embedding_functions
+
+# utils/ lives in the project root, one level up from this job
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.text_chunker import TextChunker, read_in_blocks
+from utils.lexical_index import build_index
+from utils.near_dedup import MinHasher, NearDuplicateIndex, load_state, save_state
+from utils.vector_index import build_index as build_vector_index, index_meta
 
 # Define the local model path
 EMBEDDING_MODEL_PATH = "/home/cdsw/models/embedding-model"
+os.environ.setdefault("EMBEDDING_MODEL_PATH", EMBEDDING_MODEL_PATH)
 
-# Ensure the path exists
-if not os.path.exists(EMBEDDING_MODEL_PATH):
-    raise FileNotFoundError(f"Embedding model not found at {EMBEDDING_MODEL_PATH}. Please check the path.")
+COLLECTION_NAME = os.getenv('COLLECTION_NAME')
 
-# Initialize the embedding function with the local model
-EMBEDDING_FUNCTION = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL_PATH)
+# Pipeline tuning
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "4096"))
+INGEST_MODE = os.getenv("INGEST_MODE", "incremental")
 
-# Determine base path for ChromaDB storage
-base_path = os.getcwd()
-if "5_job-populate-vectordb" in base_path:
-    chroma_client = chromadb.PersistentClient(path=base_path.replace("5_job-populate-vectordb", "") + "/chroma-data")
-else:
-    chroma_client = chromadb.PersistentClient(path=base_path + "/chroma-data")
-    base_path = os.path.join(base_path, "5_job-populate-vectordb")
+# Chunk size in embedding model tokens (the model truncates at 256) and overlap between chunks
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
 
-COLLECTION_NAME = os.getenv('COLLECTION_NAME')
+# Near-duplicate elimination: chunks whose word 5-shingles overlap a kept chunk's by DEDUP_THRESHOLD (estimated
+# Jaccard similarity) or more are not embedded
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "128"))
+DEDUP_SHINGLE_WORDS = int(os.getenv("DEDUP_SHINGLE_WORDS", "5"))
 
-print("Initializing Chroma DB connection...")
-
-# Retrieve or create collection with the local embedding function
-try:
-    collection = chroma_client.get_collection(name=COLLECTION_NAME, embedding_function=EMBEDDING_FUNCTION)
-    print("Success")
-except:
-    print("Creating new collection...")
-    collection = chroma_client.create_collection(name=COLLECTION_NAME, embedding_function=EMBEDDING_FUNCTION)
-    print("Success")
-
-# Get latest statistics from index
-current_collection_stats = collection.count()
-print(f"Total number of embeddings in Chroma DB index: {current_collection_stats}")
-
-# ** Load original HTML links to reconstruct URLs **
-html_links_file = os.path.join(base_path, "html-links.txt")
-url_mapping = {}
-
-try:
-    with open(html_links_file, "r") as f:
-        for line in f:
-            url = line.strip()
-            if url:
-                file_name = url.split("/")[-1].replace(".html", "")
-                url_mapping[file_name] = url  # Map the doc name to the full URL
-except FileNotFoundError:
-    print(f"⚠️ {html_links_file} not found. Falling back to file names for sources.")
-except Exception as e:
-    print(f"⚠️ Error reading {html_links_file}: {e}. Falling back to file names for sources.")
+# Export to the memory mapped vector index, stored as float32, float16 or int8
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "1") == "1"
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32")
 
 # ** Function to split documents intelligently **
 def split_text_smart(text, max_length=1000):
-    """Split text at the nearest period before max_length to avoid cutting sentences."""
-    chunks = []
-    snippet_number = 1
-    
-    while len(text) > max_length:
-        split_index = text[:max_length].rfind(".")
-        if split_index == -1:  
-            split_index = max_length  
-
-        chunks.append((text[:split_index + 1], snippet_number))
-        text = text[split_index + 1:].strip()
-        snippet_number += 1
-    
-    if text:  
-        chunks.append((text, snippet_number))
-    
-    return chunks
-
-# ** Insert document chunks into ChromaDB with metadata **
-def upsert_document(collection, doc_name, text_chunks, file_path):
-    """Insert split document chunks into ChromaDB with snippet metadata."""
-    base_filename = Path(file_path).stem  # Extract filename without extension
-    source_url = url_mapping.get(base_filename, base_filename)  # Use URL if available, otherwise fallback to filename
-
-    for chunk_text, snippet_number in text_chunks:
-        doc_id = f"{base_filename}-{snippet_number}"  # Unique ID per snippet
-
-        metadata = {
-            "Source": source_url,
-            "Snippet": snippet_number,
-            "Classification": "public"
-        }
-
-        collection.add(documents=[chunk_text], metadatas=[metadata], ids=[doc_id])
-        print(f"Added {doc_id} to ChromaDB.")
-
-# ** Process and insert documents **
-doc_dir = os.path.join(base_path, 'data')
-for file in Path(doc_dir).glob(f'**/*.txt'):
-    print(f"Processing file: {file}")
-
-    with open(file, "r", encoding="utf-8") as f:
-        text = f.read()
-
-        # Split large documents
-        text_chunks = split_text_smart(text)
-
-        # Insert into ChromaDB
-        upsert_document(collection, file.stem, text_chunks, str(file))
-
-print("Finished loading Knowledge Base embeddings into Chroma DB.")
+    """Split text at sentence ends into chunks of at most max_length characters."""
+    chunker = TextChunker(max_tokens=max_length, overlap_tokens=0)
+    return [(chunk.text, snippet_number) for snippet_number, chunk in enumerate(chunker.chunks(text), start=1)]
+
+# One chunker per worker process, token lengths are measured with the embedding model's tokenizer
+_chunker = None
+
+def get_chunker():
+    global _chunker
+    if _chunker is None:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_PATH)
+        # Leave room for the [CLS] and [SEP] tokens the model adds
+        _chunker = TextChunker(tokenizer, max_tokens=CHUNK_TOKENS - 2, overlap_tokens=CHUNK_OVERLAP_TOKENS)
+    return _chunker
+
+# One MinHash signer per worker process
+_hasher = None
+
+def get_hasher():
+    global _hasher
+    if _hasher is None:
+        _hasher = MinHasher(num_perm=DEDUP_NUM_PERM, shingle_words=DEDUP_SHINGLE_WORDS)
+    return _hasher
+
+def source_for(relative_path, url_mapping):
+    """URL of the page a file in data/ was made from, or its name when the URL is unknown."""
+    if relative_path in url_mapping:
+        return url_mapping[relative_path]
+    base_filename = Path(relative_path).stem  # Extract filename without extension
+    return url_mapping.get(base_filename, base_filename)  # Use URL if available, otherwise fallback to filename
+
+def chunk_id_prefix(relative_path):
+    """Chunk ids start with the file's path in data/, file names repeat across the folders html-to-text.py writes."""
+    return Path(relative_path).with_suffix("").as_posix()
+
+def load_url_mapping(base_path):
+    """Load original HTML links to reconstruct URLs."""
+    html_links_file = os.path.join(base_path, "html-links.txt")
+    url_mapping = {}
+
+    try:
+        with open(html_links_file, "r") as f:
+            for line in f:
+                url = line.strip()
+                if url:
+                    file_name = url.split("/")[-1].replace(".html", "")
+                    url_mapping[file_name] = url  # Map the doc name to the full URL
+                    # and the path html-to-text.py writes the page to, which is unique
+                    url_mapping[os.path.join(*url.strip("/").split("/")) + ".txt"] = url
+    except FileNotFoundError:
+        print(f"⚠️ {html_links_file} not found. Falling back to file names for sources.")
+    except Exception as e:
+        print(f"⚠️ Error reading {html_links_file}: {e}. Falling back to file names for sources.")
+
+    return url_mapping
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+# ** Manifest of what is already in the collection **
+def manifest_path(chroma_path):
+    return os.path.join(chroma_path, f"ingest-manifest-{COLLECTION_NAME}.json")
+
+def chunking_settings():
+    return {"chunker": "tokens", "chunk_tokens": CHUNK_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+            "ids": "relative path"}
+
+def load_manifest(path):
+    """Returns {relative file path: {"sha256": file hash, "source": source URL, "chunks": {doc id: chunk hash}}}."""
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+        # Every chunk changes when the chunking settings do
+        if manifest.get("chunking") != chunking_settings():
+            print(f"Chunking settings changed since the last run ({manifest.get('chunking')}). Re-indexing everything.")
+            return None
+        return manifest["files"]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ Could not read manifest {path}: {e}. Re-indexing everything.")
+        return None
+
+def save_manifest(path, files):
+    # Write to a temp file first so an interrupted job never leaves a truncated manifest
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), delete=False) as f:
+        json.dump({"collection": COLLECTION_NAME, "chunking": chunking_settings(), "files": files}, f)
+    os.replace(f.name, path)
+
+# ** Near-duplicate state: every chunk's signature and which kept chunk each duplicate maps to **
+def dedup_state_path(chroma_path):
+    return os.path.join(chroma_path, f"dedup-{COLLECTION_NAME}.npz")
+
+def dedup_settings():
+    return {"threshold": DEDUP_THRESHOLD, "num_perm": DEDUP_NUM_PERM, "shingle_words": DEDUP_SHINGLE_WORDS}
+
+def provenance_metadata(duplicate_ids, own_source, source_of):
+    """Metadata fields a kept chunk gets for its near-duplicates, None values remove them."""
+    if not duplicate_ids:
+        return {"Duplicates": None, "Also in": None}
+    also_in = sorted({source_of[d] for d in duplicate_ids} - {own_source})
+    return {"Duplicates": len(duplicate_ids), "Also in": " ".join(also_in) if also_in else None}
+
+# ** Indexes exported from the collection: BM25 for hybrid retrieval, vectors for the mmap backend **
+def collection_pages(collection, include, page_size):
+    """Every row of the collection, a page of at most page_size rows at a time."""
+    offset = 0
+    while True:
+        page = collection.get(include=include, limit=page_size, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+def lexical_index_path(chroma_path):
+    return os.path.join(chroma_path, f"bm25-{COLLECTION_NAME}")
+
+def build_lexical_index(collection, chroma_path, page_size):
+    """Rebuild the BM25 index from every chunk in the collection."""
+    start = time.perf_counter()
+
+    def documents():
+        for page in collection_pages(collection, ["documents"], page_size):
+            yield from zip(page["ids"], page["documents"])
+
+    stats = build_index(documents(), lexical_index_path(chroma_path))
+    print(f"Built BM25 index of {stats['documents']} chunks, {stats['terms']} terms, "
+          f"{stats['postings']} postings in {time.perf_counter() - start:.1f}s")
+
+def vector_index_path(chroma_path):
+    return os.path.join(chroma_path, f"vectors-{COLLECTION_NAME}")
+
+def export_vector_index(collection, chroma_path, page_size):
+    """Rewrite the memory mapped vector index from every chunk in the collection."""
+    start = time.perf_counter()
+    # Distances are reported in the collection's metric, Chroma defaults to squared L2
+    metric = (collection.metadata or {}).get("hnsw:space", "l2")
+
+    def rows():
+        for page in collection_pages(collection, ["embeddings", "documents", "metadatas"], page_size):
+            yield from zip(page["ids"], page["embeddings"], page["documents"], page["metadatas"])
+
+    stats = build_vector_index(rows(), vector_index_path(chroma_path), VECTOR_INDEX_DTYPE, metric)
+    print(f"Exported {stats['count']} {stats['dim']}-dimensional {stats['dtype']} vectors "
+          f"({stats['bytes'] / 1e6:.1f} MB) in {time.perf_counter() - start:.1f}s")
+
+# ** Read and split one document into ChromaDB rows, runs in a worker process **
+def read_and_chunk(file_path, relative_path, url_mapping, known_hash=None):
+    """Return (file hash, ids, documents, metadatas, chunk hashes, signatures) for every snippet of file_path.
+
+    relative_path is the file's path in data/. When the file content still matches known_hash
+    it is not chunked and ids is None. signatures are the chunks' MinHash signatures, None when
+    near-duplicate elimination is off.
+    """
+    id_prefix = chunk_id_prefix(relative_path)
+    source_url = source_for(relative_path, url_mapping)
+
+    # Hash and chunk in blocks so very large files never have to fit in memory at once
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            file_hash.update(block)
+    file_hash = file_hash.hexdigest()
+    if file_hash == known_hash:
+        return file_hash, None, None, None, None, None
+
+    ids, documents, metadatas, chunk_hashes = [], [], [], []
+    with open(file_path, "r", encoding="utf-8") as f:
+        chunks = get_chunker().chunks(read_in_blocks(f))
+        for snippet_number, chunk in enumerate(chunks, start=1):
+            ids.append(f"{id_prefix}-{snippet_number}")  # Unique ID per snippet
+            documents.append(chunk.text)
+            metadatas.append({
+                "Source": source_url,
+                "Snippet": snippet_number,
+                "Classification": "public"
+            })
+            chunk_hashes.append(content_hash(source_url + "\0" + chunk.text))
+    signatures = [get_hasher().signature(document) for document in documents] if DEDUP_ENABLED else None
+    return file_hash, ids, documents, metadatas, chunk_hashes, signatures
+
+class Progress:
+    """Prints files, chunks/s and embeddings/s as the pipeline advances."""
+
+    def __init__(self, total_files):
+        self.total_files = total_files
+        self.files = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.written = 0
+        self.skipped_files = 0
+        self.unchanged_chunks = 0
+        self.duplicates = 0
+        self.written_ids = []
+        self.embed_seconds = 0.0
+        self.start = time.perf_counter()
+
+    def report(self, label=""):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        print(f"{label}files {self.files}/{self.total_files} | chunks {self.chunks} ({self.chunks / elapsed:.1f}/s) | "
+              f"embedded {self.embedded} ({self.embedded / max(self.embed_seconds, 1e-9):.1f}/s) | "
+              f"written {self.written} | near-duplicates {self.duplicates} | "
+              f"unchanged files {self.skipped_files}, chunks {self.unchanged_chunks} | "
+              f"{elapsed:.1f}s", flush=True)
+
+# ** Bulk writer, inserts batches into ChromaDB while the next batch is embedded **
+def start_writer(collection, write_queue, progress, errors):
+    def run():
+        while True:
+            batch = write_queue.get()
+            if batch is None:
+                return
+            ids, documents, metadatas, embeddings = batch
+            try:
+                # upsert, so re-runs replace chunks instead of colliding with existing ids
+                collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+                progress.written += len(ids)
+                progress.written_ids.extend(ids)
+            except Exception as e:
+                errors.append(e)
+                print(f"⚠️ Failed to write {len(ids)} chunks starting at {ids[0]}: {e}")
+
+    writer = threading.Thread(target=run, name="chroma-writer", daemon=True)
+    writer.start()
+    return writer
+
+def main():
+    # Ensure the path exists
+    if not os.path.exists(EMBEDDING_MODEL_PATH):
+        raise FileNotFoundError(f"Embedding model not found at {EMBEDDING_MODEL_PATH}. Please check the path.")
+
+    # Chunks are embedded with the batch embedding API, the same path the retrieval service uses for questions
+    # (through the node's shared model host with MODEL_HOST=1). Chroma is always given the embeddings, so the
+    # collection has no embedding function of its own and does not load a second copy of the model.
+    import utils.model_embedding_utils as model_embedding
+
+    # Determine base path for ChromaDB storage
+    base_path = os.getcwd()
+    if "5_job-populate-vectordb" in base_path:
+        chroma_path = base_path.replace("5_job-populate-vectordb", "") + "/chroma-data"
+    else:
+        chroma_path = base_path + "/chroma-data"
+        base_path = os.path.join(base_path, "5_job-populate-vectordb")
+    chroma_client = chromadb.PersistentClient(path=chroma_path)
+
+    print("Initializing Chroma DB connection...")
+
+    # Retrieve or create collection
+    try:
+        collection = chroma_client.get_collection(name=COLLECTION_NAME, embedding_function=None)
+        print("Success")
+    except:
+        print("Creating new collection...")
+        collection = chroma_client.create_collection(name=COLLECTION_NAME, embedding_function=None)
+        print("Success")
+
+    # Get latest statistics from index
+    current_collection_stats = collection.count()
+    print(f"Total number of embeddings in Chroma DB index: {current_collection_stats}")
+
+    # Chroma rejects inserts above its own maximum batch size
+    max_batch_size = getattr(chroma_client, "max_batch_size", None) or chroma_client.get_max_batch_size()
+    write_batch_size = min(WRITE_BATCH_SIZE, max_batch_size)
+
+    url_mapping = load_url_mapping(base_path)
+
+    # ** Work out what changed since the last run **
+    manifest_file = manifest_path(chroma_path)
+    manifest = load_manifest(manifest_file) if INGEST_MODE == "incremental" else None
+    if manifest is None:
+        print(f"Running a full index ({'INGEST_MODE=' + INGEST_MODE if INGEST_MODE != 'incremental' else 'no manifest yet'})")
+        manifest = {}
+        # Without a manifest we cannot tell which existing rows are ours, collect them all
+        stale_ids = set(collection.get(include=[])["ids"]) if current_collection_stats else set()
+        full_index = True
+    else:
+        stale_ids = set()
+        full_index = False
+
+    # ** Process and insert documents **
+    doc_dir = os.path.join(base_path, 'data')
+    files = sorted(str(file) for file in Path(doc_dir).glob(f'**/*.txt'))
+    relative_paths = [os.path.relpath(file, doc_dir) for file in files]
+    sources = [source_for(path, url_mapping) for path in relative_paths]
+    # A file is re-chunked when its content or its URL in html-links.txt changed, the URL is in every chunk's metadata
+    known_hashes = [None if full_index or manifest.get(path, {}).get("source") != source
+                    else manifest[path].get("sha256") for path, source in zip(relative_paths, sources)]
+
+    # ** Near-duplicate state from the last run **
+    dedup_file = dedup_state_path(chroma_path)
+    state = load_state(dedup_file)
+    settings, signatures, previous_canonical = state if state is not None else (None, {}, {})
+    if settings is not None and settings != dedup_settings():
+        print(f"Near-duplicate settings changed since the last run ({settings}). Re-checking every chunk.")
+        signatures = {}
+    # previous_canonical maps the chunks that were not stored last time to the chunk kept in their place
+    dedup = NearDuplicateIndex(DEDUP_THRESHOLD, DEDUP_NUM_PERM) if DEDUP_ENABLED else None
+    canonical = {}
+    for i, path in enumerate(relative_paths):
+        chunk_ids = manifest.get(path, {}).get("chunks", {})
+        # Unchanged files are checked with their stored signatures, re-chunk the ones without
+        if known_hashes[i] is not None and any(doc_id not in signatures if DEDUP_ENABLED else doc_id in previous_canonical
+                                               for doc_id in chunk_ids):
+            known_hashes[i] = None
+
+    # Files that disappeared take all of their chunks with them
+    for path in set(manifest) - set(relative_paths):
+        stale_ids.update(manifest.pop(path)["chunks"])
+
+    print(f"Processing {len(files)} files with {INGEST_WORKERS} workers, "
+          f"embedding batch {EMBED_BATCH_SIZE}, write batch {write_batch_size}")
+
+    progress = Progress(len(files))
+    write_queue = queue.Queue(maxsize=2)  # Bounded so embedding never runs far ahead of the writes
+    errors = []
+    writer = start_writer(collection, write_queue, progress, errors)
+
+    pending_ids, pending_documents, pending_metadatas = [], [], []
+    # Unchanged files with chunks that were near-duplicates last time and are kept now, {file index: chunk ids}
+    promoted = {}
+
+    def flush():
+        start = time.perf_counter()
+        embeddings = model_embedding.get_embeddings_batch(pending_documents, batch_size=EMBED_BATCH_SIZE)
+        progress.embed_seconds += time.perf_counter() - start
+        progress.embedded += len(embeddings)
+        write_queue.put((list(pending_ids), list(pending_documents), list(pending_metadatas), embeddings))
+        pending_ids.clear()
+        pending_documents.clear()
+        pending_metadatas.clear()
+        progress.report()
+
+    def add(doc_id, document, metadata):
+        progress.chunks += 1
+        pending_ids.append(doc_id)
+        pending_documents.append(document)
+        pending_metadatas.append(metadata)
+        if len(pending_ids) >= write_batch_size:
+            flush()
+
+    def duplicate_of(doc_id, signature):
+        """The kept chunk doc_id duplicates, None when it is kept. Chunks are checked in file order."""
+        if dedup is None:
+            return None
+        kept = dedup.check(doc_id, signature)
+        if kept is not None:
+            canonical[doc_id] = kept
+            progress.duplicates += 1
+        return kept
+
+    with ProcessPoolExecutor(max_workers=INGEST_WORKERS) as pool:
+        results = pool.map(read_and_chunk, files, relative_paths, [url_mapping] * len(files), known_hashes,
+                           chunksize=8)
+        for i, (path, (file_hash, ids, documents, metadatas, chunk_hashes, chunk_signatures)) in \
+                enumerate(zip(relative_paths, results)):
+            progress.files += 1
+            if ids is None:
+                progress.skipped_files += 1
+                for doc_id in manifest[path]["chunks"]:
+                    kept = duplicate_of(doc_id, signatures[doc_id][0]) if dedup is not None else None
+                    if kept is not None and doc_id not in previous_canonical:
+                        # Stored last time, now a copy of a chunk earlier in the knowledge base
+                        stale_ids.add(doc_id)
+                    elif kept is None and doc_id in previous_canonical:
+                        promoted.setdefault(i, set()).add(doc_id)
+                continue
+
+            previous_chunks = manifest.get(path, {}).get("chunks", {})
+            new_chunks = dict(zip(ids, chunk_hashes))
+            manifest[path] = {"sha256": file_hash, "source": sources[i], "chunks": new_chunks}
+            # Chunks beyond the new end of a file that shrank
+            stale_ids.update(set(previous_chunks) - set(new_chunks))
+
+            for n, (doc_id, document, metadata, chunk_hash) in enumerate(zip(ids, documents, metadatas, chunk_hashes)):
+                if chunk_signatures is not None:
+                    signatures[doc_id] = (chunk_signatures[n], len(document.encode("utf-8")))
+                if duplicate_of(doc_id, signatures[doc_id][0] if chunk_signatures is not None else None) is not None:
+                    # Not embedded; a stored copy from an earlier run is deleted
+                    if doc_id in previous_chunks and doc_id not in previous_canonical:
+                        stale_ids.add(doc_id)
+                    continue
+                stale_ids.discard(doc_id)
+                if previous_chunks.get(doc_id) == chunk_hash and doc_id not in previous_canonical:
+                    progress.unchanged_chunks += 1
+                    continue
+                add(doc_id, document, metadata)
+
+        # Chunks of unchanged files that were left out last time and are kept now need their text again
+        if promoted:
+            print(f"Re-reading {len(promoted)} unchanged files for {sum(map(len, promoted.values()))} chunks "
+                  f"that are no longer near-duplicates")
+            reread = sorted(promoted)
+            results = pool.map(read_and_chunk, [files[i] for i in reread], [relative_paths[i] for i in reread],
+                               [url_mapping] * len(reread))
+            for i, (_, ids, documents, metadatas, _, _) in zip(reread, results):
+                for doc_id, document, metadata in zip(ids, documents, metadatas):
+                    if doc_id in promoted[i]:
+                        add(doc_id, document, metadata)
+
+    if pending_ids:
+        flush()
+
+    write_queue.put(None)
+    writer.join()
+
+    if stale_ids:
+        stale_ids = sorted(stale_ids)
+        for start in range(0, len(stale_ids), write_batch_size):
+            collection.delete(ids=stale_ids[start:start + write_batch_size])
+        print(f"Deleted {len(stale_ids)} chunks whose source text is gone")
+
+    progress.report("Done: ")
+
+    if errors:
+        # Leave the manifest alone so the next run retries the failed chunks
+        raise RuntimeError(f"{len(errors)} batches failed to load into Chroma DB")
+
+    # ** Provenance: kept chunks list how many near-duplicates they stand for and where those came from **
+    source_of = {doc_id: source_for(path, url_mapping)
+                 for path, entry in manifest.items() for doc_id in entry["chunks"]}
+    old_groups, new_groups = {}, {}
+    for groups, mapping in ((old_groups, previous_canonical), (new_groups, canonical)):
+        for duplicate, kept in mapping.items():
+            groups.setdefault(kept, set()).add(duplicate)
+    written = set(progress.written_ids)
+    # Upserts merge metadata, so rewritten chunks are updated as well as the ones whose group changed
+    changed = sorted(kept for kept in set(old_groups) | set(new_groups) if kept in source_of and kept not in canonical
+                     and (old_groups.get(kept) != new_groups.get(kept) or (kept in written and kept in new_groups)))
+    for start in range(0, len(changed), write_batch_size):
+        batch = changed[start:start + write_batch_size]
+        collection.update(ids=batch, metadatas=[provenance_metadata(new_groups.get(kept), source_of[kept], source_of)
+                                                for kept in batch])
+    if changed:
+        print(f"Updated the near-duplicate provenance of {len(changed)} chunks")
+
+    if dedup is not None:
+        total = sum(len(entry["chunks"]) for entry in manifest.values())
+        saved_bytes = sum(signatures[doc_id][1] for doc_id in canonical)
+        # Chroma stores every embedding as float32
+        dim = model_embedding.config.hidden_size
+        print(f"Near-duplicates: {len(canonical)} of {total} chunks ({len(canonical) / max(total, 1):.1%}) are not "
+              f"stored, saving {len(canonical)} embeddings ({len(canonical) * dim * 4 / 1e6:.2f} MB of vectors) and "
+              f"{saved_bytes / 1e6:.2f} MB of text")
+        save_state(dedup_file, dedup_settings(),
+                   {doc_id: signatures[doc_id] for entry in manifest.values() for doc_id in entry["chunks"]}, canonical)
+    elif os.path.exists(dedup_file):
+        os.remove(dedup_file)
+    save_manifest(manifest_file, manifest)
+
+    if progress.written or stale_ids or changed or not os.path.exists(lexical_index_path(chroma_path)):
+        build_lexical_index(collection, chroma_path, write_batch_size)
+    if VECTOR_INDEX and (progress.written or stale_ids or changed or
+                         (index_meta(vector_index_path(chroma_path)) or {}).get("dtype") != VECTOR_INDEX_DTYPE):
+        export_vector_index(collection, chroma_path, write_batch_size)
+
+    print(f"Total number of embeddings in Chroma DB index: {collection.count()}")
+    print("Finished loading Knowledge Base embeddings into Chroma DB.")
+
+if __name__ == "__main__":
+    main()
@@ -15,13 +15,22 @@
 import os
 import gradio
 import utils.model_llm_utils as model_llm
+from utils.answer_cache import AnswerCache
 
+# Question embeddings for the semantic cache tier, the embedding model is only
+# loaded the first time a question gets embedded
+def embed_question(question):
+    import utils.model_embedding_utils as model_embedding
+    return model_embedding.get_embeddings(question)
+
+# Repeated questions (like the examples below) are answered from the cache
+answer_cache = AnswerCache.from_env(embed_fn=embed_question)
 
 def main():
     # Configure gradio QA app 
     print("Configuring gradio app")
     demo = gradio.Interface(
-        fn=get_responses,
+        fn=stream_responses,
         inputs=gradio.Textbox(label="Question", placeholder="Enter your question here"),
         outputs=gradio.Textbox(label="LLM Response"),
         examples=[
@@ -48,32 +57,72 @@ def main():
 def get_responses(question):
     # Create a prompt directly based on the user input
     prompt = create_prompt(question)
+
+    cached, embedding = lookup_cached_response(prompt, question)
+    if cached is not None:
+        return cached
     
     # Generate response using the LLM model
     response = get_llm_response(prompt)
+
+    if answer_cache is not None:
+        answer_cache.put(response, prompt=prompt, params=GENERATION_PARAMS, embedding=embedding)
     
     return response
 
+# Generator version of get_responses, gradio shows each partial answer as it grows
+def stream_responses(question):
+    prompt = create_prompt(question)
+
+    cached, embedding = lookup_cached_response(prompt, question)
+    if cached is not None:
+        yield cached
+        return
+
+    if not model_llm.is_ready():
+        yield "The model is still loading, your answer will start as soon as it is ready..."
+
+    response = ""
+    for text in stream_llm_response(prompt):
+        response += text
+        yield response
+
+    if answer_cache is not None:
+        answer_cache.put(response, prompt=prompt, params=GENERATION_PARAMS, embedding=embedding)
+
+# Exact match on the prompt first, then the nearest cached question
+def lookup_cached_response(prompt, question):
+    if answer_cache is None:
+        return None, None
+    try:
+        return answer_cache.lookup(question, prompt=prompt, params=GENERATION_PARAMS)
+    except Exception as e:
+        print(f"Answer cache lookup skipped: {str(e)}")
+        return None, None
+
 def create_prompt(question):
     prompt_template = """<human>: %s
 <bot>:"""
     return prompt_template % question
 
+STOP_WORDS = ['<human>:', '\n<bot>:']
+GENERATION_PARAMS = dict(
+    max_new_tokens=256,
+    do_sample=False,
+    temperature=0.7,
+    top_p=0.85,
+    top_k=70,
+    repetition_penalty=1.07
+)
+
 # Pass through user input to LLM model with enhanced prompt and stop tokens
 def get_llm_response(prompt):
-    stop_words = ['<human>:', '\n<bot>:']
-
-    generated_text = model_llm.get_llm_generation(
-        prompt,
-        stop_words,
-        max_new_tokens=256,
-        do_sample=False,
-        temperature=0.7,
-        top_p=0.85,
-        top_k=70,
-        repetition_penalty=1.07
-    )
+    generated_text = model_llm.get_llm_generation(prompt, STOP_WORDS, **GENERATION_PARAMS)
     return generated_text
 
+# Streaming variant of get_llm_response, yields text pieces as they are generated
+def stream_llm_response(prompt):
+    return model_llm.stream_llm_generation(prompt, STOP_WORDS, **GENERATION_PARAMS)
+
 if __name__ == "__main__":
     main()
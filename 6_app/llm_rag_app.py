@@ -12,8 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from flask import Flask, render_template, request
-import subprocess
+from flask import Flask, Response, render_template, request, stream_with_context
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 import json
 import os
 import sys
@@ -23,60 +24,147 @@ import logging
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
-# Flask app initialization
-app = Flask(__name__, template_folder="6_app/templates", static_folder="6_app/static")
+# Flask app initialization. Paths are relative to the project root the app is started from,
+# also when it is launched as a script (python 6_app/llm_rag_app.py)
+app = Flask(__name__, root_path=os.getcwd(), template_folder="6_app/templates", static_folder="6_app/static")
 
 # Add necessary paths for the LLM model
 VENV_PATH = "/home/cdsw/chroma_venv"
 VENV_SITE_PACKAGES = os.path.join(VENV_PATH, "lib", "python3.x", "site-packages")
 sys.path.insert(0, VENV_SITE_PACKAGES)
 
+# With MODEL_HOST=1 the retrieval service may be the first to start the shared model host, in this
+# python rather than the chroma venv's, which has the LLM's dependencies
+os.environ.setdefault("MODEL_HOST_PYTHON", sys.executable)
+
 import utils.model_llm_utils as model_llm
+from utils import metrics, serving
+from utils.ipc import ServiceClient, IPCError
+from utils.serving import AdmissionController, DeadlineExceeded, Overloaded, RequestCancelled
+from utils.answer_cache import AnswerCache
+from utils.context_packer import pack_context
 
-def query_vector_db(question):
-    """Executes query_chroma_app.py and processes the response."""
-    try:
-        venv_python = "/home/cdsw/chroma_venv/bin/python"
-        script_path = "6_app/query_chroma_app.py"
+# Number of chunks retrieved per question, packed into the prompt as far as they fit
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "5"))
+RETRIEVAL_POOL_SIZE = int(os.getenv("RETRIEVAL_POOL_SIZE", "4"))
 
-        print(f"🔧 Executing ChromaDB query for: {question}")
+# "production" serves with waitress (see utils/serving.py), "development" with Flask's own server
+SERVING_MODE = os.getenv("SERVING_MODE", "development")
 
-        result = subprocess.run(
-            [venv_python, script_path, question],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=120,
-        )
+# Long-lived retrieval worker running query_chroma_app.py in the chroma venv.
+# It keeps the embedding model and collection warm between questions and is
+# restarted automatically if it crashes.
+retrieval_service = ServiceClient(
+    command=[os.getenv("CHROMA_VENV_PYTHON", "/home/cdsw/chroma_venv/bin/python"), "6_app/query_chroma_app.py", "--serve",
+             os.getenv("RETRIEVAL_SOCKET", "/tmp/chroma-retrieval.sock")],
+    socket_path=os.getenv("RETRIEVAL_SOCKET", "/tmp/chroma-retrieval.sock"),
+    name="ChromaDB retrieval service",
+    pool_size=RETRIEVAL_POOL_SIZE,
+    timeout=120,
+    log_path=os.getenv("RETRIEVAL_LOG", "/tmp/chroma-retrieval.log"),
+)
 
-        stdout = result.stdout.strip()
-        stderr = result.stderr.strip()
+# Calls to the retrieval service block, they run here so a question can stop waiting
+# for them at its deadline or when its client disconnects
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_POOL_SIZE, thread_name_prefix="retrieval")
 
-        # print(f"Subprocess stdout:\n{stdout}")
-        # if stderr:
-        #     print(f"⚠️ Subprocess stderr:\n{stderr}")
+# Bounds the questions answered at once (SERVING_MAX_ACTIVE) and waiting for a slot (SERVING_MAX_WAITING),
+# beyond that questions get a 503 right away. Each question has SERVING_REQUEST_TIMEOUT seconds.
+admission = AdmissionController.from_env()
 
-        if not stdout:
-            return None, "No response received from ChromaDB."
+def admission_active():
+    return admission.stats()["active"]
 
-        try:
-            json_output = json.loads(stdout)
-        except json.JSONDecodeError as e:
-            # print(f"Raw stdout:\n{stdout}")
-            return None, f"Invalid JSON response from ChromaDB: {str(e)}"
+def admission_waiting():
+    return admission.stats()["waiting"]
+
+def admission_stopped():
+    stats = admission.stats()
+    return {(reason,): stats[reason] for reason in ("queue_full", "queue_timeout", "deadline", "cancelled")}
+
+metrics.callback("rag_admission_active", "Questions being answered", "gauge", admission_active)
+metrics.callback("rag_admission_waiting", "Questions waiting for a slot", "gauge", admission_waiting)
+metrics.callback("rag_admission_stopped_total",
+                 "Questions refused (queue_full, queue_timeout) or stopped early (deadline, cancelled)", "counter",
+                 admission_stopped, ("reason",))
+
+def query_vector_db(question):
+    """Queries the retrieval service and packs the best chunks into the prompt's token budget."""
+    try:
+        print(f"{metrics.trace_prefix()}🔧 Executing ChromaDB query for: {question}")
+
+        with metrics.stage("retrieval"):
+            json_output = retrieval_service.request({"op": "query", "question": question, "n_results": RETRIEVAL_TOP_K})
+        # Stages inside the retrieval service: embedding, vector_search, lexical_search, fusion, rerank
+        for stage, seconds in (json_output.get("timings") or {}).items():
+            metrics.record_stage(stage, seconds)
 
         if "error" in json_output:
             return None, json_output["error"]
+        if answer_cache is not None:
+            # Answers built from an older version of the knowledge base are stale
+            answer_cache.check_version(json_output.get("collection_version"))
+
+        candidates = json_output.get("candidates") or []
+        if not candidates:
+            return None, "No matching documents found."
 
-        return json_output.get("context"), json_output.get("metadata")
+        with metrics.stage("context_pack"):
+            budget = context_token_budget(question)
+            if budget <= 0:
+                return None, QUESTION_TOO_LONG
+            context, selected, used_tokens = pack_context(candidates, model_llm.encode, model_llm.decode, budget)
+        metadata = {"Sources": [c["metadata"] for c in selected], "Context tokens": used_tokens}
+        return context, metadata
 
-    except subprocess.TimeoutExpired:
-        return None, "ChromaDB query timed out after 120 seconds."
-    except subprocess.CalledProcessError as e:
-        return None, f"ChromaDB process failed: {e.stderr.strip()}"
+    except IPCError as e:
+        return None, f"ChromaDB query failed: {str(e)}"
     except Exception as e:
         return None, f"Unexpected error: {str(e)}"
 
+QUESTION_TOO_LONG = "The question is too long to answer from the knowledge base, please shorten it."
+
+def context_token_budget(question):
+    """Tokens left for retrieved context once the template, question and answer are accounted for."""
+    template_tokens = len(model_llm.encode(create_prompt(" ", question)))
+    return model_llm.max_context_tokens - GENERATION_PARAMS["max_new_tokens"] - template_tokens
+
+def embed_question(question):
+    """Embeds the question with the retrieval service's warm embedding model."""
+    json_output = retrieval_service.request({"op": "embed", "texts": [question]})
+    if "error" in json_output:
+        raise IPCError(json_output["error"])
+    return json_output["embeddings"][0]
+
+# Repeated questions are answered from the cache, skipping retrieval and generation
+answer_cache = AnswerCache.from_env(embed_fn=embed_question)
+
+def answer_cache_lookups():
+    if answer_cache is None:
+        return None
+    stats = answer_cache.stats()
+    return {(tier, result): counts[tier] for result, counts in (("hit", stats["hits"]), ("miss", stats["misses"]))
+            for tier in counts}
+
+metrics.callback("rag_answer_cache_lookups_total", "Answer cache lookups by tier and result", "counter",
+                 answer_cache_lookups, ("tier", "result"))
+
+def lookup_cached_answer(question, use_chroma):
+    """Returns (cached answer or None, question embedding) for the semantic cache tier."""
+    if answer_cache is None:
+        return None, None
+    try:
+        if use_chroma:
+            # Answers built from an older version of the knowledge base are stale
+            answer_cache.check_version(retrieval_service.request({"op": "version"}).get("collection_version"))
+        return answer_cache.lookup(question, params=cache_params(use_chroma))
+    except Exception as e:
+        print(f"⚠️ Answer cache lookup skipped: {str(e)}")
+        return None, None
+
+def cache_params(use_chroma):
+    return dict(GENERATION_PARAMS, use_chroma=use_chroma)
+
 def create_prompt(context, question):
     """Formats the prompt for LLM generation."""
     if context:
@@ -86,28 +174,116 @@ def create_prompt(context, question):
         prompt_template = """<human>: Question: %s\n<bot>:"""
         return prompt_template % question
 
-def get_llm_response(prompt):
-    """Generates response using the LLM."""
-    stop_words = ['<human>:', '\n<bot>:']
-    generated_text = model_llm.get_llm_generation(
-        prompt,
-        stop_words,
-        max_new_tokens=512,
-        do_sample=True,
-        temperature=0.7,
-        top_p=0.85,
-        top_k=70,
-        repetition_penalty=1.07
-    )
+def create_cache_prefix(context):
+    """The start of the prompt follow-up questions about the same context share, the LLM's prefix cache keeps it."""
+    return """<human>: Answer this question based on given context: %s""" % context if context else None
+
+# Generation settings shared by the blocking and the streaming routes
+STOP_WORDS = ['<human>:', '\n<bot>:']
+GENERATION_PARAMS = dict(
+    max_new_tokens=512,
+    do_sample=True,
+    temperature=0.7,
+    top_p=0.85,
+    top_k=70,
+    repetition_penalty=1.07
+)
+
+def get_llm_response(prompt, ticket, cache_prefix=None):
+    """Generates response using the LLM, stops at the question's deadline or when its client disconnects."""
+    generated_text = model_llm.get_llm_generation(prompt, STOP_WORDS, deadline=ticket.deadline,
+                                                  is_cancelled=ticket.disconnected, cache_prefix=cache_prefix,
+                                                  **GENERATION_PARAMS)
     return generated_text
 
-def format_metadata(metadata):
-    """Format metadata for better readability in the UI."""
-    if metadata and "Source" in metadata:
+def stream_llm_response(prompt, ticket, cache_prefix=None):
+    """Yields the LLM response piece by piece as it is generated."""
+    return model_llm.stream_llm_generation(prompt, STOP_WORDS, deadline=ticket.deadline,
+                                           is_cancelled=ticket.disconnected, cache_prefix=cache_prefix,
+                                           **GENERATION_PARAMS)
+
+def link_source(metadata):
+    metadata = dict(metadata)
+    if "Source" in metadata:
         source_url = metadata["Source"]
         metadata["Source"] = f'<a href="{source_url}" target="_blank">{source_url}</a>'
+    return metadata
+
+def format_metadata(metadata):
+    """Format metadata for better readability in the UI."""
+    metadata = link_source(metadata)
+    if "Sources" in metadata:
+        metadata["Sources"] = [link_source(source) for source in metadata["Sources"]]
     return json.dumps(metadata, indent=4).replace("\n", "<br>").replace(" ", "&nbsp;")
 
+def answer_question(question, use_chroma, ticket):
+    """Retrieves context when requested and generates an answer, returns (context, metadata, llm_response, error).
+
+    Raises DeadlineExceeded or RequestCancelled when the admission ticket's question has to stop.
+    """
+    with metrics.stage("answer_cache"):
+        cached, embedding = ticket.call(retrieval_executor, lookup_cached_answer, question, use_chroma)
+    if cached:
+        print(f"{metrics.trace_prefix()}Answer cache hit for: {question}")
+        return cached["context"], cached["metadata"], cached["llm_response"], None
+
+    context = None
+    metadata = None
+    if use_chroma:
+        # A question that leaves no room for context is not worth a retrieval
+        if context_token_budget(question) <= 0:
+            return None, None, None, QUESTION_TOO_LONG
+        context, metadata = ticket.call(retrieval_executor, query_vector_db, question)
+        if not context:
+            return None, None, None, f"Error querying Vector DB: {metadata}"
+        print(f"{metrics.trace_prefix()}Retrieved context from ChromaDB: {context}")
+
+    with metrics.stage("prompt_build"):
+        prompt = create_prompt(context, question)
+    # The exact tier only holds deterministic answers, sampled ones are found by the semantic lookup above
+    cached = None
+    if answer_cache is not None and not GENERATION_PARAMS["do_sample"]:
+        cached = answer_cache.get(prompt=prompt, params=cache_params(use_chroma))
+    if cached:
+        llm_response = cached["llm_response"]
+    else:
+        llm_response = get_llm_response(prompt, ticket, cache_prefix=create_cache_prefix(context))
+    print(f"{metrics.trace_prefix()}LLM Response {'with' if context else 'without'} context: {llm_response}")
+
+    if answer_cache is not None and not cached:
+        answer_cache.put({"context": context, "metadata": metadata, "llm_response": llm_response},
+                         prompt=prompt, params=cache_params(use_chroma), embedding=embedding)
+    return context, metadata, llm_response, None
+
+def warming_up_message():
+    failed = model_llm.registry.failed()
+    if failed:
+        return f"The model failed to load: {model_llm.registry.status()[failed[0]]['error']}"
+    return "The model is still warming up, please try again in a moment."
+
+@app.route("/healthz")
+def healthz():
+    """Liveness: the process is up and serving, even while the model is still loading."""
+    status = model_llm.registry.status()
+    healthy = not model_llm.registry.failed()
+    return {"status": "ok" if healthy else "failed", "models": status}, 200 if healthy else 500
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: questions can be answered once the LLM is loaded."""
+    ready = model_llm.is_ready()
+    return {
+        "status": "ready" if ready else "warming up",
+        "models": model_llm.registry.status(),
+        "retrieval_service": retrieval_service.is_ready(),
+        "admission": admission.stats(),
+    }, 200 if ready else 503
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics: request and stage latencies, token counts, cache hits, queue depth."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route("/", methods=["GET", "POST"])
 def home():
     """Main UI for the Flask app."""
@@ -117,40 +293,179 @@ def home():
     llm_response = None
     error = None
 
+    # Questions are traced, the id is returned in X-Request-ID (or taken from the client's)
+    trace = metrics.start_trace(request.headers.get("X-Request-ID"), route="/") if request.method == "POST" else None
+
+    if request.method == "POST" and not model_llm.is_ready():
+        # Answer right away instead of holding the request until the model is loaded
+        error = warming_up_message()
+        metrics.finish_trace("warming_up")
+        return render_template("index.html", question=request.form.get("question") or "", context="",
+                               metadata="", llm_response="", error=error), 503, {"X-Request-ID": trace.id}
+
+    status = 200
+    outcome = None
     if request.method == "POST":
+        question = request.form.get("question")
+        use_chroma = request.form.get("use_chroma") == "on"
+
+        # Refuse right away when every slot is taken and the waiting line is full
         try:
-            question = request.form.get("question")
-            use_chroma = request.form.get("use_chroma") == "on"
+            ticket = admission.admit(serving.disconnect_checker(request.environ))
+        except Overloaded as e:
+            metrics.finish_trace("shed")
+            return render_template("index.html", question=question or "", context="", metadata="", llm_response="",
+                                   error=str(e)), 503, {"Retry-After": str(e.retry_after), "X-Request-ID": trace.id}
+        except RequestCancelled:
+            metrics.finish_trace("cancelled")
+            return "", 499
 
-            if not question:
-                error = "Please enter a valid question."
-            else:
-                if use_chroma:
-                    context, metadata = query_vector_db(question)
-                    if context:
-                        print(f"Retrieved context from ChromaDB: {context}")
-                        prompt = create_prompt(context, question)
-                        llm_response = get_llm_response(prompt)
-                        print(f"LLM Response with context: {llm_response}")
-                    else:
-                        error = f"Error querying Vector DB: {metadata}"
+        with ticket:
+            try:
+                if not question:
+                    error = "Please enter a valid question."
                 else:
-                    prompt = create_prompt(None, question)
-                    llm_response = get_llm_response(prompt)
-                    print(f"LLM Response without context: {llm_response}")
-        except Exception as e:
-            error = f"Unexpected error: {str(e)}"
+                    context, metadata, llm_response, error = answer_question(question, use_chroma, ticket)
+            except Overloaded as e:
+                # The generation queue is full
+                error, status, outcome = str(e), 503, "shed"
+            except DeadlineExceeded as e:
+                admission.count("deadline")
+                error, status, outcome = str(e), 504, "timeout"
+            except RequestCancelled:
+                # Nobody is left to read the answer
+                admission.count("cancelled")
+                metrics.finish_trace("cancelled")
+                return "", 499
+            except Exception as e:
+                error = f"Unexpected error: {str(e)}"
 
     formatted_metadata = format_metadata(metadata) if metadata else ""
 
-    return render_template(
-        "index.html",
-        question=question or "",
-        context=context or "",
-        metadata=formatted_metadata,
-        llm_response=llm_response or "",
-        error=error or "",
+    with metrics.stage("render"):
+        page = render_template(
+            "index.html",
+            question=question or "",
+            context=context or "",
+            metadata=formatted_metadata,
+            llm_response=llm_response or "",
+            error=error or "",
+        )
+    if trace is None:
+        return page
+    metrics.finish_trace(outcome or ("error" if error else "ok"))
+    headers = {"X-Request-ID": trace.id}
+    if status == 503:
+        headers["Retry-After"] = "1"
+    return page, status, headers
+
+def sse_event(event, data):
+    """Format one server-sent event, data is JSON encoded so newlines survive."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/stream", methods=["POST"])
+def stream():
+    """Same as the form POST on / but streams the answer as server-sent events."""
+    question = request.form.get("question")
+    use_chroma = request.form.get("use_chroma") == "on"
+    trace_id = request.headers.get("X-Request-ID") or metrics.new_trace_id()
+
+    if not model_llm.is_ready():
+        metrics.start_trace(trace_id, route="/stream")
+        metrics.finish_trace("warming_up")
+        return Response(sse_event("error", warming_up_message()), status=503, mimetype="text/event-stream",
+                        headers={"Retry-After": "10", "X-Request-ID": trace_id})
+
+    # Admitted before the stream starts, so an overloaded server answers with a plain 503
+    try:
+        ticket = admission.admit(serving.disconnect_checker(request.environ))
+    except Overloaded as e:
+        metrics.start_trace(trace_id, route="/stream")
+        metrics.finish_trace("shed")
+        return Response(sse_event("error", str(e)), status=503, mimetype="text/event-stream",
+                        headers={"Retry-After": str(e.retry_after), "X-Request-ID": trace_id})
+    except RequestCancelled:
+        metrics.start_trace(trace_id, route="/stream")
+        metrics.finish_trace("cancelled")
+        return Response("", status=499)
+
+    def events():
+        # Traced inside the generator, which runs after this view has returned
+        metrics.start_trace(trace_id, route="/stream")
+        outcome = "error"
+        try:
+            if not question:
+                yield sse_event("error", "Please enter a valid question.")
+                return
+            with metrics.stage("answer_cache"):
+                cached, embedding = ticket.call(retrieval_executor, lookup_cached_answer, question, use_chroma)
+            if cached:
+                print(f"{metrics.trace_prefix()}Answer cache hit for: {question}")
+                if cached["context"]:
+                    yield sse_event("context", {"context": cached["context"], "metadata": format_metadata(cached["metadata"]) if cached["metadata"] else ""})
+                yield sse_event("token", cached["llm_response"])
+                yield sse_event("done", "")
+                outcome = "ok"
+                return
+
+            context = None
+            metadata = None
+            if use_chroma:
+                if context_token_budget(question) <= 0:
+                    yield sse_event("error", QUESTION_TOO_LONG)
+                    return
+                context, metadata = ticket.call(retrieval_executor, query_vector_db, question)
+                if not context:
+                    yield sse_event("error", f"Error querying Vector DB: {metadata}")
+                    return
+                print(f"{metrics.trace_prefix()}Retrieved context from ChromaDB: {context}")
+                yield sse_event("context", {"context": context, "metadata": format_metadata(metadata) if metadata else ""})
+
+            with metrics.stage("prompt_build"):
+                prompt = create_prompt(context, question)
+            llm_response = ""
+            # Closed explicitly when the client disconnects mid-answer, which stops the generation
+            with closing(stream_llm_response(prompt, ticket, cache_prefix=create_cache_prefix(context))) as pieces:
+                for text in pieces:
+                    llm_response += text
+                    yield sse_event("token", text)
+            yield sse_event("done", "")
+            outcome = "ok"
+
+            if answer_cache is not None:
+                answer_cache.put({"context": context, "metadata": metadata, "llm_response": llm_response},
+                                 prompt=prompt, params=cache_params(use_chroma), embedding=embedding)
+        except Overloaded as e:
+            outcome = "shed"
+            yield sse_event("error", str(e))
+        except DeadlineExceeded as e:
+            admission.count("deadline")
+            outcome = "timeout"
+            yield sse_event("error", str(e))
+        except (RequestCancelled, GeneratorExit):
+            # The client disconnected, the server closes the stream without sending anything more
+            admission.count("cancelled")
+            outcome = "cancelled"
+        except Exception as e:
+            yield sse_event("error", f"Unexpected error: {str(e)}")
+        finally:
+            metrics.finish_trace(outcome)
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Request-ID": trace_id},
     )
+    # The slot is held until the stream is closed, also when the client disconnects before it started
+    response.call_on_close(ticket.release)
+    return response
 
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=int(os.environ["CDSW_READONLY_PORT"]))
+    # Warm up the retrieval service while the first user is still typing
+    retrieval_service.start()
+    port = int(os.environ["CDSW_READONLY_PORT"])
+    if SERVING_MODE == "production":
+        # A thread for every admitted and waiting question, plus a few for health checks and /metrics
+        serving.serve_production(app, "127.0.0.1", port, threads=admission.max_active + admission.max_waiting + 4)
+    else:
+        app.run(host="127.0.0.1", port=port)
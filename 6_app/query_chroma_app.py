@@ -15,69 +15,271 @@
 import os
 import json
 import sys
-import chromadb
-from chromadb.utils import embedding_functions
+import threading
+import time
 
 # Ensure ChromaDB is loaded from the virtual environment
 VENV_PATH = "/home/cdsw/chroma_venv"
 VENV_SITE_PACKAGES = os.path.join(VENV_PATH, "lib", "python3.x", "site-packages")  # Update version if needed
 sys.path.insert(0, VENV_SITE_PACKAGES)
 
+# Make utils/ importable when launched as a script from the project root or 6_app/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 # Configuration
 EMBEDDING_MODEL_PATH = "/home/cdsw/models/embedding-model"
-CHROMA_DATA_FOLDER = "/home/cdsw/chroma-data"
+os.environ.setdefault("EMBEDDING_MODEL_PATH", EMBEDDING_MODEL_PATH)
+CHROMA_DATA_FOLDER = os.getenv("CHROMA_DATA_FOLDER", "/home/cdsw/chroma-data")
 COLLECTION_NAME = os.getenv('COLLECTION_NAME')
 
-# Initialize embedding function
-embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name=EMBEDDING_MODEL_PATH, device="cpu"
-)
+# "chroma" searches the Chroma collection, "mmap" the memory mapped exact search index the
+# populate job exports next to it (utils/vector_index.py), without importing chromadb at all
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma")
+VECTOR_INDEX_PATH = os.path.join(CHROMA_DATA_FOLDER, f"vectors-{COLLECTION_NAME}")
 
+# Hybrid retrieval: vector search results are fused with BM25 matches from the
+# lexical index the populate job builds next to the collection
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+LEXICAL_INDEX_PATH = os.path.join(CHROMA_DATA_FOLDER, f"bm25-{COLLECTION_NAME}")
 
-# Connect to ChromaDB
-chroma_client = chromadb.PersistentClient(path=CHROMA_DATA_FOLDER)
+# Cross-encoder re-ranking of the top candidates, see utils/reranker.py. On by default once
+# models/reranker-model is downloaded, RERANK_ENABLED=0 turns it off.
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+os.environ.setdefault("RERANKER_MODEL_PATH", "/home/cdsw/models/reranker-model")
 
-# Retrieve the collection
-try:
-    collection = chroma_client.get_collection(name=COLLECTION_NAME, embedding_function=embedding_function)
-except Exception as e:
-    print(json.dumps({"error": f"Could not load ChromaDB collection: {str(e)}"}))
-    sys.stdout.flush()  # Flush output immediately
-    sys.exit(1)
+model_embedding = None
+collection = None
+reranker = None
+lexical_index = None
+lexical_index_version = None
+vector_index = None
+vector_index_version = None
+
+# Queries share the embedding model, run them one at a time
+query_lock = threading.Lock()
+
+def load_collection():
+    """Load the embedding model and open the ChromaDB collection once per process."""
+    global model_embedding, collection, reranker
+
+    # Questions are embedded with the batch embedding API in utils, so Chroma does not need to load its own copy
+    import utils.model_embedding_utils as model_embedding
 
-def query_chroma(question):
-    """Query ChromaDB for the nearest knowledge base chunk and free memory after retrieval."""
+    if RETRIEVAL_BACKEND == "mmap":
+        if get_vector_index() is None:
+            raise FileNotFoundError(f"No vector index at {VECTOR_INDEX_PATH}, run the populate job with VECTOR_INDEX=1")
+    else:
+        # Connect to ChromaDB and retrieve the collection
+        import chromadb
+        chroma_client = chromadb.PersistentClient(path=CHROMA_DATA_FOLDER)
+        collection = chroma_client.get_collection(name=COLLECTION_NAME, embedding_function=None)
+    get_lexical_index()
+
+    from utils.reranker import CrossEncoderReranker
     try:
-        response = collection.query(
-            query_texts=[question],
-            n_results=1
-        )
-        if response["documents"]:
+        reranker = CrossEncoderReranker.from_env()
+    except Exception as e:
+        print(f"⚠️ Could not load the re-ranking model: {e}. Using the retrieval order.")
+        reranker = None
+    return collection
+
+def get_lexical_index():
+    """The BM25 index, reopened after the populate job rebuilt it. None when disabled or not built yet."""
+    global lexical_index, lexical_index_version
+    if not HYBRID_SEARCH:
+        return None
+    from utils.lexical_index import index_version, open_index
+
+    version = index_version(LEXICAL_INDEX_PATH)
+    if version != lexical_index_version:
+        try:
+            lexical_index = open_index(LEXICAL_INDEX_PATH)
+        except Exception as e:
+            print(f"⚠️ Could not open BM25 index {LEXICAL_INDEX_PATH}: {e}. Using vector search only.")
+            lexical_index = None
+        lexical_index_version = version
+    return lexical_index
+
+def get_vector_index():
+    """The memory mapped vector index, reopened after the populate job exported it again."""
+    global vector_index, vector_index_version
+    from utils.vector_index import index_version, open_index
+
+    version = index_version(VECTOR_INDEX_PATH)
+    if version != vector_index_version:
+        vector_index = open_index(VECTOR_INDEX_PATH)
+        vector_index_version = version
+    return vector_index
+
+def vector_search(query_embedding, n_results):
+    """[{"id", "document", "metadata", "distance"}] of the nearest chunks, best first."""
+    if RETRIEVAL_BACKEND == "mmap":
+        return get_vector_index().query(query_embedding, n_results)
+    response = collection.query(query_embeddings=query_embedding[None, :], n_results=n_results)
+    if not response["documents"] or not response["documents"][0]:
+        return []
+    return [
+        {"id": doc_id, "document": document, "metadata": metadata, "distance": distance}
+        for doc_id, document, metadata, distance in zip(
+            response["ids"][0], response["documents"][0], response["metadatas"][0], response["distances"][0])
+    ]
+
+def get_chunks(ids):
+    """[{"id", "document", "metadata"}] of the chunks with these ids, skipping unknown ones."""
+    if RETRIEVAL_BACKEND == "mmap":
+        return get_vector_index().get(ids)
+    response = collection.get(ids=ids, include=["documents", "metadatas"])
+    return [{"id": doc_id, "document": document, "metadata": metadata, "distance": None}
+            for doc_id, document, metadata in zip(response["ids"], response["documents"], response["metadatas"])]
+
+def count_chunks():
+    return len(get_vector_index()) if RETRIEVAL_BACKEND == "mmap" else collection.count()
+
+def fuse_candidates(candidates, lexical_matches, n_results):
+    """Reciprocal rank fusion of the vector search candidates with the BM25 matches."""
+    from utils.lexical_index import reciprocal_rank_fusion
+
+    by_id = {c["id"]: c for c in candidates}
+    bm25_scores = dict(lexical_matches)
+    fused = reciprocal_rank_fusion([list(by_id), [doc_id for doc_id, _ in lexical_matches]],
+                                   k=RRF_K, limit=n_results)
+
+    # Chunks only the lexical index found still need their text
+    missing = [doc_id for doc_id, _ in fused if doc_id not in by_id]
+    if missing:
+        for chunk in get_chunks(missing):
+            by_id[chunk["id"]] = chunk
+
+    fused_candidates = []
+    for doc_id, score in fused:
+        # Skip ids the index still has but the collection no longer does
+        if doc_id in by_id:
+            fused_candidates.append(dict(by_id[doc_id], bm25=bm25_scores.get(doc_id), rrf=round(score, 6)))
+    return fused_candidates
+
+def query_chroma(question, n_results=1):
+    """Query ChromaDB for the nearest knowledge base chunks.
+
+    context/metadata hold the best match, candidates lists all n_results
+    matches best first for callers that assemble their own context. timings
+    holds the seconds each retrieval stage took.
+    """
+    timings = {}
+    try:
+        with query_lock:
+            index = get_lexical_index()
+            # Fusion and re-ranking need a deeper candidate list than what is returned
+            n_candidates = n_results
+            if index is not None:
+                n_candidates = max(n_candidates, HYBRID_CANDIDATES)
+            if reranker is not None:
+                n_candidates = max(n_candidates, RERANK_CANDIDATES)
+            n_keep = max(n_results, RERANK_CANDIDATES) if reranker is not None else n_results
+            start = time.perf_counter()
+            query_embeddings = model_embedding.get_embeddings_batch([question])
+            timings["embedding"] = time.perf_counter() - start
+            start = time.perf_counter()
+            candidates = vector_search(query_embeddings[0], n_candidates)
+            timings["vector_search"] = time.perf_counter() - start
+            start = time.perf_counter()
+            lexical_matches = index.search(question, n_candidates) if index is not None else []
+            if index is not None:
+                timings["lexical_search"] = time.perf_counter() - start
+
+        if lexical_matches:
+            start = time.perf_counter()
+            candidates = fuse_candidates(candidates, lexical_matches, n_keep)
+            timings["fusion"] = time.perf_counter() - start
+        else:
+            candidates = candidates[:n_keep]
+
+        reranked = False
+        if reranker is not None:
+            # Past the time budget the candidates keep their retrieval order
+            start = time.perf_counter()
+            candidates, reranked = reranker.rerank(question, candidates, top_k=n_results)
+            timings["rerank"] = time.perf_counter() - start
+
+        if candidates:
             result = {
-                "context": response["documents"][0][0],
-                "metadata": response["metadatas"][0][0]
+                "context": candidates[0]["document"],
+                "metadata": candidates[0]["metadata"],
+                "candidates": candidates,
+                "reranked": reranked,
+                "timings": timings
             }
         else:
-            result = {"context": None, "metadata": None}
+            result = {"context": None, "metadata": None, "candidates": [], "reranked": reranked, "timings": timings}
     except Exception as e:
         result = {"error": str(e)}
 
-    # Clear embedding model from memory
-    global embedding_function
-    del embedding_function  # Delete to free memory
-    import gc
-    gc.collect()  # Force garbage collection
+    return result
+
+def get_collection_version():
+    """Changes whenever the populate job rewrites the persisted collection."""
+    if RETRIEVAL_BACKEND == "mmap":
+        from utils.vector_index import index_version
+        return index_version(VECTOR_INDEX_PATH)
+    sqlite_path = os.path.join(CHROMA_DATA_FOLDER, "chroma.sqlite3")
+    try:
+        stat = os.stat(sqlite_path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+def embed_texts(texts):
+    """Embed texts with the already loaded embedding model."""
+    with query_lock:
+        return model_embedding.get_embeddings_batch(texts).tolist()
+
+def serve(socket_path):
+    """Keep the embedding model and collection warm and answer queries over a unix socket."""
+    from utils import ipc
+
+    def handle_query(request):
+        result = query_chroma(request["question"], n_results=int(request.get("n_results", 1)))
+        # Lets the app drop cached answers once the populate job rewrote the collection, without a health request
+        result["collection_version"] = get_collection_version()
+        return result
 
-    print(json.dumps(result))  # Return JSON response
-    sys.stdout.flush()  # Ensure output is flushed immediately
+    def handle_embed(request):
+        return {"embeddings": embed_texts(request["texts"])}
 
+    def handle_version(request):
+        # Checked before every answer cache lookup, so only a stat of the collection
+        return {"collection_version": get_collection_version()}
 
-# Read question from command-line arguments
+    def handle_health(request):
+        index = get_lexical_index()
+        return {"status": "ok", "pid": os.getpid(), "count": count_chunks(), "collection_version": get_collection_version(),
+                "lexical_index": len(index) if index is not None else None,
+                "reranker": reranker.stats() if reranker is not None else None}
+
+    print(f"Serving ChromaDB collection {COLLECTION_NAME} on {socket_path}")
+    sys.stdout.flush()
+    ipc.serve(socket_path, {"query": handle_query, "embed": handle_embed, "version": handle_version,
+                                "health": handle_health})
+
+def exit_with_error(message):
+    print(json.dumps({"error": message}))
+    sys.stdout.flush()  # Flush output immediately
+    sys.exit(1)
+
+
+# Read question from command-line arguments, or run as a long-lived service with --serve <socket>
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print(json.dumps({"error": "No question provided"}))
-        sys.stdout.flush()
-        sys.exit(1)
-    
-    question = sys.argv[1]
-    query_chroma(question)
+        exit_with_error("No question provided")
+
+    try:
+        load_collection()
+    except Exception as e:
+        exit_with_error(f"Could not load ChromaDB collection: {str(e)}")
+
+    if sys.argv[1] == "--serve":
+        serve(sys.argv[2] if len(sys.argv) > 2 else os.getenv("RETRIEVAL_SOCKET", "/tmp/chroma-retrieval.sock"))
+    else:
+        print(json.dumps(query_chroma(sys.argv[1])))  # Return JSON response
+        sys.stdout.flush()  # Ensure output is flushed immediately
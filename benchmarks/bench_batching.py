@@ -0,0 +1,99 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Throughput vs latency of utils/batch_scheduler.py for different batch sizes.
+# Every setting fires the same set of concurrent requests at the scheduler.
+#
+# Usage: python benchmarks/bench_batching.py [--model models/llm-model] [--requests 32]
+# Without --model a tiny random checkpoint is built (see benchmarks/tiny_models.py).
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.tiny_models import ensure_tiny_models, synthetic_corpus
+from utils.batch_scheduler import BatchScheduler
+
+
+def run_setting(model, tokenizer, prompts, max_batch_size, max_wait_ms, concurrency, max_new_tokens):
+    scheduler = BatchScheduler(model, tokenizer, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    stop_sequences = ["<human>:"]
+
+    def one(prompt):
+        start = time.perf_counter()
+        text = scheduler.generate(prompt, stop_sequences, max_new_tokens=max_new_tokens, do_sample=False)
+        return time.perf_counter() - start, len(scheduler.encode(text))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, prompts))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([r[0] for r in results])
+    tokens = sum(r[1] for r in results)
+    return {
+        "max_batch_size": max_batch_size,
+        "max_wait_ms": max_wait_ms,
+        "concurrency": concurrency,
+        "requests": len(prompts),
+        "requests_per_s": round(len(prompts) / elapsed, 3),
+        "tokens_per_s": round(tokens / elapsed, 1),
+        "latency_p50_s": round(float(np.percentile(latencies, 50)), 4),
+        "latency_p95_s": round(float(np.percentile(latencies, 95)), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="Causal LM checkpoint, defaults to a tiny random model")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16")
+    parser.add_argument("--max-wait-ms", type=float, default=20)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    model_path = args.model or ensure_tiny_models("/tmp/tiny-models")["llm-model"]
+    tokenizer = AutoTokenizer.from_pretrained(model_path, local_files_only=True, padding_side="left")
+    model = AutoModelForCausalLM.from_pretrained(model_path, local_files_only=True,
+                                                 torch_dtype=torch.bfloat16 if torch.cuda.is_available() else torch.float32)
+    model.to("cuda" if torch.cuda.is_available() else "cpu").eval()
+
+    sentences = synthetic_corpus(args.requests, seed=1)
+    prompts = [f"<human>: Question: {s}\n<bot>:" for s in sentences]
+
+    results = []
+    for max_batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        result = run_setting(model, tokenizer, prompts, max_batch_size, args.max_wait_ms,
+                             args.concurrency, args.max_new_tokens)
+        print(f"batch<={result['max_batch_size']:>3}  {result['requests_per_s']:>8} req/s  "
+              f"{result['tokens_per_s']:>8} tok/s  p50 {result['latency_p50_s']}s  p95 {result['latency_p95_s']}s")
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Chunking time and peak memory of utils/text_chunker.py against the previous
+# split_text_smart, which copied the remaining text on every split, for growing
+# document sizes. Before timing, every chunker is checked to never yield a
+# chunk over its max_tokens, including the overlap and headings it carries
+# over (exits with status 1 otherwise).
+#
+# Usage: python benchmarks/bench_chunker.py [--sizes-mb 1 4 16] [--tokenizer models/embedding-model]
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.text_chunker import TextChunker
+
+
+def baseline_split(text, max_length=1000):
+    """What load-to-chromadb.py did before."""
+    chunks = []
+    snippet_number = 1
+    while len(text) > max_length:
+        split_index = text[:max_length].rfind(".")
+        if split_index == -1:
+            split_index = max_length
+        chunks.append((text[:split_index + 1], snippet_number))
+        text = text[split_index + 1:].strip()
+        snippet_number += 1
+    if text:
+        chunks.append((text, snippet_number))
+    return chunks
+
+
+def document_pieces(size_mb, piece_chars=1 << 16):
+    """Synthetic documentation text of about size_mb, as pieces like a file read in blocks."""
+    section = ("Working with ML Runtimes\n\n" + "".join(
+        f"Cloudera Machine Learning sessions start from an ML Runtime image, paragraph {p}. "
+        f"Runtimes bundle Python, R and GPU libraries! Which one should you pick? It depends on the project.\n\n"
+        for p in range(6)))
+    repeat = max(1, piece_chars // len(section))
+    piece = section * repeat
+    for _ in range(max(1, int(size_mb * 1e6 / len(piece)))):
+        yield piece
+
+
+def sectioned_document(seed, paragraphs=100):
+    """Headings and paragraphs of sentences of varied length, so chunks end with overlap and headings to carry."""
+    rng = random.Random(seed)
+    words = "cloudera machine learning runtimes sessions projects workspace spark iceberg tables".split()
+    parts = []
+    for p in range(paragraphs):
+        if rng.random() < 0.3:
+            parts.append(f"Section heading {p}\n\n")
+        sentences = (" ".join(rng.choice(words) for _ in range(rng.randint(1, 12))) + "."
+                     for _ in range(rng.randint(1, 4)))
+        parts.append(" ".join(sentences) + "\n\n")
+    return "".join(parts)
+
+
+def check_max_tokens(chunker, documents=50):
+    """Chunks over chunker.max_tokens, which the embedding model would silently truncate."""
+    return [chunk for seed in range(documents) for chunk in chunker.chunks(sectioned_document(seed))
+            if chunk.tokens > chunker.max_tokens]
+
+
+def run(name, chunk, size_mb, streaming):
+    pieces = document_pieces(size_mb)
+    if not streaming:
+        pieces = "".join(pieces)
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = 0
+    for _ in chunk(pieces):
+        count += 1
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"chunker": name, "size_mb": size_mb, "chunks": count, "seconds": round(elapsed, 3),
+            "mb_per_s": round(size_mb / elapsed, 2), "peak_mb": round(peak / 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--tokenizer", help="Embedding model directory, adds the token based chunker")
+    parser.add_argument("--baseline-max-mb", type=float, default=16, help="Skip the quadratic baseline above this size")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    chunkers = [("characters, streamed", TextChunker(max_tokens=1000, overlap_tokens=0).chunks, True)]
+    checked = [TextChunker(max_tokens=100, overlap_tokens=30), TextChunker(max_tokens=60, overlap_tokens=30)]
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+        chunkers.append(("tokens, streamed", TextChunker(tokenizer, max_tokens=254, overlap_tokens=32).chunks, True))
+        checked.append(TextChunker(tokenizer, max_tokens=30, overlap_tokens=15))
+
+    for chunker in checked:
+        oversized = check_max_tokens(chunker)
+        if oversized:
+            print(f"{len(oversized)} chunks over max_tokens={chunker.max_tokens} "
+                  f"(overlap_tokens={chunker.overlap_tokens}), the largest has {max(c.tokens for c in oversized)}")
+            sys.exit(1)
+
+    results = []
+    for size_mb in args.sizes_mb:
+        if size_mb <= args.baseline_max_mb:
+            results.append(run("baseline split_text_smart", baseline_split, size_mb, streaming=False))
+        for name, chunk, streaming in chunkers:
+            results.append(run(name, chunk, size_mb, streaming))
+
+    for result in results:
+        print(f"{result['chunker']:<28} {result['size_mb']:>6} MB {result['chunks']:>8} chunks "
+              f"{result['seconds']:>8} s {result['mb_per_s']:>8} MB/s peak {result['peak_mb']:>8} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
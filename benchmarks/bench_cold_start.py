@@ -0,0 +1,178 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Cold start of the LLM from a legacy pytorch_model.bin checkpoint compared with
+# the memory mapped safetensors copy written by utils/model_registry.py:
+# - import: how long importing utils.model_llm_utils blocks (the model loads in the background)
+# - ready: seconds until the model is loaded, and peak RSS of the process until then
+# - healthz / readyz: seconds until a freshly started llm_rag_app.py answers 200 on each route
+# Every measurement runs in a new process, after one unmeasured start that fills the page cache.
+#
+# Usage: python benchmarks/bench_cold_start.py [--model models/llm-model] [--repeat 3]
+# Without --model a small random GPT-NeoX checkpoint is built (see benchmarks/tiny_models.py).
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def child(args):
+    """Runs inside a fresh process, prints a JSON result."""
+    os.chdir(args.workdir)
+    start = time.perf_counter()
+    import utils.model_llm_utils as model_llm
+    import_seconds = time.perf_counter() - start
+    model_llm.wait_until_ready()
+    ready_seconds = time.perf_counter() - start
+
+    from utils.model_registry import peak_rss_mb
+    print(json.dumps({"import_s": round(import_seconds, 3), "ready_s": round(ready_seconds, 3),
+                      "peak_rss_mb": round(peak_rss_mb(), 1)}))
+
+
+def make_workdir(model_path, checkpoint_format):
+    """A working directory laid out like /home/cdsw holding a copy of the model in one format."""
+    workdir = tempfile.mkdtemp(prefix=f"bench-cold-start-{checkpoint_format}-")
+    for name in ("6_app", "utils"):
+        os.symlink(os.path.join(ROOT, name), os.path.join(workdir, name))
+    target = os.path.join(workdir, "models", "llm-model")
+    shutil.copytree(model_path, target, ignore=shutil.ignore_patterns("model*.safetensors*"))
+    if checkpoint_format == "safetensors":
+        import torch
+        from utils.model_registry import convert_to_safetensors
+        convert_to_safetensors(target, torch.bfloat16)
+    return workdir
+
+
+def child_env(checkpoint_format):
+    # The legacy run must not convert its checkpoint on startup
+    return dict(os.environ, PYTHONPATH=ROOT, LLM_MAX_BATCH_SIZE="1",
+                LLM_CONVERT_SAFETENSORS="1" if checkpoint_format == "safetensors" else "0")
+
+
+def measure_load(workdir, checkpoint_format):
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--workdir", workdir]
+    output = subprocess.run(command, env=child_env(checkpoint_format), check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def status_code(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def measure_app(workdir, checkpoint_format, timeout):
+    """Seconds until llm_rag_app.py answers 200 on /healthz and on /readyz."""
+    port = free_port()
+    env = dict(child_env(checkpoint_format), CDSW_READONLY_PORT=str(port),
+               RETRIEVAL_SOCKET=os.path.join(workdir, "retrieval.sock"),
+               RETRIEVAL_LOG=os.path.join(workdir, "retrieval.log"))
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "6_app/llm_rag_app.py"], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {}
+    try:
+        while "readyz_s" not in result and time.perf_counter() - start < timeout:
+            for route in ("healthz", "readyz"):
+                if f"{route}_s" not in result and status_code(f"http://127.0.0.1:{port}/{route}") == 200:
+                    result[f"{route}_s"] = round(time.perf_counter() - start, 3)
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+def median(results, key):
+    values = [r[key] for r in results if key in r]
+    return round(statistics.median(values), 3) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="Causal LM checkpoint, defaults to a small random model")
+    parser.add_argument("--hidden-size", type=int, default=1024, help="Size of the generated model")
+    parser.add_argument("--layers", type=int, default=8, help="Layers of the generated model")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-app", action="store_true", help="Skip the /healthz and /readyz measurement")
+    parser.add_argument("--app-timeout", type=float, default=600)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    model_path = args.model
+    if not model_path:
+        from benchmarks.tiny_models import build_llm
+        model_path = os.path.join(tempfile.mkdtemp(prefix="bench-cold-start-"), "llm-model")
+        build_llm(model_path, hidden_size=args.hidden_size, num_layers=args.layers)
+
+    results = []
+    for checkpoint_format in ("bin", "safetensors"):
+        workdir = make_workdir(model_path, checkpoint_format)
+        measure_load(workdir, checkpoint_format)  # fills the page cache
+        loads = [measure_load(workdir, checkpoint_format) for _ in range(args.repeat)]
+        apps = [] if args.no_app else [measure_app(workdir, checkpoint_format, args.app_timeout)
+                                       for _ in range(args.repeat)]
+        results.append({
+            "format": checkpoint_format,
+            "import_s": median(loads, "import_s"),
+            "ready_s": median(loads, "ready_s"),
+            "peak_rss_mb": median(loads, "peak_rss_mb"),
+            "app_healthz_s": median(apps, "healthz_s"),
+            "app_readyz_s": median(apps, "readyz_s"),
+        })
+        shutil.rmtree(workdir)
+
+    print(f"model {model_path}, median of {args.repeat} starts")
+    for result in results:
+        print(f"{result['format']:<12} import {result['import_s']:>7} s  ready {result['ready_s']:>7} s  "
+              f"peak RSS {result['peak_rss_mb']:>8} MB  /healthz {result['app_healthz_s']} s  "
+              f"/readyz {result['app_readyz_s']} s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The crawler of 5_job-populate-vectordb/html-to-text.py against a local
+# http.server that serves pages with an ETag and answers If-None-Match with a
+# 304. Checks, exiting with status 1 when one fails:
+# - first crawl: one request and one parse per page
+# - re-crawl: one conditional request per page, answered 304, and no parse
+# - one changed page: only that page is fetched and parsed again
+# - per host limit: never more than --per-host requests in flight at once
+# - retries: a page failing with 503 is fetched on a later attempt, after
+#   exponentially growing delays; a 404 is not retried and a page that keeps
+#   failing is given up after max_retries attempts
+#
+# Usage: python benchmarks/bench_crawler.py [--pages 40] [--per-host 3] [--output results.json]
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The crawler must reach the local server directly
+os.environ["NO_PROXY"] = os.environ["no_proxy"] = "127.0.0.1,localhost"
+
+
+def load_html_to_text():
+    spec = importlib.util.spec_from_file_location("html_to_text", os.path.join(ROOT, "5_job-populate-vectordb", "html-to-text.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def page(index, revision=0):
+    return (f"<html><body><nav>Navigation</nav><main><h1>Page {index}</h1>"
+            f"<p>Revision {revision} of documentation page {index}.</p></main></body></html>").encode("utf-8")
+
+
+class Site:
+    """Pages, failures to serve before a path succeeds, and what the server saw."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.pages = {}
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.conditional = 0
+            self.not_modified = 0
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+
+def make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with site.lock:
+                site.requests.setdefault(self.path, []).append(time.perf_counter())
+                site.in_flight += 1
+                site.max_in_flight = max(site.max_in_flight, site.in_flight)
+                failures = site.failures.get(self.path, 0)
+                if failures:
+                    site.failures[self.path] = failures - 1
+                body = site.pages.get(self.path)
+            time.sleep(site.delay)
+            # Counted out before answering: the client may send its next request as soon as it has the response
+            with site.lock:
+                site.in_flight -= 1
+            if failures:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if body is None:
+                self.send_error(404)
+                return
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            if self.headers.get("If-None-Match") is not None:
+                with site.lock:
+                    site.conditional += 1
+                if self.headers["If-None-Match"] == etag:
+                    with site.lock:
+                        site.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--per-host", type=int, default=3)
+    parser.add_argument("--delay-ms", type=float, default=20, help="Time the server takes per request")
+    parser.add_argument("--retry-delay-ms", type=float, default=50, help="First retry delay of the crawler")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    html_to_text = load_html_to_text()
+    html_to_text.crawl_workers = args.workers
+    html_to_text.per_host_limit = args.per_host
+    html_to_text.retry_base_delay_seconds = args.retry_delay_ms / 1000
+
+    # Count parses by wrapping the extraction that write_text calls
+    parses = []
+    extract_main_text = html_to_text.extract_main_text
+    html_to_text.extract_main_text = lambda content: parses.append(1) or extract_main_text(content)
+
+    site = Site(args.delay_ms / 1000)
+    for i in range(args.pages):
+        site.pages[f"/docs/page-{i}.html"] = page(i)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(site))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [base_url + path for path in site.pages]
+
+    workdir = tempfile.mkdtemp(prefix="bench-crawler-")
+    data_path, cache_dir = os.path.join(workdir, "data"), os.path.join(workdir, ".http-cache")
+
+    def crawl():
+        site.reset()
+        del parses[:]
+        start = time.perf_counter()
+        counts = html_to_text.crawl(urls, data_path, cache_dir)
+        return {"counts": counts, "seconds": round(time.perf_counter() - start, 3),
+                "requests": sum(len(times) for times in site.requests.values()),
+                "conditional_requests": site.conditional, "not_modified": site.not_modified,
+                "parses": len(parses), "max_in_flight": site.max_in_flight}
+
+    results = {"meta": {"pages": args.pages, "workers": args.workers, "per_host": args.per_host}}
+    results["first_crawl"] = first = crawl()
+    results["recrawl"] = again = crawl()
+    changed_path = "/docs/page-0.html"
+    site.pages[changed_path] = page(0, revision=1)
+    results["one_page_changed"] = changed = crawl()
+    _, changed_file = html_to_text.create_directory_path_from_url(data_path, base_url + changed_path[:-5])
+    with open(changed_file) as f:
+        changed_text = f.read()
+
+    # Retries go through fetch directly, one URL at a time
+    session = html_to_text.create_session()
+    cache = html_to_text.HttpCache(cache_dir)
+    limiter = html_to_text.HostLimiter(args.per_host)
+    site.pages["/flaky.html"] = page("flaky")
+    site.failures["/flaky.html"] = 2
+    site.failures["/down.html"] = html_to_text.max_retries
+    site.reset()
+    flaky_status, _ = html_to_text.fetch(session, base_url + "/flaky.html", cache, limiter)
+    missing_status, _ = html_to_text.fetch(session, base_url + "/missing.html", cache, limiter)
+    down_status, _ = html_to_text.fetch(session, base_url + "/down.html", cache, limiter)
+    times = site.requests["/flaky.html"]
+    # Time between attempts minus the time the server took to answer
+    gaps = [round(b - a - site.delay, 3) for a, b in zip(times, times[1:])]
+    results["retries"] = {"flaky": flaky_status, "flaky_attempts": len(times), "flaky_delays": gaps,
+                          "missing": missing_status, "missing_attempts": len(site.requests["/missing.html"]),
+                          "down": down_status, "down_attempts": len(site.requests["/down.html"])}
+    server.shutdown()
+
+    base_delay = html_to_text.retry_base_delay_seconds
+    checks = {
+        "first_crawl_fetches_each_page_once": first["counts"]["fetched"] == args.pages and first["requests"] == args.pages,
+        "first_crawl_parses_each_page_once": first["parses"] == args.pages,
+        "recrawl_one_conditional_request_per_page": again["requests"] == args.pages and
+                                                    again["conditional_requests"] == args.pages,
+        "recrawl_all_not_modified": again["not_modified"] == args.pages and again["counts"]["not_modified"] == args.pages,
+        "recrawl_parses_nothing": again["parses"] == 0,
+        "changed_page_parsed_alone": changed["counts"]["fetched"] == 1 and changed["parses"] == 1 and
+                                     "Revision 1" in changed_text,
+        "per_host_limit_held": max(r["max_in_flight"] for r in (first, again, changed)) <= args.per_host,
+        "per_host_limit_reached": first["max_in_flight"] == args.per_host,
+        "retried_until_fetched": flaky_status == "fetched" and len(times) == 3,
+        # Jitter scales each delay by 0.5 to 1.5, so the n-th is at least half of base * 2 ** (n - 1)
+        "backoff_grows": len(gaps) == 2 and gaps[0] >= 0.5 * base_delay and gaps[1] >= base_delay and
+                         gaps[1] <= 3 * base_delay + 0.05,
+        "not_found_not_retried": missing_status == "failed" and results["retries"]["missing_attempts"] == 1,
+        "gives_up_after_max_retries": down_status == "failed" and
+                                      results["retries"]["down_attempts"] == html_to_text.max_retries,
+    }
+    results["checks"] = checks
+
+    for name in ("first_crawl", "recrawl", "one_page_changed"):
+        r = results[name]
+        print(f"{name:<18} {r['seconds']:>6}s  requests {r['requests']:>4}  conditional {r['conditional_requests']:>4}  "
+              f"304 {r['not_modified']:>4}  parses {r['parses']:>4}  max in flight {r['max_in_flight']}")
+    print(f"retries: {results['retries']}")
+    for name, ok in checks.items():
+        print(f"{name:<42} {'ok' if ok else 'FAILED'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not all(checks.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Near-duplicate elimination in the populate job (utils/near_dedup.py) on a
+# synthetic crawl: every page carries the same navigation header and footer,
+# and some pages are re-published copies of others with a sentence changed.
+# The populate job runs with DEDUP_ENABLED=0 and =1 and reports for each:
+# - the chunks stored, how many were found to be near-duplicates, the Chroma
+#   folder size and the ingestion time
+# - retrieval noise: how many of the top-k chunks of a question are
+#   near-duplicates of a better ranked chunk, and how many come from the boilerplate
+# An incremental run after the boilerplate of the first page changed (so its
+# copies on other pages are no longer duplicates of it) must leave the same
+# chunks and provenance metadata as a full run; otherwise the script exits with status 1.
+#
+# Usage: python benchmarks/bench_dedup.py [--documents 40 --paragraphs 12 --copies 0.2]
+#        [--embedding-model models/embedding-model] [--output results.json]
+# Run it with the main python; --chroma-python is the chroma venv's.
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.bench_e2e import make_workdir, workdir_env
+from utils.near_dedup import MinHasher, similarity
+
+NAVIGATION = ("Home Documentation Getting started Installation Administration Security Networking Storage "
+              "Release notes Support Downloads Community Training Partners Contact us Search the documentation "
+              "Product overview Architecture Deployment planning Upgrading Troubleshooting Reference Glossary "
+              "Management console Data services Machine learning Data engineering Operational database")
+FOOTER = ("Was this page helpful? Send feedback to the documentation team. Terms of use Privacy policy "
+          "Cookie preferences Accessibility Trademarks Export compliance. All other trademarks are the property "
+          "of their respective owners. The product documentation is provided as is without warranty of any kind. "
+          "Subscribe to the release announcements to hear about new versions, security bulletins and end of "
+          "support dates. Related topics Getting started Installation Administration Troubleshooting Reference")
+
+QUERY_SCRIPT = r'''
+import importlib.util, json, sys
+spec = importlib.util.spec_from_file_location("q", "6_app/query_chroma_app.py")
+q = importlib.util.module_from_spec(spec); spec.loader.exec_module(q)
+q.load_collection()
+print(json.dumps([[c["document"] for c in q.query_chroma(question, int(sys.argv[1]))["candidates"]]
+                  for question in json.load(open("questions.json"))]))
+'''
+
+READ_SCRIPT = r'''
+import chromadb, json, sys
+collection = chromadb.PersistentClient(path=sys.argv[1]).get_collection(sys.argv[2])
+rows = collection.get(include=["metadatas"])
+print(json.dumps(dict(zip(rows["ids"], rows["metadatas"])), sort_keys=True))
+'''
+
+
+def add_boilerplate(workdir, copies, seed=0):
+    """Wrap every page in the navigation and footer and re-publish a share of them with a sentence changed."""
+    rng = random.Random(seed)
+    data = os.path.join(workdir, "5_job-populate-vectordb", "data")
+    names = sorted(os.listdir(data))
+    for name in names:
+        path = os.path.join(data, name)
+        with open(path) as f:
+            text = f.read()
+        title = name.rsplit(".", 1)[0].replace("-", " ").title()
+        with open(path, "w") as f:
+            f.write(f"{NAVIGATION} {title}\n\n{text}\n\n{FOOTER}\n")
+    for name in rng.sample(names, int(len(names) * copies)):
+        with open(os.path.join(data, name)) as f:
+            paragraphs = f.read().split("\n\n")
+        changed = rng.randrange(1, len(paragraphs) - 1)
+        paragraphs[changed] += " This behaviour changed in the latest release."
+        with open(os.path.join(data, name.replace(".txt", "-latest.txt")), "w") as f:
+            f.write("\n\n".join(paragraphs))
+
+
+def populate(workdir, args, **env):
+    """Runs the populate job, returns (seconds, its output)."""
+    environment = workdir_env(workdir, args)
+    environment.update(env)
+    start = time.perf_counter()
+    output = subprocess.run([args.chroma_python, "5_job-populate-vectordb/load-to-chromadb.py"], cwd=workdir,
+                            env=environment, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(f"Populate job failed:\n{output.stdout[-2000:]}\n{output.stderr[-4000:]}")
+    return time.perf_counter() - start, output.stdout
+
+
+def read_collection(workdir, args, chroma_path):
+    """{id: metadata} of every stored chunk."""
+    output = subprocess.run([args.chroma_python, "-c", READ_SCRIPT, chroma_path, "bench-e2e"], cwd=workdir,
+                            env=workdir_env(workdir, args), capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def retrieval_noise(workdir, args, chroma_path, hasher):
+    env = workdir_env(workdir, args)
+    env["CHROMA_DATA_FOLDER"] = chroma_path
+    output = subprocess.run([args.chroma_python, "-c", QUERY_SCRIPT, str(args.top_k)], cwd=workdir, env=env,
+                            capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(output.stderr[-4000:])
+    results = json.loads(output.stdout.strip().splitlines()[-1])
+    boilerplate = [hasher.signature(NAVIGATION), hasher.signature(FOOTER)]
+    redundant = boilerplate_hits = total = 0
+    for documents in results:
+        signatures = [hasher.signature(document) for document in documents]
+        for n, signature in enumerate(signatures):
+            total += 1
+            redundant += any(similarity(signature, better) >= args.threshold for better in signatures[:n])
+            boilerplate_hits += max(similarity(signature, b) for b in boilerplate) >= 0.5
+    return {"results": total, "redundant": redundant, "boilerplate": boilerplate_hits,
+            "redundant_share": round(redundant / max(total, 1), 4)}
+
+
+def folder_bytes(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def line_value(output, prefix):
+    return next((line for line in output.splitlines() if line.startswith(prefix)), "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--embedding-model", help="Embedding model, defaults to the tiny BERT")
+    parser.add_argument("--chroma-python", default="/home/cdsw/chroma_venv/bin/python",
+                        help="Python of the chroma venv, runs the populate job and retrieval")
+    parser.add_argument("--documents", type=int, default=40, help="Pages in the synthetic crawl")
+    parser.add_argument("--paragraphs", type=int, default=12, help="Paragraphs per page")
+    parser.add_argument("--copies", type=float, default=0.2, help="Share of pages re-published with a change")
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--top-k", type=int, default=5, help="Chunks retrieved per question")
+    parser.add_argument("--threshold", type=float, default=0.85, help="DEDUP_THRESHOLD")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+    args.reranker_model = None
+    from benchmarks.tiny_models import ensure_tiny_models
+    tiny = ensure_tiny_models("/tmp/tiny-models")
+    args.llm_model = tiny["llm-model"]
+    args.embedding_model = args.embedding_model or tiny["embedding-model"]
+
+    workdir = make_workdir(args)
+    add_boilerplate(workdir, args.copies)
+    chroma_path = os.path.join(workdir, "chroma-data")
+    hasher = MinHasher()
+    results = {"meta": {"documents": len(os.listdir(os.path.join(workdir, "5_job-populate-vectordb", "data"))),
+                        "threshold": args.threshold, "top_k": args.top_k}}
+    print(f"Working directory {workdir}, {results['meta']['documents']} pages")
+    try:
+        for name, enabled in (("off", "0"), ("on", "1")):
+            seconds, output = populate(workdir, args, DEDUP_ENABLED=enabled, DEDUP_THRESHOLD=str(args.threshold))
+            kept_path = chroma_path + "-" + name
+            os.rename(chroma_path, kept_path)
+            chunks = read_collection(workdir, args, kept_path)
+            results[name] = {"ingest_s": round(seconds, 2), "chunks_stored": len(chunks),
+                             "chroma_mb": round(folder_bytes(kept_path) / 1e6, 2),
+                             "retrieval": retrieval_noise(workdir, args, kept_path, hasher)}
+            report = line_value(output, "Near-duplicates:")
+            if report:
+                results[name]["report"] = report
+            print(f"dedup {name}: {results[name]}")
+
+        # Change the first page's header, the copies of its header chunk elsewhere are no longer duplicates of it
+        os.rename(chroma_path + "-on", chroma_path)
+        data = os.path.join(workdir, "5_job-populate-vectordb", "data")
+        first = os.path.join(data, sorted(os.listdir(data))[0])
+        with open(first) as f:
+            text = f.read()
+        with open(first, "w") as f:
+            f.write(text.replace(NAVIGATION, "Archived page, see the current documentation instead."))
+        seconds, output = populate(workdir, args)
+        incremental = read_collection(workdir, args, chroma_path)
+        shutil.rmtree(chroma_path)
+        populate(workdir, args, INGEST_MODE="full")
+        full = read_collection(workdir, args, chroma_path)
+        results["incremental"] = {"ingest_s": round(seconds, 2), "matches_full_run": incremental == full,
+                                  "progress": line_value(output, "Done: ")}
+        print(f"incremental: {results['incremental']}")
+    finally:
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    off, on = results["off"], results["on"]
+    print(f"{'':<6} {'chunks':>7} {'MB':>7} {'ingest s':>9} {'redundant':>10} {'boilerplate':>12}")
+    for name, r in (("off", off), ("on", on)):
+        print(f"{name:<6} {r['chunks_stored']:>7} {r['chroma_mb']:>7} {r['ingest_s']:>9} "
+              f"{r['retrieval']['redundant']:>10} {r['retrieval']['boilerplate']:>12}")
+    print(f"Embeddings saved: {off['chunks_stored'] - on['chunks_stored']} "
+          f"({1 - on['chunks_stored'] / max(off['chunks_stored'], 1):.1%})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not results["incremental"]["matches_full_run"]:
+        print("⚠️ The incremental run left different chunks or provenance than a full run")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# End-to-end benchmark of the RAG chatbot on a synthetic knowledge base, through
+# the same code the jobs and the application run. A working directory laid out
+# like /home/cdsw is created with the models and a generated corpus, then every
+# stage runs in its own process (the chroma venv for ingestion and retrieval):
+# - ingestion: split_text_smart, get_embeddings for single questions,
+#   get_embeddings_batch, and the whole populate job (load-to-chromadb.py)
+# - retrieval: query_chroma in the retrieval service code
+# - generation: get_llm_generation with the application's prompt and settings
+# - end_to_end: query_vector_db (through the retrieval service) plus generation
+# - flask: POST / on a running llm_rag_app.py at several concurrency levels
+# Latencies are reported as p50/p95/p99, with throughput and the peak RSS of
+# the processes involved. Results are written as JSON; --compare flags the
+# metrics that got worse than a previous run by more than --tolerance and exits
+# with status 1, so it can gate changes.
+#
+# Usage: python benchmarks/bench_e2e.py [--output results.json] [--compare baseline.json]
+#        [--llm-model models/llm-model --embedding-model models/embedding-model] [--concurrency 1 4 8]
+# Without model arguments the tiny checkpoints of benchmarks/tiny_models.py are
+# used. Run it with the main python; --chroma-python is the chroma venv's.
+
+import argparse
+import concurrent.futures
+import importlib.util
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COLLECTION_NAME = "bench-e2e"
+STAGES = ("ingestion", "retrieval", "generation", "end_to_end", "flask")
+
+
+# ** Measurements **
+def summarize(latencies, wall_seconds=None, items=None):
+    """p50/p95/p99/mean latency in ms and throughput per second of a list of latencies in seconds."""
+    ordered = sorted(latencies)
+
+    def percentile(q):
+        if not ordered:
+            return None
+        rank = q / 100 * (len(ordered) - 1)
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        return round((ordered[low] + (ordered[high] - ordered[low]) * (rank - low)) * 1000, 3)
+
+    wall_seconds = wall_seconds if wall_seconds is not None else sum(latencies)
+    return {"n": len(latencies), "p50_ms": percentile(50), "p95_ms": percentile(95), "p99_ms": percentile(99),
+            "mean_ms": round(sum(latencies) / max(len(latencies), 1) * 1000, 3),
+            "throughput_per_s": round((items if items is not None else len(latencies)) / max(wall_seconds, 1e-9), 3)}
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak RSS of this process (or the largest of its waited-for children), Linux reports KiB."""
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def process_tree_peak_rss_mb(pid):
+    """Sum of the peak RSS of a running process and all of its descendants."""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat", "r") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                pass
+    tree, frontier = [pid], [pid]
+    while frontier:
+        frontier = [child for child, parent in parents.items() if parent in frontier]
+        tree += frontier
+    total = 0
+    for member in tree:
+        try:
+            with open(f"/proc/{member}/status", "r") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+        except (OSError, StopIteration):
+            pass
+    return round(total / 1024, 1)
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ** Synthetic workspace **
+def make_corpus(n_documents, paragraphs, seed=0):
+    """{file name: text} of documents made of paragraphs of synthetic product sentences."""
+    from benchmarks.tiny_models import synthetic_corpus
+
+    rng = random.Random(seed)
+    sentences = synthetic_corpus(5000, seed=seed)
+    return {f"doc-{number:04d}.txt": "\n\n".join(" ".join(rng.sample(sentences, rng.randint(3, 8)))
+                                                 for _ in range(paragraphs))
+            for number in range(n_documents)}
+
+
+def make_questions(corpus, n, seed=1):
+    rng = random.Random(seed)
+    texts = list(corpus.values())
+    questions = []
+    for _ in range(n):
+        words = rng.choice(texts).split()
+        start = rng.randrange(0, max(len(words) - 6, 1))
+        questions.append("What does the documentation say about " + " ".join(words[start:start + 5]).strip(".") + "?")
+    return questions
+
+
+def make_workdir(args):
+    """A directory laid out like /home/cdsw: code symlinked, models symlinked, corpus written."""
+    workdir = tempfile.mkdtemp(prefix="bench-e2e-")
+    for name in ("6_app", "utils"):
+        os.symlink(os.path.join(ROOT, name), os.path.join(workdir, name))
+    job_dir = os.path.join(workdir, "5_job-populate-vectordb")
+    os.makedirs(os.path.join(job_dir, "data"))
+    os.symlink(os.path.join(ROOT, "5_job-populate-vectordb", "load-to-chromadb.py"),
+               os.path.join(job_dir, "load-to-chromadb.py"))
+
+    os.makedirs(os.path.join(workdir, "models"))
+    models = {"llm-model": args.llm_model, "embedding-model": args.embedding_model}
+    if args.reranker_model:
+        models["reranker-model"] = args.reranker_model
+    for name, path in models.items():
+        os.symlink(os.path.abspath(path), os.path.join(workdir, "models", name))
+
+    corpus = make_corpus(args.documents, args.paragraphs)
+    for name, text in corpus.items():
+        with open(os.path.join(job_dir, "data", name), "w") as f:
+            f.write(text)
+    with open(os.path.join(workdir, "questions.json"), "w") as f:
+        json.dump(make_questions(corpus, args.questions), f)
+    return workdir
+
+
+def workdir_env(workdir, args):
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": workdir,
+        "COLLECTION_NAME": COLLECTION_NAME,
+        "EMBEDDING_MODEL_PATH": os.path.join(workdir, "models", "embedding-model"),
+        "RERANKER_MODEL_PATH": os.path.join(workdir, "models", "reranker-model"),
+        "CHROMA_DATA_FOLDER": os.path.join(workdir, "chroma-data"),
+        "CHROMA_VENV_PYTHON": args.chroma_python,
+        "RETRIEVAL_SOCKET": os.path.join(workdir, "retrieval.sock"),
+        "RETRIEVAL_LOG": os.path.join(workdir, "retrieval.log"),
+        # Every question is asked once per stage, the answer cache would only hide the work
+        "ANSWER_CACHE_ENABLED": "0",
+    })
+    return env
+
+
+def read_questions(workdir):
+    with open(os.path.join(workdir, "questions.json"), "r") as f:
+        return json.load(f)
+
+
+# ** Stages, each runs in a fresh process with the working directory as cwd **
+def stage_ingestion(args):
+    documents = []
+    for name in sorted(os.listdir(os.path.join("5_job-populate-vectordb", "data"))):
+        with open(os.path.join("5_job-populate-vectordb", "data", name), "r") as f:
+            documents.append(f.read())
+    loader = load_module("load_to_chromadb", os.path.join("5_job-populate-vectordb", "load-to-chromadb.py"))
+
+    split_latencies, chunks = [], []
+    start = time.perf_counter()
+    for document in documents:
+        began = time.perf_counter()
+        chunks += [text for text, _ in loader.split_text_smart(document)]
+        split_latencies.append(time.perf_counter() - began)
+    split = summarize(split_latencies, time.perf_counter() - start)
+    split["chunks"] = len(chunks)
+    split["mb_per_s"] = round(sum(len(d) for d in documents) / 1e6 / max(sum(split_latencies), 1e-9), 3)
+
+    import utils.model_embedding_utils as model_embedding
+    questions = read_questions(".")
+    model_embedding.get_embeddings(questions[0])  # warm up
+    single_latencies = []
+    for question in questions:
+        began = time.perf_counter()
+        model_embedding.get_embeddings(question)
+        single_latencies.append(time.perf_counter() - began)
+
+    began = time.perf_counter()
+    model_embedding.get_embeddings_batch(chunks)
+    batch_seconds = time.perf_counter() - began
+
+    # The populate job as the job runs it, including its chunking, worker processes and Chroma writes
+    began = time.perf_counter()
+    job = subprocess.run([sys.executable, os.path.join("5_job-populate-vectordb", "load-to-chromadb.py")],
+                         capture_output=True, text=True)
+    job_seconds = time.perf_counter() - began
+    if job.returncode != 0:
+        raise RuntimeError(f"Populate job failed:\n{job.stdout[-2000:]}\n{job.stderr[-2000:]}")
+    totals = re.findall(r"Total number of embeddings in Chroma DB index: (\d+)", job.stdout)
+    stored = int(totals[-1]) if totals else None
+
+    return {
+        "documents": len(documents),
+        "split_text_smart": split,
+        "get_embeddings": summarize(single_latencies),
+        "get_embeddings_batch": {"chunks": len(chunks), "seconds": round(batch_seconds, 3),
+                                 "throughput_per_s": round(len(chunks) / max(batch_seconds, 1e-9), 3)},
+        "populate_job": {"seconds": round(job_seconds, 3), "chunks": stored,
+                         "throughput_per_s": round((stored or 0) / max(job_seconds, 1e-9), 3),
+                         "peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN)},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def stage_retrieval(args):
+    app = load_module("query_chroma_app", os.path.join("6_app", "query_chroma_app.py"))
+    app.load_collection()
+    questions = read_questions(".")
+    app.query_chroma(questions[0], n_results=args.top_k)  # warm up
+    latencies = []
+    start = time.perf_counter()
+    for question in questions:
+        began = time.perf_counter()
+        result = app.query_chroma(question, n_results=args.top_k)
+        latencies.append(time.perf_counter() - began)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+    return {"query_chroma": summarize(latencies, time.perf_counter() - start), "top_k": args.top_k,
+            "chunks": app.collection.count(), "peak_rss_mb": peak_rss_mb()}
+
+
+def generate_all(app, model_llm, prompts):
+    latencies, tokens = [], 0
+    start = time.perf_counter()
+    for prompt in prompts:
+        began = time.perf_counter()
+        response = app.get_llm_response(prompt)
+        latencies.append(time.perf_counter() - began)
+        tokens += len(model_llm.encode(response))
+    wall = time.perf_counter() - start
+    result = summarize(latencies, wall)
+    result.update({"generated_tokens": tokens, "tokens_per_s": round(tokens / max(wall, 1e-9), 3)})
+    return result
+
+
+def stage_generation(args):
+    app = load_module("llm_rag_app", os.path.join("6_app", "llm_rag_app.py"))
+    model_llm = app.model_llm
+    model_llm.wait_until_ready()
+
+    # Prompts shaped like the application's: a few chunks of context and the question
+    loader_chunks = []
+    data_dir = os.path.join("5_job-populate-vectordb", "data")
+    for name in sorted(os.listdir(data_dir))[:20]:
+        with open(os.path.join(data_dir, name), "r") as f:
+            loader_chunks += f.read().split("\n\n")
+    rng = random.Random(2)
+    prompts = [app.create_prompt("\n\n".join(rng.sample(loader_chunks, 2)), question)
+               for question in read_questions(".")]
+    app.get_llm_response(prompts[0])  # warm up
+    result = generate_all(app, model_llm, prompts)
+    result["prompt_tokens_mean"] = round(sum(len(model_llm.encode(p)) for p in prompts) / len(prompts), 1)
+    return {"get_llm_generation": result, "generation_params": app.GENERATION_PARAMS, "peak_rss_mb": peak_rss_mb()}
+
+
+def stage_end_to_end(args):
+    app = load_module("llm_rag_app", os.path.join("6_app", "llm_rag_app.py"))
+    app.retrieval_service.start()
+    app.model_llm.wait_until_ready()
+    app.retrieval_service.wait_until_ready(timeout=600)
+    try:
+        questions = read_questions(".")
+        app.answer_question(questions[0], True)  # warm up
+        retrieval, generation, total = [], [], []
+        start = time.perf_counter()
+        for question in questions:
+            began = time.perf_counter()
+            context, metadata = app.query_vector_db(question)
+            if not context:
+                raise RuntimeError(f"Retrieval failed: {metadata}")
+            retrieved = time.perf_counter()
+            app.get_llm_response(app.create_prompt(context, question))
+            done = time.perf_counter()
+            retrieval.append(retrieved - began)
+            generation.append(done - retrieved)
+            total.append(done - began)
+        wall = time.perf_counter() - start
+        # This process and the retrieval service it started
+        tree_rss = process_tree_peak_rss_mb(os.getpid())
+    finally:
+        app.retrieval_service.stop()
+    return {"query_vector_db": summarize(retrieval), "generation": summarize(generation),
+            "total": summarize(total, wall), "peak_rss_mb": peak_rss_mb(), "with_retrieval_service_peak_rss_mb": tree_rss}
+
+
+def run_stage(name, workdir, args, python):
+    """Runs one stage in a fresh process, returns the JSON it prints last."""
+    command = [python, os.path.abspath(__file__), "--stage", name, "--top-k", str(args.top_k)]
+    output = subprocess.run(command, cwd=workdir, env=workdir_env(workdir, args), capture_output=True, text=True)
+    if output.returncode != 0:
+        raise RuntimeError(f"Stage {name} failed:\n{output.stdout[-2000:]}\n{output.stderr[-4000:]}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+# ** Flask: POST / on a running application **
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get_json(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+
+def post_question(url, question):
+    body = urllib.parse.urlencode({"question": question, "use_chroma": "on"}).encode()
+    began = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body), timeout=600) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = None
+    return status, time.perf_counter() - began
+
+
+def bench_flask(workdir, args):
+    port = free_port()
+    env = workdir_env(workdir, args)
+    env["CDSW_READONLY_PORT"] = str(port)
+    server = subprocess.Popen([sys.executable, os.path.join("6_app", "llm_rag_app.py")], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, "flask.log"), "w"))
+    base = f"http://127.0.0.1:{port}"
+    results = []
+    try:
+        deadline = time.time() + 600
+        while True:
+            try:
+                status, body = get_json(base + "/readyz")
+                if status == 200 and body.get("retrieval_service"):
+                    break
+            except (OSError, ValueError):
+                pass
+            if server.poll() is not None or time.time() > deadline:
+                raise RuntimeError(f"llm_rag_app.py did not become ready, see {workdir}/flask.log")
+            time.sleep(0.2)
+
+        questions = read_questions(workdir)
+        post_question(base + "/", questions[0])  # warm up
+        for concurrency in args.concurrency:
+            total = max(args.requests_per_level, concurrency)
+            batch = [questions[i % len(questions)] for i in range(total)]
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+                outcomes = list(pool.map(lambda q: post_question(base + "/", q), batch))
+            wall = time.perf_counter() - start
+            ok = [seconds for status, seconds in outcomes if status == 200]
+            row = {"concurrency": concurrency, **summarize(ok, wall), "requests": total,
+                   "errors": total - len(ok)}
+            results.append(row)
+            print(f"  concurrency {concurrency}: p50 {row['p50_ms']} ms, p95 {row['p95_ms']} ms, "
+                  f"{row['throughput_per_s']} req/s, {row['errors']} errors")
+        server_rss = process_tree_peak_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return {"levels": results, "peak_rss_mb": server_rss}
+
+
+# ** Comparing runs **
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if key == "levels":
+            for level in value:
+                flat.update(flatten(level, f"{prefix}concurrency={level['concurrency']}."))
+        elif isinstance(value, dict) and key != "generation_params":
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(current, baseline, tolerance):
+    """Metrics that are worse than the baseline by more than tolerance (a fraction)."""
+    now, before = flatten(current), flatten(baseline)
+    regressions = []
+    for key, value in now.items():
+        old = before.get(key)
+        if not old or value is None:
+            continue
+        if key.endswith(("_ms", "peak_rss_mb", ".seconds")):
+            worse = value > old * (1 + tolerance)
+        elif key.endswith("_per_s"):
+            worse = value < old * (1 - tolerance)
+        else:
+            continue
+        if worse:
+            regressions.append({"metric": key, "baseline": old, "current": value,
+                                "change": f"{(value - old) / old:+.1%}"})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--llm-model", help="LLM checkpoint, defaults to the tiny GPT-NeoX")
+    parser.add_argument("--embedding-model", help="Embedding model, defaults to the tiny BERT")
+    parser.add_argument("--reranker-model", help="Cross-encoder to re-rank with, off by default")
+    parser.add_argument("--chroma-python", default="/home/cdsw/chroma_venv/bin/python",
+                        help="Python of the chroma venv, runs ingestion, retrieval and the retrieval service")
+    parser.add_argument("--documents", type=int, default=40, help="Documents in the synthetic corpus")
+    parser.add_argument("--paragraphs", type=int, default=30, help="Paragraphs per document")
+    parser.add_argument("--questions", type=int, default=30, help="Questions asked in each stage")
+    parser.add_argument("--top-k", type=int, default=5, help="Chunks retrieved per question (RETRIEVAL_TOP_K)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="Concurrent clients on POST /")
+    parser.add_argument("--requests-per-level", type=int, default=16)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown before --compare fails")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    if args.stage:
+        stage = globals()[f"stage_{args.stage}"]
+        print(json.dumps(stage(args)))
+        return
+
+    if not args.llm_model or not args.embedding_model:
+        from benchmarks.tiny_models import ensure_tiny_models
+        tiny = ensure_tiny_models("/tmp/tiny-models")
+        args.llm_model = args.llm_model or tiny["llm-model"]
+        args.embedding_model = args.embedding_model or tiny["embedding-model"]
+
+    workdir = make_workdir(args)
+    print(f"Working directory {workdir}")
+    results = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                        "machine": platform.machine(), "cpus": os.cpu_count(), "llm_model": args.llm_model,
+                        "embedding_model": args.embedding_model, "reranker_model": args.reranker_model,
+                        "documents": args.documents, "paragraphs": args.paragraphs, "questions": args.questions,
+                        "top_k": args.top_k}}
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        results["meta"]["commit"] = commit.stdout.strip() or None
+    except OSError:
+        pass
+
+    try:
+        # The collection is needed by every later stage
+        stages = ["ingestion"] + [s for s in args.stages if s != "ingestion"]
+        for name in stages:
+            print(f"Running {name}...")
+            sys.stdout.flush()
+            if name == "flask":
+                results[name] = bench_flask(workdir, args)
+            else:
+                python = args.chroma_python if name in ("ingestion", "retrieval") else sys.executable
+                results[name] = run_stage(name, workdir, args, python)
+    finally:
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f"⚠️ Regression: {r['metric']} {r['baseline']} -> {r['current']} ({r['change']})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
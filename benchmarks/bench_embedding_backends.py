@@ -0,0 +1,108 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Parity and latency of the embedding backends in utils/model_embedding_utils.py
+# (EMBEDDING_BACKEND=torch, onnx, onnx-int8). Every backend's embeddings are
+# compared with PyTorch's by cosine similarity; the script exits with status 1
+# when a backend falls below --min-cosine.
+#
+# Usage: python benchmarks/bench_embedding_backends.py [--model models/embedding-model] [--threads 4]
+# Without --model a tiny random checkpoint is built (see benchmarks/tiny_models.py).
+# Needs onnxruntime and onnx (installed in the chroma venv).
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.bench_embeddings import workload
+from benchmarks.tiny_models import ensure_tiny_models
+
+
+def measure(model_embedding, backend, texts, queries, batch_size, reference):
+    embeddings = model_embedding.get_embeddings_batch(texts, batch_size=batch_size, backend=backend)
+    cosine = np.sum(embeddings * reference, axis=1)
+
+    # Query latency: one question per call, like the retrieval service
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        model_embedding.get_embeddings_batch([query], backend=backend)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    model_embedding.get_embeddings_batch(texts, batch_size=batch_size, backend=backend)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "backend": backend,
+        "min_cosine": round(float(cosine.min()), 6),
+        "mean_cosine": round(float(cosine.mean()), 6),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "query_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "batch_sentences_per_s": round(len(texts) / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="Embedding model directory, defaults to a tiny random model")
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--sentences", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, help="Sets EMBEDDING_THREADS")
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    # model_embedding_utils reads its configuration when it is imported
+    os.environ["EMBEDDING_MODEL_PATH"] = args.model or ensure_tiny_models("/tmp/tiny-models")["embedding-model"]
+    os.environ["EMBEDDING_BACKEND"] = "torch"
+    if args.threads:
+        os.environ["EMBEDDING_THREADS"] = str(args.threads)
+    import utils.model_embedding_utils as model_embedding
+
+    texts = workload(args.sentences)
+    queries = [text for text in texts if text.endswith("?")][:args.queries]
+    reference = model_embedding.get_embeddings_batch(texts, batch_size=args.batch_size, backend="torch")
+
+    results = []
+    for backend in args.backends.split(","):
+        # Exports (and quantizes) the ONNX model the first time
+        model_embedding.get_embeddings_batch(texts[:4], backend=backend)
+        results.append(measure(model_embedding, backend, texts, queries, args.batch_size, reference))
+
+    print(f"{len(texts)} sentences, {len(queries)} queries, batch {args.batch_size}")
+    for result in results:
+        print(f"{result['backend']:<10} min cosine {result['min_cosine']:<9} query p50 {result['query_p50_ms']:>8} ms "
+              f"p95 {result['query_p95_ms']:>8} ms  batch {result['batch_sentences_per_s']:>9} sentences/s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = [r["backend"] for r in results if r["min_cosine"] < args.min_cosine]
+    if failed:
+        print(f"Parity check failed for {', '.join(failed)} (min cosine < {args.min_cosine})")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
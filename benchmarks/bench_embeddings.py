@@ -0,0 +1,102 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Sentences/s on CPU of utils/model_embedding_utils.get_embeddings_batch compared
+# with the previous get_embeddings, which embedded one sentence at a time padded
+# to the model's maximum length.
+#
+# Usage: python benchmarks/bench_embeddings.py [--model models/embedding-model] [--threads 4]
+# Without --model a tiny random checkpoint is built (see benchmarks/tiny_models.py).
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.tiny_models import ensure_tiny_models, synthetic_corpus
+
+
+def workload(n, seed=0):
+    """Short questions mixed with chunk sized passages, like queries plus ingestion."""
+    rng = random.Random(seed)
+    sentences = synthetic_corpus(n * 4, seed)
+    texts = []
+    for i in range(n):
+        if i % 2:
+            texts.append(" ".join(rng.sample(sentences, 8)))
+        else:
+            texts.append(sentences[i].split(" ", 6)[-1].rstrip(".") + "?")
+    return texts
+
+
+def baseline_embed(model_embedding, torch, F, sentence):
+    """What get_embeddings did before: padding='max_length', no_grad, tolist()."""
+    encoded_input = model_embedding.tokenizer([sentence], padding='max_length', truncation=True, return_tensors='pt')
+    with torch.no_grad():
+        model_output = model_embedding.load_torch_model()(**encoded_input)
+    sentence_embeddings = model_embedding.mean_pooling(model_output, encoded_input['attention_mask'])
+    return F.normalize(sentence_embeddings, p=2, dim=1).tolist()[0]
+
+
+def run(name, embed, texts, repeat):
+    embed(texts[:4])  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        embed(texts)
+    elapsed = (time.perf_counter() - start) / repeat
+    return {"method": name, "sentences": len(texts), "seconds": round(elapsed, 4),
+            "sentences_per_s": round(len(texts) / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="Embedding model directory, defaults to a tiny random model")
+    parser.add_argument("--sentences", type=int, default=512)
+    parser.add_argument("--batch-sizes", default="1,8,32,128")
+    parser.add_argument("--threads", type=int, help="Sets EMBEDDING_THREADS")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    # model_embedding_utils reads its configuration when it is imported
+    os.environ["EMBEDDING_MODEL_PATH"] = args.model or ensure_tiny_models("/tmp/tiny-models")["embedding-model"]
+    if args.threads:
+        os.environ["EMBEDDING_THREADS"] = str(args.threads)
+    import torch
+    import torch.nn.functional as F
+    import utils.model_embedding_utils as model_embedding
+
+    texts = workload(args.sentences)
+    results = [run("baseline, one at a time, max_length padding",
+                   lambda batch: [baseline_embed(model_embedding, torch, F, text) for text in batch], texts, args.repeat)]
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        results.append(run(f"get_embeddings_batch, batch {batch_size}",
+                           lambda batch: model_embedding.get_embeddings_batch(batch, batch_size=batch_size),
+                           texts, args.repeat))
+
+    print(f"{len(texts)} sentences, {torch.get_num_threads()} threads, max_seq_length {model_embedding.max_seq_length}")
+    for result in results:
+        print(f"{result['method']:<46} {result['sentences_per_s']:>9} sentences/s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
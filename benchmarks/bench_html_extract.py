@@ -0,0 +1,113 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# HTML to text extraction speed and output size of 5_job-populate-vectordb/html-to-text.py
+# compared with the previous whole-page BeautifulSoup(html.parser) extraction.
+#
+# Usage: python benchmarks/bench_html_extract.py [--fixtures DIR]
+# DIR defaults to the crawler's cache (5_job-populate-vectordb/.http-cache), which holds
+# every page saved by the last crawl; synthetic documentation pages are used when it is empty.
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import time
+
+from bs4 import BeautifulSoup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_html_to_text():
+    spec = importlib.util.spec_from_file_location("html_to_text", os.path.join(ROOT, "5_job-populate-vectordb", "html-to-text.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_page(index):
+    nav = "".join(f'<li><a href="/topics/page-{i}.html">Navigation entry {i}</a></li>' for i in range(300))
+    body = "".join(
+        f"<h2>Section {s}</h2>" + "".join(
+            f"<p>Cloudera Machine Learning runs <code>ML Runtimes</code> on Kubernetes and reads Iceberg tables "
+            f"with Spark — paragraph {s}.{p} of page {index}.</p>" for p in range(8))
+        for s in range(12))
+    footer = "".join(f'<a href="/legal/{i}">Footer link {i}</a>' for i in range(60))
+    return (f"<html><head><title>Page {index}</title><script>{'var x = 1;' * 200}</script></head><body>"
+            f"<header><nav><ul>{nav}</ul></nav></header><main>{body}</main><footer>{footer}</footer>"
+            f"</body></html>").encode("utf-8")
+
+
+def baseline_extract(content):
+    """What html-to-text.py did before: whole page, html.parser, per character ASCII filter."""
+    soup = BeautifulSoup(content, 'html.parser')
+    soup_text = soup.get_text()
+    soup_text = soup_text.replace('\n', ' ')
+    return "".join(i for i in soup_text if ord(i) < 128)
+
+
+def run(name, extract, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        outputs = [extract(page) for page in pages]
+    elapsed = (time.perf_counter() - start) / repeat
+    input_bytes = sum(len(page) for page in pages)
+    return {
+        "engine": name,
+        "pages_per_s": round(len(pages) / elapsed, 1),
+        "input_mb_per_s": round(input_bytes / elapsed / 1e6, 2),
+        "avg_output_chars": round(sum(len(o) for o in outputs) / len(outputs)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", default=os.path.join(ROOT, "5_job-populate-vectordb", ".http-cache"))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(args.fixtures, "*.html"))):
+        with open(path, "rb") as f:
+            pages.append(f.read())
+    if not pages:
+        print(f"No HTML fixtures in {args.fixtures}, using synthetic documentation pages")
+        pages = [synthetic_page(i) for i in range(50)]
+
+    html_to_text = load_html_to_text()
+    engines = [
+        ("baseline (html.parser, whole page)", baseline_extract),
+        ("html.parser, main content", lambda page: html_to_text.normalize_text(html_to_text.extract_main_text_bs4(page))),
+    ]
+    if html_to_text.lxml is not None:
+        engines.append(("lxml, main content", html_to_text.extract_main_text))
+    else:
+        print("lxml is not installed, skipping the lxml engine")
+
+    results = [run(name, extract, pages, args.repeat) for name, extract in engines]
+    print(f"{len(pages)} pages, {sum(len(p) for p in pages) / 1e6:.2f} MB")
+    for result in results:
+        print(f"{result['engine']:<36} {result['pages_per_s']:>8} pages/s {result['input_mb_per_s']:>7} MB/s "
+              f"{result['avg_output_chars']:>8} chars/page")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
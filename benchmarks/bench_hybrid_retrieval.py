@@ -0,0 +1,195 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Recall and latency of vector-only retrieval vs the hybrid (vector + BM25,
+# reciprocal rank fusion) retrieval in 6_app/query_chroma_app.py, plus the
+# latency of the BM25 lookup on its own.
+# Queries are generated from the chunks themselves, the chunk a query was made
+# from is the one that should be retrieved:
+# - keyword: a few of the chunk's rarest terms plus common words, like "iceberg time travel"
+# - sentence: a span of the chunk with some words replaced
+#
+# Usage: python benchmarks/bench_hybrid_retrieval.py [--chroma-path chroma-data --collection cml-default --model models/embedding-model]
+# Without --chroma-path a synthetic corpus is indexed with a tiny random embedding
+# model (see benchmarks/tiny_models.py), so its vector recall says little about a
+# real model. Runs in the chroma venv.
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.tiny_models import WORDS, ensure_tiny_models
+from utils.lexical_index import build_index, tokenize
+
+
+def synthetic_chunks(n, vocabulary=20000, seed=0):
+    """Chunks of 80-150 words drawn from a Zipf distributed vocabulary, like product documentation."""
+    rng = np.random.default_rng(seed)
+    words = list(WORDS) + [f"term{i}" for i in range(vocabulary)]
+    probabilities = 1.0 / np.arange(1, len(words) + 1) ** 1.1
+    probabilities /= probabilities.sum()
+    return [" ".join(words[i] for i in rng.choice(len(words), size=int(rng.integers(80, 150)), p=probabilities))
+            for _ in range(n)]
+
+
+def make_queries(ids, documents, n, seed=0):
+    """(query, kind, expected id) known-item queries generated from random chunks."""
+    rng = random.Random(seed)
+    document_frequency = Counter(t for document in documents for t in set(tokenize(document)))
+    queries = []
+    for number in rng.sample(range(len(ids)), min(n, len(ids))):
+        terms = tokenize(documents[number])
+        if len(terms) < 12:
+            continue
+        if len(queries) % 2 == 0:
+            rare = sorted(set(terms), key=lambda t: document_frequency[t])[:rng.randint(2, 3)]
+            common = rng.sample(terms, 2)
+            words = rare + common
+            rng.shuffle(words)
+            queries.append((" ".join(words), "keyword", ids[number]))
+        else:
+            start = rng.randrange(0, len(terms) - 12)
+            span = terms[start:start + 12]
+            span = [rng.choice(terms) if rng.random() < 0.3 else word for word in span]
+            queries.append((" ".join(span), "sentence", ids[number]))
+    return queries
+
+
+def load_query_app():
+    spec = importlib.util.spec_from_file_location("query_chroma_app", os.path.join(ROOT, "6_app", "query_chroma_app.py"))
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return app
+
+
+def percentile_ms(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 3)
+
+
+def evaluate(app, queries, hybrid, k):
+    app.HYBRID_SEARCH = hybrid
+    app.lexical_index_version = None
+    app.query_chroma(queries[0][0], n_results=k)  # warm up
+    latencies, ranks = [], []
+    for query, _, expected in queries:
+        start = time.perf_counter()
+        result = app.query_chroma(query, n_results=k)
+        latencies.append(time.perf_counter() - start)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        ids = [c["id"] for c in result["candidates"]]
+        ranks.append(ids.index(expected) + 1 if expected in ids else None)
+    return latencies, ranks
+
+
+def recall(ranks, at):
+    return round(sum(1 for r in ranks if r is not None and r <= at) / max(len(ranks), 1), 3)
+
+
+def mrr(ranks):
+    return round(sum(1.0 / r for r in ranks if r is not None) / max(len(ranks), 1), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chroma-path", help="Existing Chroma data folder, defaults to a synthetic corpus")
+    parser.add_argument("--collection", default=os.getenv("COLLECTION_NAME", "cml-default"))
+    parser.add_argument("--model", help="Embedding model the collection was built with")
+    parser.add_argument("--chunks", type=int, default=5000, help="Size of the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--k", type=int, default=5, help="Results per query (the app's RETRIEVAL_TOP_K)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    os.environ["EMBEDDING_MODEL_PATH"] = args.model or ensure_tiny_models("/tmp/tiny-models")["embedding-model"]
+    os.environ["COLLECTION_NAME"] = args.collection
+    import chromadb
+    import utils.model_embedding_utils as model_embedding
+
+    chroma_path = args.chroma_path or tempfile.mkdtemp(prefix="bench-hybrid-")
+    client = chromadb.PersistentClient(path=chroma_path)
+    if args.chroma_path:
+        collection = client.get_collection(name=args.collection, embedding_function=None)
+    else:
+        documents = synthetic_chunks(args.chunks)
+        ids = [f"chunk-{i}" for i in range(len(documents))]
+        collection = client.create_collection(name=args.collection, embedding_function=None)
+        embeddings = model_embedding.get_embeddings_batch(documents)
+        batch = client.get_max_batch_size()
+        for start in range(0, len(ids), batch):
+            collection.add(ids=ids[start:start + batch], documents=documents[start:start + batch],
+                           embeddings=embeddings[start:start + batch],
+                           metadatas=[{"Source": i} for i in ids[start:start + batch]])
+
+    everything = collection.get(include=["documents"])
+    index_path = os.path.join(chroma_path, f"bm25-{args.collection}")
+    if not args.chroma_path or not os.path.exists(index_path):
+        start = time.perf_counter()
+        stats = build_index(zip(everything["ids"], everything["documents"]), index_path)
+        print(f"Built BM25 index of {stats['documents']} chunks, {stats['terms']} terms in {time.perf_counter() - start:.2f}s")
+
+    # Run the service's own query code against this collection
+    app = load_query_app()
+    app.CHROMA_DATA_FOLDER = chroma_path
+    app.LEXICAL_INDEX_PATH = index_path
+    app.model_embedding = model_embedding
+    app.collection = collection
+
+    queries = make_queries(everything["ids"], everything["documents"], args.queries)
+    index = app.get_lexical_index()
+    lexical_latencies = []
+    for query, _, _ in queries:
+        start = time.perf_counter()
+        index.search(query, app.HYBRID_CANDIDATES)
+        lexical_latencies.append(time.perf_counter() - start)
+
+    results = []
+    for name, hybrid in (("vector", False), ("hybrid", True)):
+        latencies, ranks = evaluate(app, queries, hybrid, args.k)
+        row = {"retrieval": name, "queries": len(queries), f"recall@1": recall(ranks, 1),
+               f"recall@{args.k}": recall(ranks, args.k), "mrr": mrr(ranks),
+               "p50_ms": percentile_ms(latencies, 50), "p95_ms": percentile_ms(latencies, 95)}
+        for kind in ("keyword", "sentence"):
+            kind_ranks = [r for r, (_, k, _) in zip(ranks, queries) if k == kind]
+            row[f"{kind}_recall@{args.k}"] = recall(kind_ranks, args.k)
+        results.append(row)
+    results.append({"retrieval": "bm25 lookup only", "queries": len(queries),
+                    "p50_ms": percentile_ms(lexical_latencies, 50), "p95_ms": percentile_ms(lexical_latencies, 95)})
+
+    print(f"{collection.count()} chunks in {chroma_path}, {len(queries)} queries, top {args.k}")
+    for r in results:
+        if "mrr" in r:
+            print(f"{r['retrieval']:<17} recall@1 {r['recall@1']:<6} recall@{args.k} {r[f'recall@{args.k}']:<6} "
+                  f"(keyword {r[f'keyword_recall@{args.k}']}, sentence {r[f'sentence_recall@{args.k}']})  "
+                  f"MRR {r['mrr']:<6} p50 {r['p50_ms']:>7} ms  p95 {r['p95_ms']:>7} ms")
+        else:
+            print(f"{r['retrieval']:<17} p50 {r['p50_ms']:>7} ms  p95 {r['p95_ms']:>7} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Greedy decoding tokens/s, load time and peak RSS of the LLM backends in
+# utils/model_llm_utils.py (LLM_BACKEND=bf16, int8, int4) on CPU. Each backend
+# runs in its own process, after a first run that builds the quantized cache,
+# so peak RSS is what a replica needs to load the model and serve.
+# Before that, every quantized backend's saved model is checked: rebuilding it
+# from the cache must give the same layers and logits as the first load, and
+# the same greedy tokens as the model quantized in memory; the script exits
+# with status 1 otherwise.
+#
+# Usage: python benchmarks/bench_llm_backends.py [--model models/llm-model] [--max-new-tokens 64]
+# Without --model a small random GPT-NeoX checkpoint is built (see benchmarks/tiny_models.py).
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PROMPTS = [
+    "<human>: What are ML Runtimes?\n<bot>:",
+    "<human>: How do data scientists use CML?\n<bot>:",
+    "<human>: Answer this question based on given context: Iceberg tables support time travel.\nQuestion: What are iceberg tables?\n<bot>:",
+]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process. ru_maxrss survives exec, so it would include the parent's peak."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(args):
+    """Runs inside the benchmark process of one backend, prints a JSON result."""
+    os.chdir(args.workdir)
+    os.environ["LLM_BACKEND"] = args.backend
+    os.environ["LLM_MAX_BATCH_SIZE"] = "1"
+    start = time.perf_counter()
+    import torch
+    import utils.model_llm_utils as model_llm
+    load_seconds = time.perf_counter() - start
+
+    model, tokenizer = model_llm.model, model_llm.tokenizer
+    generated, outputs, elapsed = 0, [], 0.0
+    with torch.inference_mode():
+        for prompt in PROMPTS * args.repeat:
+            encoded = tokenizer(prompt, return_tensors="pt")
+            start = time.perf_counter()
+            output = model.generate(input_ids=encoded["input_ids"], attention_mask=encoded["attention_mask"],
+                                    max_new_tokens=args.max_new_tokens, min_new_tokens=args.max_new_tokens,
+                                    do_sample=False, pad_token_id=tokenizer.eos_token_id)
+            elapsed += time.perf_counter() - start
+            new_tokens = output[0, encoded["input_ids"].shape[1]:].tolist()
+            generated += len(new_tokens)
+            outputs.append(new_tokens)
+
+    # The public API still works with this backend
+    model_llm.get_llm_generation(PROMPTS[0], ["<human>:"], max_new_tokens=8)
+
+    print(json.dumps({
+        "backend": args.backend,
+        "load_s": round(load_seconds, 2),
+        "tokens_per_s": round(generated / elapsed, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "outputs": outputs,
+    }))
+
+
+def check_saved_model(model_path, backend, max_new_tokens=16):
+    """Compare the model rebuilt from the quantized cache with the one quantized in memory."""
+    import torch
+    from transformers import AutoModelForCausalLM
+    from utils.llm_quantization import load_quantized_model, quantize_model
+
+    cache_dir = tempfile.mkdtemp(prefix=f"bench-llm-{backend}-")
+    converted = load_quantized_model(model_path, backend, cache_dir=cache_dir)
+    loaded = load_quantized_model(model_path, backend, cache_dir=cache_dir)
+    in_memory = quantize_model(AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.bfloat16), backend)
+
+    ids = torch.randint(0, in_memory.config.vocab_size, (1, 32), generator=torch.Generator().manual_seed(0))
+    with torch.inference_mode():
+        logits = [model(ids).logits for model in (converted, loaded, in_memory)]
+        tokens = [model.generate(ids, attention_mask=torch.ones_like(ids), max_new_tokens=max_new_tokens,
+                                 do_sample=False, pad_token_id=0)[0].tolist() for model in (loaded, in_memory)]
+    return {
+        "same_layers": [type(m).__name__ for m in loaded.modules()] == [type(m).__name__ for m in in_memory.modules()],
+        "same_logits_on_reload": torch.equal(logits[0], logits[1]),
+        "max_logit_diff_vs_in_memory": round(float((logits[1] - logits[2]).abs().max()), 5),
+        "same_greedy_tokens": tokens[0] == tokens[1],
+        "files": sorted(os.listdir(cache_dir)),
+    }
+
+
+def run_backend(args, workdir, backend):
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--workdir", workdir, "--backend", backend,
+               "--max-new-tokens", str(args.max_new_tokens), "--repeat", str(args.repeat)]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    if args.threads:
+        env["LLM_THREADS"] = str(args.threads)
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="Causal LM checkpoint, defaults to a small random model")
+    parser.add_argument("--hidden-size", type=int, default=1024, help="Size of the generated model")
+    parser.add_argument("--layers", type=int, default=8, help="Layers of the generated model")
+    parser.add_argument("--backends", default="bf16,int8,int4")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--threads", type=int, help="Sets LLM_THREADS")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    # model_llm_utils loads models/llm-model relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="bench-llm-")
+    os.makedirs(os.path.join(workdir, "models"))
+    model_path = args.model
+    if not model_path:
+        from benchmarks.tiny_models import build_llm
+        model_path = os.path.join(workdir, "source-model")
+        build_llm(model_path, hidden_size=args.hidden_size, num_layers=args.layers)
+    os.symlink(os.path.abspath(model_path), os.path.join(workdir, "models", "llm-model"))
+
+    checks = {backend: check_saved_model(model_path, backend) for backend in args.backends.split(",") if backend != "bf16"}
+    for backend, check in checks.items():
+        print(f"{backend:<6} saved model: {check}")
+
+    results = []
+    for backend in args.backends.split(","):
+        if backend != "bf16":
+            run_backend(args, workdir, backend)  # builds the quantized cache
+        results.append(run_backend(args, workdir, backend))
+
+    # How often each backend's greedy tokens agree with the bf16 baseline
+    reference = next((r["outputs"] for r in results if r["backend"] == "bf16"), None)
+    for result in results:
+        outputs = result.pop("outputs")
+        if reference is not None:
+            same = sum(a == b for ref, out in zip(reference, outputs) for a, b in zip(ref, out))
+            result["token_agreement_vs_bf16"] = round(same / max(sum(len(r) for r in reference), 1), 3)
+
+    print(f"workdir {workdir}")
+    for result in results:
+        print(f"{result['backend']:<6} load {result['load_s']:>7} s  {result['tokens_per_s']:>8} tokens/s  "
+              f"peak RSS {result['peak_rss_mb']:>8} MB  agreement {result.get('token_agreement_vs_bf16')}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"saved_model_checks": checks, "backends": results}, f, indent=2)
+    if not all(c["same_layers"] and c["same_logits_on_reload"] and c["same_greedy_tokens"] for c in checks.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
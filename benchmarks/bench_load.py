@@ -0,0 +1,286 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Load test of llm_rag_app.py's admission control (utils/serving.py) against a
+# running app on a tiny local model:
+# - ramp: POST / at increasing numbers of concurrent clients, reporting how
+#   many questions were answered, shed with 503 or stopped at their deadline
+#   (504), the latency of answers and how fast a 503 comes back
+# - cancellation: clients that disconnect from /stream after the first token
+#   and from POST / while it is answering; their generations must stop and their
+#   slots must free up, read back from /metrics
+#
+# Usage: python benchmarks/bench_load.py [--mode production --max-active 4 --max-waiting 4]
+#        [--concurrency 1 4 16 32] [--request-timeout 30] [--no-retrieval]
+# Without --no-retrieval a synthetic knowledge base is ingested first with the
+# chroma venv (--chroma-python), like benchmarks/bench_e2e.py does.
+
+import argparse
+import concurrent.futures
+import http.client
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.bench_e2e import (free_port, get_json, make_workdir, process_tree_peak_rss_mb, read_questions,
+                                  run_stage, summarize, workdir_env)
+
+
+def ask(port, path, question, use_chroma, timeout=600):
+    """(status, seconds) of one question, status None when the connection failed."""
+    body = urllib.parse.urlencode({"question": question, "use_chroma": "on" if use_chroma else ""})
+    began = time.perf_counter()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        connection.request("POST", path, body, {"Content-Type": "application/x-www-form-urlencoded"})
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except OSError:
+        status = None
+    finally:
+        connection.close()
+    return status, time.perf_counter() - began
+
+
+def read_metrics(port):
+    """{(name, labels text): value} from /metrics."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        connection.request("GET", "/metrics")
+        text = connection.getresponse().read().decode()
+    finally:
+        connection.close()
+    samples = {}
+    for line in text.splitlines():
+        match = re.match(r"^([a-z_]+)(\{[^}]*\})? (\S+)$", line)
+        if match:
+            samples[(match.group(1), match.group(2) or "")] = float(match.group(3))
+    return samples
+
+
+def metric_total(samples, name, **labels):
+    """Sum of name's samples that have all of labels."""
+    wanted = [f'{k}="{v}"' for k, v in labels.items()]
+    return sum(value for (sample, text), value in samples.items()
+               if sample == name and all(w in text for w in wanted))
+
+
+def wait_until_idle(port, timeout=30):
+    """Seconds until no question holds a slot any more, None when they are still held after timeout."""
+    began = time.perf_counter()
+    while time.perf_counter() - began < timeout:
+        samples = read_metrics(port)
+        if metric_total(samples, "rag_admission_active") == 0 and metric_total(samples, "llm_queue_depth") == 0:
+            return round(time.perf_counter() - began, 3)
+        time.sleep(0.1)
+    return None
+
+
+# ** Phases **
+def ramp(port, questions, args):
+    rows = []
+    for concurrency in args.concurrency:
+        total = max(args.requests_per_level, concurrency)
+        batch = [questions[i % len(questions)] for i in range(total)]
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+            outcomes = list(pool.map(lambda q: ask(port, "/", q, not args.no_retrieval), batch))
+        wall = time.perf_counter() - start
+        by_status = {}
+        for status, seconds in outcomes:
+            by_status.setdefault(status, []).append(seconds)
+        answered = by_status.get(200, [])
+        shed = by_status.get(503, [])
+        row = {"concurrency": concurrency, "requests": total, "answered": len(answered), "shed": len(shed),
+               "deadline": len(by_status.get(504, [])),
+               "other": sum(len(v) for k, v in by_status.items() if k not in (200, 503, 504)),
+               "shed_rate": round(len(shed) / total, 3),
+               "answered_latency": summarize(answered, wall) if answered else None,
+               "shed_latency": summarize(shed) if shed else None}
+        rows.append(row)
+        latency = row["answered_latency"] or {}
+        shed_p95 = (row["shed_latency"] or {}).get("p95_ms")
+        print(f"  concurrency {concurrency:>3}: {row['answered']} answered (p50 {latency.get('p50_ms')} ms, "
+              f"p95 {latency.get('p95_ms')} ms, {latency.get('throughput_per_s')} req/s), {row['shed']} shed "
+              f"(p95 {shed_p95} ms), {row['deadline']} past deadline, {row['other']} other")
+        wait_until_idle(port)
+    return rows
+
+
+def disconnect_stream(port, question, use_chroma):
+    """Asks on /stream, hangs up after the first token. Returns seconds to the first token or None."""
+    body = urllib.parse.urlencode({"question": question, "use_chroma": "on" if use_chroma else ""})
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    began = time.perf_counter()
+    try:
+        connection.request("POST", "/stream", body, {"Content-Type": "application/x-www-form-urlencoded"})
+        response = connection.getresponse()
+        if response.status != 200:
+            return None
+        while True:
+            line = response.fp.readline()
+            if not line or line.startswith(b"event: token"):
+                break
+        return time.perf_counter() - began if line else None
+    except OSError:
+        return None
+    finally:
+        # Drop the socket without reading the rest of the answer
+        if connection.sock is not None:
+            connection.sock.close()
+        connection.close()
+
+
+def disconnect_blocking(port, question, use_chroma, after):
+    """Asks on POST / and hangs up after `after` seconds, before the answer is ready."""
+    body = urllib.parse.urlencode({"question": question, "use_chroma": "on" if use_chroma else ""})
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    connection.request("POST", "/", body, {"Content-Type": "application/x-www-form-urlencoded"})
+    time.sleep(after)
+    connection.sock.close()
+    connection.close()
+
+
+def cancellation(port, questions, args):
+    use_chroma = not args.no_retrieval
+    before = read_metrics(port)
+    with concurrent.futures.ThreadPoolExecutor(args.disconnects) as pool:
+        first_tokens = list(pool.map(lambda q: disconnect_stream(port, q, use_chroma),
+                                     questions[:args.disconnects]))
+    stream_idle = wait_until_idle(port)
+    with concurrent.futures.ThreadPoolExecutor(args.disconnects) as pool:
+        list(pool.map(lambda q: disconnect_blocking(port, q, use_chroma, args.hang_up_after),
+                      questions[:args.disconnects]))
+    blocking_idle = wait_until_idle(port)
+    after = read_metrics(port)
+
+    def delta(name, **labels):
+        return int(metric_total(after, name, **labels) - metric_total(before, name, **labels))
+
+    result = {
+        "clients": 2 * args.disconnects,
+        "streams_with_first_token": sum(t is not None for t in first_tokens),
+        "cancelled_questions": delta("rag_admission_stopped_total", reason="cancelled"),
+        "cancelled_generations_decoding": delta("llm_abandoned_generations_total", reason="cancelled", stage="decode"),
+        "cancelled_generations_queued": delta("llm_abandoned_generations_total", reason="cancelled", stage="queue"),
+        "stream_slots_freed_s": stream_idle,
+        "blocking_slots_freed_s": blocking_idle,
+    }
+    print(f"  {result['clients']} clients hung up: {result['cancelled_questions']} questions cancelled, "
+          f"{result['cancelled_generations_decoding']} generations stopped mid-decode, "
+          f"{result['cancelled_generations_queued']} dropped from the queue; slots free after "
+          f"{stream_idle} s (stream) and {blocking_idle} s (POST /)")
+    return result
+
+
+def start_app(workdir, args):
+    port = free_port()
+    env = workdir_env(workdir, args)
+    env.update({"CDSW_READONLY_PORT": str(port), "SERVING_MODE": args.mode,
+                "SERVING_MAX_ACTIVE": str(args.max_active), "SERVING_MAX_WAITING": str(args.max_waiting),
+                "SERVING_QUEUE_TIMEOUT": str(args.queue_timeout),
+                "SERVING_REQUEST_TIMEOUT": str(args.request_timeout), "LLM_MAX_QUEUE": str(args.max_queue)})
+    server = subprocess.Popen([sys.executable, os.path.join("6_app", "llm_rag_app.py")], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, "flask.log"), "w"))
+    deadline = time.time() + 600
+    while True:
+        try:
+            status, body = get_json(f"http://127.0.0.1:{port}/readyz")
+            if status == 200 and (args.no_retrieval or body.get("retrieval_service")):
+                return server, port
+        except (OSError, ValueError):
+            pass
+        if server.poll() is not None or time.time() > deadline:
+            server.kill()
+            raise RuntimeError(f"llm_rag_app.py did not become ready, see {workdir}/flask.log")
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mode", choices=("production", "development"), default="production",
+                        help="SERVING_MODE of the app")
+    parser.add_argument("--max-active", type=int, default=4, help="SERVING_MAX_ACTIVE")
+    parser.add_argument("--max-waiting", type=int, default=4, help="SERVING_MAX_WAITING")
+    parser.add_argument("--queue-timeout", type=float, default=2, help="SERVING_QUEUE_TIMEOUT in seconds")
+    parser.add_argument("--request-timeout", type=float, default=60, help="SERVING_REQUEST_TIMEOUT in seconds")
+    parser.add_argument("--max-queue", type=int, default=32, help="LLM_MAX_QUEUE")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32],
+                        help="Concurrent clients on POST /")
+    parser.add_argument("--requests-per-level", type=int, default=16)
+    parser.add_argument("--disconnects", type=int, default=4, help="Clients hanging up, on each route")
+    parser.add_argument("--hang-up-after", type=float, default=0.5,
+                        help="Seconds after which POST / clients hang up")
+    parser.add_argument("--no-retrieval", action="store_true", help="Ask without the knowledge base")
+    parser.add_argument("--llm-model", help="LLM checkpoint, defaults to the tiny GPT-NeoX")
+    parser.add_argument("--embedding-model", help="Embedding model, defaults to the tiny BERT")
+    parser.add_argument("--chroma-python", default="/home/cdsw/chroma_venv/bin/python",
+                        help="Python of the chroma venv, runs ingestion and the retrieval service")
+    parser.add_argument("--documents", type=int, default=20, help="Documents in the synthetic corpus")
+    parser.add_argument("--paragraphs", type=int, default=20, help="Paragraphs per document")
+    parser.add_argument("--questions", type=int, default=30, help="Distinct questions asked")
+    parser.add_argument("--top-k", type=int, default=5, help="Chunks retrieved per question (RETRIEVAL_TOP_K)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+    args.reranker_model = None
+
+    if not args.llm_model or not args.embedding_model:
+        from benchmarks.tiny_models import ensure_tiny_models
+        tiny = ensure_tiny_models("/tmp/tiny-models")
+        args.llm_model = args.llm_model or tiny["llm-model"]
+        args.embedding_model = args.embedding_model or tiny["embedding-model"]
+
+    workdir = make_workdir(args)
+    print(f"Working directory {workdir}")
+    results = {"meta": {"mode": args.mode, "max_active": args.max_active, "max_waiting": args.max_waiting,
+                        "queue_timeout": args.queue_timeout, "request_timeout": args.request_timeout,
+                        "retrieval": not args.no_retrieval, "llm_model": args.llm_model, "cpus": os.cpu_count()}}
+    server = None
+    try:
+        if not args.no_retrieval:
+            print("Ingesting the synthetic knowledge base...")
+            run_stage("ingestion", workdir, args, args.chroma_python)
+        print(f"Starting llm_rag_app.py ({args.mode})...")
+        server, port = start_app(workdir, args)
+        questions = read_questions(workdir)
+        ask(port, "/", questions[0], not args.no_retrieval)  # warm up
+
+        print("Ramp:")
+        results["ramp"] = ramp(port, questions, args)
+        print("Cancellation:")
+        results["cancellation"] = cancellation(port, questions, args)
+        results["peak_rss_mb"] = process_tree_peak_rss_mb(server.pid)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Several client processes (like llm_only_app.py and llm_rag_app.py side by
+# side) that each load the LLM and embedding model, vs the same clients using
+# the shared model host (utils/model_host.py, MODEL_HOST=1):
+# - resident memory of every process once the models are loaded, in total and
+#   above what importing torch and transformers alone costs each process (with
+#   small models that fixed cost dominates, the rest grows with the checkpoints)
+# - greedy generation from --threads threads in every client at once: tokens/s
+#   and request latency, and how many requests the host ran per batch
+# - single question embeddings from every client at once: latency and how
+#   many requests the host embedded per batch
+# - the generated text and embeddings of both setups are compared; bf16 greedy
+#   text can differ where a prompt was batched with different neighbours, as it
+#   does between batch sizes within one process
+#
+# Usage: python benchmarks/bench_model_host.py [--clients 2 --threads 4 --requests 2 --max-new-tokens 32]
+#        [--llm-model models/llm-model --embedding-model models/embedding-model] [--output results.json]
+# Without model arguments a GPT-NeoX of --llm-hidden-size / --llm-layers and the
+# tiny BERT of benchmarks/tiny_models.py are used.
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.tiny_models import build_llm, ensure_tiny_models
+
+# One client process: loads (or connects to) the models, says "ready", waits for "go" on stdin,
+# runs its share of the workload and prints its results as JSON
+CLIENT_SCRIPT = r'''
+import json, sys, threading, time
+import numpy as np
+import utils.model_llm_utils as model_llm
+import utils.model_embedding_utils as model_embedding
+from utils.model_registry import peak_rss_mb
+
+job = json.loads(sys.argv[1])
+model_llm.wait_until_ready()
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) / 1024 for line in f if line.startswith("VmRSS:"))
+
+loaded_rss = rss_mb()
+print("ready", flush=True)
+sys.stdin.readline()
+
+def run_threads(fn, items):
+    latencies, results = [None] * len(items), [None] * len(items)
+    def work(start):
+        for i in range(start, len(items), job["threads"]):
+            began = time.perf_counter()
+            results[i] = fn(items[i])
+            latencies[i] = time.perf_counter() - began
+    began = time.perf_counter()
+    threads = [threading.Thread(target=work, args=(t,)) for t in range(job["threads"])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, latencies, time.perf_counter() - began
+
+texts, latencies, seconds = run_threads(
+    lambda prompt: model_llm.get_llm_generation(prompt, ["<human>:"], max_new_tokens=job["max_new_tokens"],
+                                                do_sample=False, repetition_penalty=1.0), job["prompts"])
+tokens = sum(len(model_llm.encode(text)) for text in texts)
+sys.stdin.readline()
+embeddings, embed_latencies, _ = run_threads(lambda question: model_embedding.get_embeddings_batch([question])[0],
+                                             job["questions"])
+print(json.dumps({"loaded_rss_mb": round(loaded_rss, 1), "peak_rss_mb": round(peak_rss_mb(), 1),
+                  "texts": texts, "tokens": tokens, "generate_s": seconds, "latencies": latencies,
+                  "embed_latencies": embed_latencies, "embeddings": np.stack(embeddings).tolist()}))
+'''
+
+
+def host_request(socket_path, message):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(message) + "\n").encode())
+        return json.loads(sock.makefile("rb").readline())
+
+
+def import_rss_mb():
+    """Resident memory of a process that only imports torch and transformers, the floor of every client."""
+    code = ("import torch, transformers; from transformers import AutoModel, AutoModelForCausalLM, AutoTokenizer; "
+            "print(next(int(l.split()[1]) / 1024 for l in open('/proc/self/status') if l.startswith('VmRSS:')))")
+    return float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                check=True).stdout.strip().splitlines()[-1])
+
+
+def process_rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        return next(int(line.split()[1]) / 1024 for line in f if line.startswith("VmRSS:"))
+
+
+def make_workdir(llm_model, embedding_model):
+    workdir = tempfile.mkdtemp(prefix="bench-model-host-")
+    os.symlink(os.path.join(ROOT, "utils"), os.path.join(workdir, "utils"))
+    os.makedirs(os.path.join(workdir, "models"))
+    os.symlink(os.path.abspath(llm_model), os.path.join(workdir, "models", "llm-model"))
+    os.symlink(os.path.abspath(embedding_model), os.path.join(workdir, "models", "embedding-model"))
+    return workdir
+
+
+def percentiles(values):
+    return {"p50_ms": round(float(np.percentile(values, 50)) * 1000, 1),
+            "p95_ms": round(float(np.percentile(values, 95)) * 1000, 1)}
+
+
+def run_setup(workdir, args, model_host, prompts, questions, floor_mb):
+    env = dict(os.environ, PYTHONPATH=workdir, MODEL_HOST="1" if model_host else "0",
+               MODEL_HOST_SOCKET=os.path.join(workdir, "model-host.sock"),
+               MODEL_HOST_LOG=os.path.join(workdir, "model-host.log"),
+               EMBEDDING_MODEL_PATH=os.path.join(workdir, "models", "embedding-model"),
+               LLM_MAX_BATCH_SIZE=str(args.clients * args.threads), PREFIX_CACHE_ENABLED="0")
+    clients = []
+    start = time.perf_counter()
+    try:
+        for n in range(args.clients):
+            job = {"threads": args.threads, "max_new_tokens": args.max_new_tokens,
+                   "prompts": prompts[n::args.clients], "questions": questions[n::args.clients]}
+            clients.append(subprocess.Popen([sys.executable, "-c", CLIENT_SCRIPT, json.dumps(job)], cwd=workdir,
+                                            env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                                            start_new_session=True))
+        for client in clients:
+            # The models' loading messages come first
+            line = client.stdout.readline()
+            while line and line.strip() != "ready":
+                line = client.stdout.readline()
+            if not line:
+                raise RuntimeError(f"A client failed to start, see {workdir}/model-host.log")
+        ready_s = time.perf_counter() - start
+        host = host_request(env["MODEL_HOST_SOCKET"], {"op": "stats"}) if model_host else None
+
+        # Generation in every client at once, then embedding
+        for client in clients:
+            client.stdin.write("go\n")
+            client.stdin.flush()
+        for client in clients:
+            client.stdin.write("go\n")
+            client.stdin.flush()
+        outputs = [json.loads(client.stdout.read().strip().splitlines()[-1]) for client in clients]
+        if model_host:
+            host_stats = host_request(env["MODEL_HOST_SOCKET"], {"op": "stats"})
+            host = dict(host_stats, rss_mb=round(process_rss_mb(host_stats["pid"]), 1))
+    finally:
+        # The host, and any standby a second client started, run in the session of the client that started them
+        for client in clients:
+            os.killpg(client.pid, signal.SIGKILL)
+            client.wait()
+
+    texts, embeddings = {}, {}
+    for n, output in enumerate(outputs):
+        texts.update(zip(prompts[n::args.clients], output["texts"]))
+        embeddings.update(zip(questions[n::args.clients], output["embeddings"]))
+    rss = [o["loaded_rss_mb"] for o in outputs] + ([host["rss_mb"]] if host else [])
+    result = {
+        "ready_s": round(ready_s, 2),
+        "client_rss_mb": [o["loaded_rss_mb"] for o in outputs],
+        "total_rss_mb": round(sum(rss), 1),
+        "above_import_mb": round(sum(rss) - floor_mb * len(rss), 1),
+        "tokens_per_s": round(sum(o["tokens"] for o in outputs) / max(o["generate_s"] for o in outputs), 1),
+        "generate": percentiles([latency for o in outputs for latency in o["latencies"]]),
+        "embed": percentiles([latency for o in outputs for latency in o["embed_latencies"]]),
+    }
+    if host:
+        result["host_rss_mb"] = host["rss_mb"]
+        result["llm_requests_per_batch"] = round(host["llm"]["requests"] / max(host["llm"]["batches"], 1), 2)
+        result["embed_requests_per_batch"] = round(
+            host["embedding"]["requests"] / max(host["embedding"]["batches"], 1), 2)
+    return result, texts, embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=2, help="Client processes, like apps running side by side")
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent requests in each client")
+    parser.add_argument("--requests", type=int, default=2, help="Generations per thread")
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--llm-model", help="LLM checkpoint, defaults to a random GPT-NeoX")
+    parser.add_argument("--llm-hidden-size", type=int, default=512)
+    parser.add_argument("--llm-layers", type=int, default=8)
+    parser.add_argument("--embedding-model", help="Embedding model, defaults to the tiny BERT")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    tiny = ensure_tiny_models("/tmp/tiny-models")
+    if not args.llm_model:
+        args.llm_model = f"/tmp/tiny-models/llm-model-{args.llm_hidden_size}x{args.llm_layers}"
+        if not os.path.exists(os.path.join(args.llm_model, "config.json")):
+            build_llm(args.llm_model, hidden_size=args.llm_hidden_size, num_layers=args.llm_layers)
+    args.embedding_model = args.embedding_model or tiny["embedding-model"]
+
+    from benchmarks.tiny_models import synthetic_corpus
+    sentences = synthetic_corpus(200, seed=3)
+    total = args.clients * args.threads * args.requests
+    prompts = [f"<human>: {sentence}\n<bot>:" for sentence in sentences[:total]]
+    questions = sentences[100:100 + args.clients * args.threads * 4]
+
+    floor_mb = import_rss_mb()
+    workdir = make_workdir(args.llm_model, args.embedding_model)
+    results = {"meta": {"clients": args.clients, "threads": args.threads, "requests": total,
+                        "llm_model": args.llm_model, "cpus": os.cpu_count(), "import_rss_mb": round(floor_mb, 1)}}
+    try:
+        results["in_process"], texts, embeddings = run_setup(workdir, args, False, prompts, questions, floor_mb)
+        print(f"in process: {results['in_process']}")
+        results["model_host"], host_texts, host_embeddings = run_setup(workdir, args, True, prompts, questions, floor_mb)
+        print(f"model host: {results['model_host']}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results["identical_generations"] = sum(texts[p] == host_texts[p] for p in prompts) / len(prompts)
+    results["max_embedding_difference"] = float(max(np.max(np.abs(np.subtract(embeddings[q], host_embeddings[q])))
+                                                    for q in questions))
+    local, host = results["in_process"], results["model_host"]
+    print(f"Importing torch and transformers alone: {floor_mb:.1f} MB per process")
+    print(f"{'':<11} {'total RSS MB':>13} {'above imports':>14} {'tokens/s':>9} {'gen p50 ms':>11} {'embed p50 ms':>13}")
+    for name, r in (("in process", local), ("model host", host)):
+        print(f"{name:<11} {r['total_rss_mb']:>13} {r['above_import_mb']:>14} {r['tokens_per_s']:>9} "
+              f"{r['generate']['p50_ms']:>11} {r['embed']['p50_ms']:>13}")
+    print(f"Requests per batch on the host: generation {host['llm_requests_per_batch']}, "
+          f"embedding {host['embed_requests_per_batch']}")
+    print(f"Identical greedy generations: {results['identical_generations']:.0%}, "
+          f"largest embedding difference {results['max_embedding_difference']:.2e}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
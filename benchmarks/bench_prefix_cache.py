@@ -0,0 +1,174 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Time to first token of RAG prompts with and without utils/prefix_cache.py for
+# growing context lengths. Two workloads:
+# - follow-up: several questions about the same retrieved context
+# - new context: every question comes with a different context, only the
+#   template preamble is shared
+# Greedy answers with the cache are checked against the answers without it,
+# one prompt at a time and with all prompts of a workload submitted at once,
+# so their prefill runs as one batch of cache hits and misses.
+#
+# Usage: python benchmarks/bench_prefix_cache.py [--model models/llm-model] [--context-tokens 256,512,1024]
+# Without --model a small random GPT-NeoX checkpoint is built (see benchmarks/tiny_models.py).
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.tiny_models import synthetic_corpus
+from utils.batch_scheduler import BatchScheduler
+from utils.prefix_cache import PrefixCache
+
+QUESTIONS = ["What are ML Runtimes?", "How do data scientists use CML?", "What are iceberg tables?",
+             "Which users can access the workspace?"]
+
+
+def create_prompt(context, question):
+    # Same template as 6_app/llm_rag_app.py
+    return "<human>: Answer this question based on given context: %s\nQuestion: %s\n<bot>:" % (context, question)
+
+
+def create_cache_prefix(prompt):
+    # The template and context, as 6_app/llm_rag_app.py passes it
+    end = prompt.rfind("\nQuestion: ")
+    return prompt[:end] if end >= 0 else None
+
+
+def make_context(tokenizer, sentences, start, tokens):
+    ids = tokenizer.encode(" ".join(sentences[start:start + tokens]))[:tokens]
+    return tokenizer.decode(ids)
+
+
+def time_to_first_token(scheduler, prompt, stop_sequences):
+    start = time.perf_counter()
+    text = scheduler.generate(prompt, stop_sequences, max_new_tokens=1, do_sample=False,
+                              cache_prefix=create_cache_prefix(prompt))
+    return time.perf_counter() - start, text
+
+
+def generate_together(scheduler, prompts, stop_sequences):
+    """Greedy answers of prompts submitted at once, so they are batched together."""
+    requests = [scheduler.submit(prompt, stop_sequences, max_new_tokens=8, do_sample=False,
+                                 cache_prefix=create_cache_prefix(prompt)) for prompt in prompts]
+    return [request.future.result() for request in requests]
+
+
+def run(model, tokenizer, prompts):
+    """Times every prompt without and then with the prefix cache, interleaved so drift affects both alike."""
+    baseline = BatchScheduler(model, tokenizer, max_batch_size=1)
+    prefix_cache = PrefixCache()
+    cached = BatchScheduler(model, tokenizer, max_batch_size=1, prefix_cache=prefix_cache)
+    # Every length falls in one bucket, so the prompts are batched whatever their length
+    batched_baseline = BatchScheduler(model, tokenizer, max_batch_size=len(prompts), max_wait_ms=200,
+                                      length_bucket=1 << 20)
+    batched = BatchScheduler(model, tokenizer, max_batch_size=len(prompts), max_wait_ms=200,
+                             length_bucket=1 << 20, prefix_cache=prefix_cache)
+    stop_sequences = ["<human>:"]
+    for scheduler in (baseline, cached):
+        time_to_first_token(scheduler, prompts[0][:200], stop_sequences)  # warm up
+    prefix_cache.clear()
+
+    result = {"baseline": [], "cached": [], "same_output": True}
+    for prompt in prompts:
+        baseline_seconds, expected = time_to_first_token(baseline, prompt, stop_sequences)
+        cached_seconds, text = time_to_first_token(cached, prompt, stop_sequences)
+        result["baseline"].append(baseline_seconds)
+        result["cached"].append(cached_seconds)
+        result["same_output"] &= text == expected
+    result["stats"] = prefix_cache.stats()
+
+    # Half of the prompts' prefixes are cached, the batch mixes hits and misses
+    prefix_cache.clear()
+    for prompt in prompts[::2]:
+        time_to_first_token(cached, prompt, stop_sequences)
+    result["same_output_batched"] = (generate_together(batched, prompts, stop_sequences) ==
+                                     generate_together(batched_baseline, prompts, stop_sequences))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="Causal LM checkpoint, defaults to a small random model")
+    parser.add_argument("--hidden-size", type=int, default=512, help="Size of the generated model")
+    parser.add_argument("--layers", type=int, default=6, help="Layers of the generated model")
+    parser.add_argument("--context-tokens", default="256,512,1024,1536")
+    parser.add_argument("--contexts", type=int, default=3, help="Distinct contexts per workload")
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model_path = args.model
+    if not model_path:
+        from benchmarks.tiny_models import build_llm
+        model_path = os.path.join(tempfile.mkdtemp(prefix="bench-prefix-cache-"), "llm-model")
+        build_llm(model_path, hidden_size=args.hidden_size, num_layers=args.layers)
+
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=dtype, low_cpu_mem_usage=True).eval()
+    model.to("cuda" if torch.cuda.is_available() else "cpu")
+    tokenizer = AutoTokenizer.from_pretrained(model_path, padding_side="left")
+    sentences = synthetic_corpus(20000)
+
+    results = []
+    for tokens in [int(t) for t in args.context_tokens.split(",")]:
+        contexts = [make_context(tokenizer, sentences, i * tokens, tokens)
+                    for i in range(args.contexts * len(QUESTIONS))]
+        workloads = {
+            "follow-up": [create_prompt(contexts[i], q) for i in range(args.contexts) for q in QUESTIONS],
+            "new context": [create_prompt(c, QUESTIONS[i % len(QUESTIONS)]) for i, c in enumerate(contexts)],
+        }
+        for workload, prompts in workloads.items():
+            result = run(model, tokenizer, prompts)
+            baseline, cached, stats = result["baseline"], result["cached"], result["stats"]
+            results.append({
+                "context_tokens": tokens,
+                "workload": workload,
+                "baseline_ttft_ms": round(statistics.median(baseline) * 1000, 1),
+                "cached_ttft_ms": round(statistics.median(cached) * 1000, 1),
+                "speedup": round(sum(baseline) / sum(cached), 2),
+                "reused_tokens_pct": round(100 * stats["reused_tokens"] /
+                                           max(stats["reused_tokens"] + stats["prefilled_tokens"], 1), 1),
+                "cache_mb": stats["mb"],
+                "same_output": result["same_output"],
+                "same_output_batched": result["same_output_batched"],
+            })
+
+    print(f"model {model_path}, {len(QUESTIONS)} questions per context, median time to first token")
+    for r in results:
+        print(f"{r['context_tokens']:>5} tokens  {r['workload']:<12} baseline {r['baseline_ttft_ms']:>8} ms  "
+              f"cached {r['cached_ttft_ms']:>8} ms  speedup {r['speedup']:>5}x  reused {r['reused_tokens_pct']:>5}%  "
+              f"cache {r['cache_mb']:>7} MB  same output {r['same_output']} (batched {r['same_output_batched']})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not all(r["same_output"] and r["same_output_batched"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
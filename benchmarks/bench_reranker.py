@@ -0,0 +1,123 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Cost of the cross-encoder re-ranking stage (utils/reranker.py) per query:
+# - latency to re-rank the top N candidates for new questions and for repeated
+#   questions (answered from the score cache), for a few batch sizes
+# - how often each time budget falls back to the retrieval order, and the
+#   latency the budget holds a query to, for new and for repeated questions
+#
+# Usage: python benchmarks/bench_reranker.py [--model models/reranker-model --candidates 20 --budgets 50 100 250]
+# Without --model a randomly initialised model with the shape of
+# cross-encoder/ms-marco-MiniLM-L-6-v2 is built, so latencies are realistic
+# while the scores themselves are meaningless.
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.tiny_models import build_reranker_model, synthetic_corpus
+from utils.reranker import CrossEncoderReranker
+
+
+def make_candidates(n_questions, n_candidates, seed=0):
+    """(question, candidates) pairs, candidates are chunks of 100-200 words."""
+    rng = random.Random(seed)
+    sentences = synthetic_corpus(4000, seed=seed)
+    queries = []
+    for _ in range(n_questions):
+        question = rng.choice(sentences)
+        candidates = []
+        for number in range(n_candidates):
+            words = " ".join(rng.sample(sentences, 12)).split()[:rng.randint(100, 200)]
+            candidates.append({"id": f"chunk-{number}", "document": " ".join(words)})
+        queries.append((question, candidates))
+    return queries
+
+
+def percentile_ms(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 2)
+
+
+def run(reranker, queries):
+    latencies, fallbacks = [], 0
+    for question, candidates in queries:
+        start = time.perf_counter()
+        _, reranked = reranker.rerank(question, candidates, top_k=5)
+        latencies.append(time.perf_counter() - start)
+        fallbacks += not reranked
+    return {"p50_ms": percentile_ms(latencies, 50), "p95_ms": percentile_ms(latencies, 95),
+            "max_ms": percentile_ms(latencies, 100), "fallback_rate": round(fallbacks / len(queries), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="Cross-encoder checkpoint, defaults to a random MiniLM-L6 shaped model")
+    parser.add_argument("--candidates", type=int, default=20, help="Candidates re-ranked per question (RERANK_CANDIDATES)")
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--budgets", type=float, nargs="+", default=[25, 100, 250], help="RERANK_BUDGET_MS values")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    model_path = args.model
+    if not model_path:
+        model_path = "/tmp/tiny-models/reranker-minilm-l6"
+        if not os.path.exists(os.path.join(model_path, "config.json")):
+            build_reranker_model(model_path, hidden_size=384, num_layers=6, num_heads=12)
+
+    queries = make_candidates(args.questions, args.candidates)
+    results = []
+
+    # Unbounded budget: what scoring every candidate costs
+    for batch_size in args.batch_sizes:
+        reranker = CrossEncoderReranker(model_path, batch_size=batch_size, budget_ms=1e9)
+        reranker.rerank(*queries[0])  # warm up
+        reranker.cache.clear()
+        row = {"run": "new questions", "batch_size": batch_size, "budget_ms": None, **run(reranker, queries)}
+        results.append(row)
+        results.append({"run": "repeated questions", "batch_size": batch_size, "budget_ms": None,
+                        **run(reranker, queries), "cache": reranker.cache.stats()})
+
+    batch_size = args.batch_sizes[len(args.batch_sizes) // 2]
+    for budget_ms in args.budgets:
+        reranker = CrossEncoderReranker(model_path, batch_size=batch_size, budget_ms=budget_ms)
+        reranker.rerank(*queries[0])  # warm up, this also primes the per pair cost estimate
+        reranker.cache.clear()
+        results.append({"run": "new questions", "batch_size": batch_size, "budget_ms": budget_ms,
+                        **run(reranker, queries)})
+        # Pairs scored before a fallback are cached, so asking again gets further
+        results.append({"run": "repeated questions", "batch_size": batch_size, "budget_ms": budget_ms,
+                        **run(reranker, queries)})
+
+    print(f"{args.questions} questions x {args.candidates} candidates, model {model_path}")
+    for r in results:
+        budget = f"{r['budget_ms']:g} ms" if r["budget_ms"] else "none"
+        print(f"{r['run']:<19} batch {r['batch_size']:<3} budget {budget:<8} p50 {r['p50_ms']:>8} ms  "
+              f"p95 {r['p95_ms']:>8} ms  max {r['max_ms']:>8} ms  fallback {r['fallback_rate']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
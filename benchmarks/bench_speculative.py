@@ -0,0 +1,162 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Greedy decoding through the batch scheduler with and without speculative
+# decoding (utils/speculative.py), one request at a time as in llm_only_app.py:
+# - effective tokens/s (generated tokens over the whole generation time) and
+#   the speedup over plain greedy decoding
+# - acceptance rate: the share of the draft's proposed tokens the model kept,
+#   and tokens kept per forward pass of the model
+# - whether every answer is identical to the one without speculation (exits
+#   with status 1 when one is not)
+# for several starting numbers of proposed tokens (--draft-tokens).
+#
+# Usage: python benchmarks/bench_speculative.py [--model models/llm-model --draft-model models/llm-draft-model]
+#        [--draft-tokens 2,4,6] [--max-new-tokens 64] [--output results.json]
+# Without --model a random GPT-NeoX of --hidden-size / --layers is built, and
+# its draft keeps the first --draft-layers layers (benchmarks/tiny_models.py).
+# Random models barely agree, so the LLM's other layers are scaled down by
+# --damping first: 1 leaves them as they are, smaller values make the pair
+# agree more often, like a draft distilled from its model.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from utils import metrics
+from utils.batch_scheduler import BatchScheduler
+
+PROMPTS = [
+    "<human>: What are ML Runtimes?\n<bot>:",
+    "<human>: How do data scientists use CML?\n<bot>:",
+    "<human>: Answer this question based on given context: Iceberg tables support time travel.\nQuestion: What are iceberg tables?\n<bot>:",
+    "<human>: Which users can access the workspace?\n<bot>:",
+    "<human>: How do I deploy a model as an application?\n<bot>:",
+    "<human>: What is a session in a project?\n<bot>:",
+]
+
+
+def build_pair(workdir, hidden_size, layers, draft_layers, damping):
+    from benchmarks.tiny_models import build_draft_llm, build_llm
+    from transformers import GPTNeoXForCausalLM
+
+    llm_path, draft_path = os.path.join(workdir, "llm-model"), os.path.join(workdir, "llm-draft-model")
+    build_llm(llm_path, hidden_size=hidden_size, num_layers=layers)
+    model = GPTNeoXForCausalLM.from_pretrained(llm_path)
+    with torch.no_grad():
+        for layer in model.gpt_neox.layers[draft_layers:]:
+            layer.attention.dense.weight.mul_(damping)
+            layer.attention.dense.bias.mul_(damping)
+            layer.mlp.dense_4h_to_h.weight.mul_(damping)
+            layer.mlp.dense_4h_to_h.bias.mul_(damping)
+    model.save_pretrained(llm_path)
+    build_draft_llm(llm_path, draft_path, num_layers=draft_layers)
+    return llm_path, draft_path
+
+
+def run(scheduler, prompts, max_new_tokens):
+    """Answers, total generated tokens and seconds, and the draft counts from the requests' traces."""
+    texts, tokens, seconds, proposed, accepted = [], 0, 0.0, 0, 0
+    for prompt in prompts:
+        metrics.start_trace()
+        start = time.perf_counter()
+        texts.append(scheduler.generate(prompt, ["<human>:"], max_new_tokens=max_new_tokens, do_sample=False,
+                                        repetition_penalty=1.07))
+        seconds += time.perf_counter() - start
+        values = metrics.finish_trace(None).values
+        tokens += values["generated_tokens"]
+        proposed += values.get("draft_tokens", 0)
+        accepted += values.get("accepted_draft_tokens", 0)
+    return texts, tokens, seconds, proposed, accepted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", help="Causal LM checkpoint, defaults to a small random model")
+    parser.add_argument("--draft-model", help="Draft checkpoint with the model's tokenizer, required with --model")
+    parser.add_argument("--hidden-size", type=int, default=512, help="Size of the generated model")
+    parser.add_argument("--layers", type=int, default=8, help="Layers of the generated model")
+    parser.add_argument("--draft-layers", type=int, default=1, help="Layers of the generated draft")
+    parser.add_argument("--damping", type=float, default=0.1, help="Scale of the generated model's other layers")
+    parser.add_argument("--draft-tokens", default="2,4,6", help="Starting numbers of proposed tokens")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=2, help="Times every prompt is answered")
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model_path, draft_path = args.model, args.draft_model
+    if not model_path:
+        model_path, draft_path = build_pair(tempfile.mkdtemp(prefix="bench-speculative-"), args.hidden_size,
+                                            args.layers, args.draft_layers, args.damping)
+    elif not draft_path:
+        parser.error("--draft-model is required with --model")
+
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=dtype).to(device).eval()
+    draft_model = AutoModelForCausalLM.from_pretrained(draft_path, torch_dtype=dtype).to(device).eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_path, padding_side="left")
+    prompts = PROMPTS * args.repeats
+
+    baseline = BatchScheduler(model, tokenizer, max_batch_size=1)
+    run(baseline, prompts[:1], 4)  # warm up
+    expected, tokens, seconds, _, _ = run(baseline, prompts, args.max_new_tokens)
+    baseline_tps = tokens / seconds
+    results = {"meta": {"model": model_path, "draft_model": draft_path, "device": device,
+                        "max_new_tokens": args.max_new_tokens, "requests": len(prompts)},
+               "baseline_tokens_per_s": round(baseline_tps, 1), "speculative": []}
+
+    for draft_tokens in [int(n) for n in args.draft_tokens.split(",")]:
+        scheduler = BatchScheduler(model, tokenizer, max_batch_size=1, draft_model=draft_model,
+                                   draft_tokens=draft_tokens)
+        run(scheduler, prompts[:1], 4)
+        texts, tokens, seconds, proposed, accepted = run(scheduler, prompts, args.max_new_tokens)
+        results["speculative"].append({
+            "draft_tokens": draft_tokens,
+            "tokens_per_s": round(tokens / seconds, 1),
+            "speedup": round(tokens / seconds / baseline_tps, 2),
+            "acceptance": round(accepted / max(proposed, 1), 3),
+            # Every forward pass of the model keeps the accepted draft tokens and one of its own
+            "tokens_per_pass": round(tokens / max(tokens - accepted, 1), 2),
+            "identical": sum(t == e for t, e in zip(texts, expected)) / len(prompts),
+        })
+
+    print(f"model {model_path}, draft {draft_path}, {len(prompts)} greedy requests of up to "
+          f"{args.max_new_tokens} tokens on {device}")
+    print(f"plain greedy: {results['baseline_tokens_per_s']} tokens/s")
+    for r in results["speculative"]:
+        print(f"draft tokens {r['draft_tokens']:>2}  {r['tokens_per_s']:>8} tokens/s  speedup {r['speedup']:>5}x  "
+              f"acceptance {r['acceptance']:>6.1%}  tokens per pass {r['tokens_per_pass']:>5}  "
+              f"identical {r['identical']:.0%}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if any(r["identical"] < 1 for r in results["speculative"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Parity and speed of the memory mapped exact search index (utils/vector_index.py)
+# against the Chroma collection it is exported from:
+# - top-k overlap with Chroma's results and recall against an exact search, for
+#   each stored dtype (float32, float16, int8), and the largest distance difference
+# - time to open the index in a fresh process vs importing chromadb and opening
+#   the collection, the size on disk and the query latency
+# Exits with status 1 when the float32 index agrees with Chroma on fewer than
+# --min-parity of the top-k results.
+#
+# Usage: python benchmarks/bench_vector_index.py [--chroma-path chroma-data --collection cml-default]
+#        [--chunks 5000 --dim 384 --k 5]
+# Without --chroma-path a Chroma collection of clustered random unit vectors is
+# created in a temporary directory. Runs in the chroma venv.
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from benchmarks.tiny_models import synthetic_corpus
+from utils.vector_index import DTYPES, build_index, index_size, normalize, open_index
+
+
+def synthetic_collection(client, name, n, dim, seed=0):
+    """A collection of n unit vectors in clusters, like embeddings of documentation pages."""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((max(1, n // 20), dim)))
+    vectors = normalize(centers[rng.integers(0, len(centers), n)] + 0.35 * rng.standard_normal((n, dim)) / np.sqrt(dim) * 4)
+    sentences = synthetic_corpus(n, seed=seed)
+    collection = client.create_collection(name=name, embedding_function=None)
+    batch = client.get_max_batch_size()
+    for start in range(0, n, batch):
+        end = min(start + batch, n)
+        collection.add(ids=[f"chunk-{i}" for i in range(start, end)], embeddings=vectors[start:end],
+                       documents=sentences[start:end],
+                       metadatas=[{"Source": f"doc-{i // 30}", "Snippet": i % 30 + 1} for i in range(start, end)])
+    return collection
+
+
+def read_collection(collection, page_size=5000):
+    ids, embeddings, documents, metadatas = [], [], [], []
+    offset = 0
+    while True:
+        page = collection.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        ids += page["ids"]
+        embeddings.append(np.asarray(page["embeddings"], dtype=np.float32))
+        documents += page["documents"]
+        metadatas += page["metadatas"]
+        offset += len(page["ids"])
+    return ids, np.concatenate(embeddings), documents, metadatas
+
+
+def cold_open_ms(code, repeats=3):
+    """Milliseconds a fresh python process spends running code (it prints its own timing)."""
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT)
+        if output.returncode != 0:
+            raise RuntimeError(output.stderr[-2000:])
+        timings.append(float(output.stdout.strip().splitlines()[-1]))
+    return round(min(timings), 2)
+
+
+def latency_ms(fn, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        timings.append(time.perf_counter() - start)
+    return {"p50_ms": round(float(np.percentile(timings, 50)) * 1000, 3),
+            "p95_ms": round(float(np.percentile(timings, 95)) * 1000, 3)}
+
+
+def overlap(a, b):
+    return len(set(a) & set(b)) / max(len(b), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chroma-path", help="Existing Chroma data folder, defaults to a synthetic collection")
+    parser.add_argument("--collection", default=os.getenv("COLLECTION_NAME", "cml-default"))
+    parser.add_argument("--chunks", type=int, default=5000, help="Rows of the synthetic collection")
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of the synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5, help="Results compared per query")
+    parser.add_argument("--min-parity", type=float, default=0.98,
+                        help="Required mean top-k overlap of the float32 index with Chroma")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    import chromadb
+
+    workdir = tempfile.mkdtemp(prefix="bench-vector-index-")
+    try:
+        if args.chroma_path:
+            chroma_path = args.chroma_path
+            collection = chromadb.PersistentClient(path=chroma_path).get_collection(args.collection)
+        else:
+            chroma_path = os.path.join(workdir, "chroma-data")
+            collection = synthetic_collection(chromadb.PersistentClient(path=chroma_path), args.collection,
+                                              args.chunks, args.dim)
+        metric = (collection.metadata or {}).get("hnsw:space", "l2")
+        ids, embeddings, documents, metadatas = read_collection(collection)
+        print(f"{len(ids)} chunks of dimension {embeddings.shape[1]}, metric {metric}")
+
+        # Questions close to, but not exactly at, stored chunks
+        rng = np.random.default_rng(1)
+        rows = rng.choice(len(ids), size=min(args.queries, len(ids)), replace=False)
+        queries = normalize(normalize(embeddings[rows]) + 0.5 * rng.standard_normal((len(rows), embeddings.shape[1]))
+                            / np.sqrt(embeddings.shape[1]))
+        exact = normalize(embeddings) @ queries.T
+        exact_top = [[ids[i] for i in np.argsort(-exact[:, q], kind="stable")[:args.k]] for q in range(len(rows))]
+
+        chroma_results = collection.query(query_embeddings=queries, n_results=args.k)
+        chroma_top = chroma_results["ids"]
+        chroma_distances = [dict(zip(i, d)) for i, d in zip(chroma_results["ids"], chroma_results["distances"])]
+        chroma_size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(chroma_path) for f in files)
+        results = {"chunks": len(ids), "dim": int(embeddings.shape[1]), "k": args.k, "chroma": {
+            "recall_vs_exact": round(float(np.mean([overlap(c, e) for c, e in zip(chroma_top, exact_top)])), 4),
+            "query": latency_ms(lambda q: collection.query(query_embeddings=q[None, :], n_results=args.k), queries),
+            "open_ms": cold_open_ms(
+                "import time; t = time.perf_counter(); import chromadb; "
+                f"c = chromadb.PersistentClient(path={chroma_path!r}).get_collection({args.collection!r}); "
+                f"c.query(query_embeddings=[[0.0] * {embeddings.shape[1]}], n_results=1); "
+                "print((time.perf_counter() - t) * 1000)"),
+            "bytes": chroma_size}}
+
+        for dtype in DTYPES:
+            path = os.path.join(workdir, f"vectors-{dtype}")
+            start = time.perf_counter()
+            build_index(zip(ids, embeddings, documents, metadatas), path, dtype, metric)
+            build_seconds = time.perf_counter() - start
+            index = open_index(path)
+            top = [index.query(q, args.k) for q in queries]
+            distance_error = max((abs(c["distance"] - chroma_distances[n][c["id"]])
+                                  for n, candidates in enumerate(top) for c in candidates
+                                  if c["id"] in chroma_distances[n]), default=0.0)
+            top_ids = [[c["id"] for c in candidates] for candidates in top]
+            results[dtype] = {
+                "parity_vs_chroma": round(float(np.mean([overlap(t, c) for t, c in zip(top_ids, chroma_top)])), 4),
+                "recall_vs_exact": round(float(np.mean([overlap(t, e) for t, e in zip(top_ids, exact_top)])), 4),
+                "max_distance_error": round(float(distance_error), 6),
+                "query": latency_ms(lambda q: index.query(q, args.k), queries),
+                "open_ms": cold_open_ms(
+                    "import time; t = time.perf_counter(); from utils.vector_index import open_index; "
+                    f"i = open_index({path!r}); i.query([1.0] + [0.0] * {embeddings.shape[1] - 1}, 1); "
+                    "print((time.perf_counter() - t) * 1000)"),
+                "build_s": round(build_seconds, 3),
+                "bytes": index_size(path)}
+
+        print(f"{'backend':<9} {'parity':>7} {'recall':>7} {'dist err':>9} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'open ms':>8} {'MB':>7}")
+        for name in ("chroma",) + DTYPES:
+            r = results[name]
+            print(f"{name:<9} {r.get('parity_vs_chroma', 1.0):>7} {r['recall_vs_exact']:>7} "
+                  f"{r.get('max_distance_error', 0.0):>9} {r['query']['p50_ms']:>8} {r['query']['p95_ms']:>8} "
+                  f"{r['open_ms']:>8} {r['bytes'] / 1e6:>7.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if results["float32"]["parity_vs_chroma"] < args.min_parity:
+        print(f"⚠️ float32 index agrees with Chroma on {results['float32']['parity_vs_chroma']:.1%} of the top "
+              f"{args.k}, below --min-parity {args.min_parity:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
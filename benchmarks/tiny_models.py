@@ -0,0 +1,127 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Builds tiny randomly initialised checkpoints with the same layout as
+# models/llm-model (GPT-NeoX), models/llm-draft-model (a shallower copy of
+# the LLM), models/embedding-model (BERT) and models/reranker-model (BERT
+# cross-encoder), so benchmarks can exercise the real code paths on a laptop
+# CPU without downloading anything.
+#
+# Usage: python benchmarks/tiny_models.py [output_dir]
+
+import os
+import random
+import sys
+
+import torch
+from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers, processors, trainers
+from transformers import (BertConfig, BertForSequenceClassification, BertModel, BertTokenizerFast, GPTNeoXConfig,
+                          GPTNeoXForCausalLM, PreTrainedTokenizerFast)
+
+WORDS = ("the a of and to is are cloudera machine learning ml runtimes iceberg tables spark kubernetes "
+         "data scientists users cml workspace model models deploy project session job jobs application "
+         "gpu cpu answer question context human bot engineers experiments notebooks python").split()
+
+
+def synthetic_corpus(n_sentences=2000, seed=0):
+    """Sentences built from a small product vocabulary, also used as a benchmark corpus."""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))).capitalize() + "."
+            for _ in range(n_sentences)]
+
+
+def build_llm(path, hidden_size=64, num_layers=2, seed=0):
+    corpus = synthetic_corpus() + ["<human>: Question: what is cml?\n<bot>: CML is a platform."] * 50
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(corpus, trainers.BpeTrainer(
+        vocab_size=512, special_tokens=["<|endoftext|>"], initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>",
+                                        bos_token="<|endoftext|>", unk_token="<|endoftext|>")
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = GPTNeoXConfig(vocab_size=len(tokenizer), hidden_size=hidden_size, num_hidden_layers=num_layers,
+                           num_attention_heads=4, intermediate_size=hidden_size * 4, max_position_embeddings=2048,
+                           bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id)
+    GPTNeoXForCausalLM(config).save_pretrained(path)
+
+
+def build_draft_llm(llm_path, path, num_layers=1):
+    """Draft model for speculative decoding paired with the LLM in llm_path: the same tokenizer, embeddings and
+    output head with only its first num_layers layers, so its guesses agree with the LLM's now and then."""
+    tokenizer = PreTrainedTokenizerFast.from_pretrained(llm_path)
+    tokenizer.save_pretrained(path)
+
+    model = GPTNeoXForCausalLM.from_pretrained(llm_path)
+    model.gpt_neox.layers = model.gpt_neox.layers[:num_layers]
+    model.config.num_hidden_layers = num_layers
+    model.save_pretrained(path)
+
+
+def build_bert_tokenizer():
+    tokenizer = Tokenizer(models.WordPiece(unk_token="[UNK]"))
+    tokenizer.normalizer = normalizers.BertNormalizer(lowercase=True)
+    tokenizer.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    tokenizer.decoder = decoders.WordPiece()
+    tokenizer.train_from_iterator(synthetic_corpus(), trainers.WordPieceTrainer(
+        vocab_size=300, special_tokens=["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]))
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]", pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+        special_tokens=[("[CLS]", tokenizer.token_to_id("[CLS]")), ("[SEP]", tokenizer.token_to_id("[SEP]"))])
+    return BertTokenizerFast(tokenizer_object=tokenizer, model_max_length=256)
+
+
+def build_embedding_model(path, hidden_size=32, num_layers=2, seed=0):
+    tokenizer = build_bert_tokenizer()
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = BertConfig(vocab_size=len(tokenizer), hidden_size=hidden_size, num_hidden_layers=num_layers,
+                        num_attention_heads=2, intermediate_size=hidden_size * 2, max_position_embeddings=512)
+    BertModel(config).save_pretrained(path)
+
+
+def build_reranker_model(path, hidden_size=32, num_layers=2, num_heads=2, seed=0):
+    """Cross-encoder with a single relevance logit, like cross-encoder/ms-marco-MiniLM-L-6-v2
+    (hidden_size=384, num_layers=6, num_heads=12 gives its shape and speed)."""
+    tokenizer = build_bert_tokenizer()
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = BertConfig(vocab_size=len(tokenizer), hidden_size=hidden_size, num_hidden_layers=num_layers,
+                        num_attention_heads=num_heads, intermediate_size=hidden_size * 4,
+                        max_position_embeddings=512, num_labels=1)
+    BertForSequenceClassification(config).save_pretrained(path)
+
+
+def ensure_tiny_models(output_dir):
+    """Build the tiny checkpoints once and return {name: path}."""
+    paths = {
+        "llm-model": os.path.join(output_dir, "llm-model"),
+        "embedding-model": os.path.join(output_dir, "embedding-model"),
+        "reranker-model": os.path.join(output_dir, "reranker-model"),
+    }
+    if not os.path.exists(os.path.join(paths["llm-model"], "config.json")):
+        build_llm(paths["llm-model"])
+    if not os.path.exists(os.path.join(paths["embedding-model"], "config.json")):
+        build_embedding_model(paths["embedding-model"])
+    if not os.path.exists(os.path.join(paths["reranker-model"], "config.json")):
+        build_reranker_model(paths["reranker-model"])
+    return paths
+
+
+if __name__ == "__main__":
+    print(ensure_tiny_models(sys.argv[1] if len(sys.argv) > 1 else "/tmp/tiny-models"))
@@ -0,0 +1,300 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Two tier cache for generated answers.
+# - exact tier: keyed on the normalized prompt plus the generation parameters,
+#   only used for deterministic generation (do_sample=False)
+# - semantic tier: keyed on the question embedding, a lookup hits when the
+#   cosine similarity with a cached question is above a threshold
+# Entries are evicted least recently used first, expire after a TTL and the
+# whole cache is bounded by entry count and approximate size in bytes.
+# With a persist_path the cache is written to disk by a background thread
+# every save_interval seconds when it changed, and once more at exit.
+
+import atexit
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace so trivially different prompts share a key."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+class _Entry:
+    def __init__(self, key, params, value, embedding, created):
+        self.key = key
+        self.params = params
+        self.value = value
+        self.embedding = embedding
+        self.created = created
+        self.size = len(key) + len(params) + len(json.dumps(value)) + (embedding.nbytes if embedding is not None else 0)
+
+
+class AnswerCache:
+    """LRU/TTL answer cache with an exact and a semantic tier.
+
+    Values are any JSON serialisable object. embed_fn maps a question to a
+    1-d embedding; without it only the exact tier is used.
+    """
+
+    def __init__(self, embed_fn=None, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl_seconds=3600,
+                 similarity_threshold=0.95, persist_path=None, save_interval=60):
+        self.embed_fn = embed_fn
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.persist_path = persist_path
+        self.save_interval = save_interval
+
+        self.version = None
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = {"exact": 0, "semantic": 0}
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._matrix = None
+        self._lock = threading.RLock()
+        # Changed since the last save, the saver thread only starts with the first change
+        self._dirty = False
+        self._saver = None
+        self._save_lock = threading.Lock()
+
+        if persist_path:
+            if os.path.exists(persist_path):
+                self.load()
+            atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls, embed_fn=None, default_path=None):
+        """Build a cache configured by the ANSWER_CACHE_* environment variables, None when disabled."""
+        if os.getenv("ANSWER_CACHE_ENABLED", "1") != "1":
+            return None
+        return cls(
+            embed_fn=embed_fn if os.getenv("ANSWER_CACHE_SEMANTIC", "1") == "1" else None,
+            max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1024")),
+            max_bytes=int(float(os.getenv("ANSWER_CACHE_MAX_MB", "64")) * 1024 * 1024),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+            similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")),
+            persist_path=os.getenv("ANSWER_CACHE_PATH", default_path),
+            save_interval=float(os.getenv("ANSWER_CACHE_SAVE_INTERVAL", "60")),
+        )
+
+    @staticmethod
+    def exact_key(prompt, params):
+        return hashlib.sha256((normalize_text(prompt) + "\0" + params_key(params)).encode("utf-8")).hexdigest()
+
+    def embed(self, question):
+        """Normalized float32 embedding for question, None without a semantic tier."""
+        if self.embed_fn is None or not question:
+            return None
+        embedding = np.asarray(self.embed_fn(question), dtype=np.float32).ravel()
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+    # ** Lookups **
+    def get(self, prompt=None, params=None, embedding=None):
+        """Return the cached value for prompt/params (exact tier) or embedding (semantic tier)."""
+        params = params or {}
+        with self._lock:
+            self._expire()
+
+            if prompt is not None and not params.get("do_sample", False):
+                entry = self._entries.get(self.exact_key(prompt, params))
+                if entry is not None:
+                    self._entries.move_to_end(entry.key)
+                    self.hits["exact"] += 1
+                    return entry.value
+                self.misses["exact"] += 1
+
+            if embedding is not None:
+                entry = self._nearest(embedding, params_key(params))
+                if entry is not None:
+                    self._entries.move_to_end(entry.key)
+                    self.hits["semantic"] += 1
+                    return entry.value
+                self.misses["semantic"] += 1
+
+            return None
+
+    def lookup(self, question, prompt=None, params=None):
+        """Exact tier first, then embed the question for the semantic tier.
+
+        Returns (value or None, question embedding or None), pass the
+        embedding back to put() to avoid embedding the question twice.
+        """
+        value = self.get(prompt=prompt, params=params)
+        if value is not None:
+            return value, None
+        embedding = self.embed(question)
+        if embedding is None:
+            return None, None
+        return self.get(params=params, embedding=embedding), embedding
+
+    def _nearest(self, embedding, params):
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            entries = [e for e in self._entries.values() if e.embedding is not None]
+            if not entries:
+                return None
+            self._matrix = (entries, np.stack([e.embedding for e in entries]))
+        entries, matrix = self._matrix
+        if matrix.shape[1] != embedding.shape[0]:
+            return None
+
+        scores = matrix @ embedding
+        for index in np.argsort(-scores):
+            if scores[index] < self.similarity_threshold:
+                return None
+            if entries[index].params == params:
+                return entries[index]
+        return None
+
+    # ** Updates **
+    def put(self, value, prompt=None, params=None, embedding=None):
+        """Cache value under the exact key (deterministic generation only) and/or the embedding."""
+        params = params or {}
+        if prompt is not None and not params.get("do_sample", False):
+            key = self.exact_key(prompt, params)
+        elif embedding is not None:
+            # Semantic only entry, keyed on the embedding itself
+            key = "semantic:" + hashlib.sha256(embedding.tobytes() + params_key(params).encode("utf-8")).hexdigest()
+        else:
+            return
+
+        with self._lock:
+            self._remove(key)
+            entry = _Entry(key, params_key(params), value, embedding, time.time())
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._matrix = None
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+            self._changed()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            self._matrix = None
+
+    def _expire(self):
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry.created < cutoff]
+        for key in expired:
+            self._remove(key)
+
+    def invalidate(self):
+        """Drop every cached answer."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._matrix = None
+            self._changed()
+
+    def check_version(self, version):
+        """Invalidate when the knowledge base the answers were built from changed."""
+        with self._lock:
+            if version is not None and version != self.version:
+                if self.version is not None or self._entries:
+                    print(f"Knowledge base changed ({self.version} -> {version}), clearing answer cache")
+                    self.invalidate()
+                self.version = version
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": dict(self.hits), "misses": dict(self.misses)}
+
+    # ** Persistence **
+    def _changed(self):
+        # Called with _lock held
+        if not self.persist_path:
+            return
+        self._dirty = True
+        if self._saver is None and self.save_interval:
+            self._saver = threading.Thread(target=self._save_periodically, name="answer-cache-saver", daemon=True)
+            self._saver.start()
+
+    def _save_periodically(self):
+        while True:
+            time.sleep(self.save_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Could not save answer cache to {self.persist_path}: {e}")
+
+    def flush(self):
+        """Save the cache when it changed since the last save."""
+        if self.persist_path and self._dirty:
+            self.save()
+
+    def save(self):
+        with self._save_lock:
+            # Entries are never modified once cached, so only the list is copied under the lock and
+            # serialising and writing do not hold up lookups
+            with self._lock:
+                version, entries = self.version, list(self._entries.values())
+                self._dirty = False
+            state = {
+                "version": version,
+                "entries": [
+                    {"key": e.key, "params": e.params, "value": e.value, "created": e.created,
+                     "embedding": e.embedding.tolist() if e.embedding is not None else None}
+                    for e in entries
+                ],
+            }
+            try:
+                directory = os.path.dirname(os.path.abspath(self.persist_path))
+                os.makedirs(directory, exist_ok=True)
+                # Write to a temp file first so a crash never leaves a truncated cache behind
+                with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+                    json.dump(state, f)
+                os.replace(f.name, self.persist_path)
+            except Exception:
+                self._dirty = True
+                raise
+
+    def load(self):
+        try:
+            with open(self.persist_path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load answer cache from {self.persist_path}: {e}")
+            return
+        with self._lock:
+            self.version = state.get("version")
+            for item in state.get("entries", []):
+                embedding = np.asarray(item["embedding"], dtype=np.float32) if item["embedding"] is not None else None
+                entry = _Entry(item["key"], item["params"], item["value"], embedding, item["created"])
+                self._entries[entry.key] = entry
+                self._bytes += entry.size
+            self._expire()
+            # The file may have been saved under larger limits
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
@@ -0,0 +1,383 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Dynamic batching in front of a causal LM. Prompts from concurrent callers
+# are queued, grouped by generation settings and prompt length and run as
+# left padded batches. Each caller gets back its own text (or text stream).
+# The queue is bounded, and a request that is past its deadline or whose
+# caller has gone away is dropped from the queue or stops decoding mid-batch.
+# With a draft model, a greedy request that has no batch to join is decoded
+# speculatively instead: the draft proposes a few tokens and the model checks
+# them all in one forward pass, which gives the same text as plain greedy decoding.
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import torch
+from transformers import StoppingCriteriaList
+
+from utils import metrics, speculative
+from utils.serving import POLL_INTERVAL, DeadlineExceeded, Overloaded, RequestCancelled
+from utils.stop_sequences import StopSequenceCriteria, StopSequenceMatcher, make_decoder
+
+
+class _Request:
+    def __init__(self, prompt, input_length, stop_sequences, params, stream, deadline=None, cache_length=None):
+        self.prompt = prompt
+        self.input_length = input_length
+        # Leading prompt tokens the prefix cache keeps, None to keep nothing
+        self.cache_length = cache_length
+        self.stop_sequences = stop_sequences
+        self.params = params
+        self.key = tuple(sorted(params.items()))
+        self.arrival = time.monotonic()
+        self.future = Future()
+        self.stream = queue.Queue() if stream else None
+        # time.monotonic() after which nobody waits for the answer any more
+        self.deadline = deadline
+        self.cancelled = False
+        # Set when the request's row was stopped mid-batch because it was abandoned
+        self.stopped_early = False
+        # Seconds per stage and generated token count, filled in by the scheduler thread
+        self.timings = {}
+        self.generated_tokens = 0
+        # Tokens the draft model proposed and how many of them the model accepted, 0 without speculation
+        self.draft_tokens = 0
+        self.accepted_draft_tokens = 0
+
+    def cancel(self):
+        """Stop generating for this request: it is dropped from the queue or its row stops decoding."""
+        self.cancelled = True
+
+    def abandoned(self):
+        return self.cancelled or (self.deadline is not None and time.monotonic() > self.deadline)
+
+    def abandoned_error(self):
+        if self.cancelled:
+            return RequestCancelled("Generation cancelled")
+        return DeadlineExceeded("Generation did not finish before the deadline")
+
+    def record(self):
+        """Report this request's stages and token counts, from the caller's thread so they land in its trace."""
+        record_generation(self.timings, self.input_length, self.generated_tokens, self.draft_tokens,
+                          self.accepted_draft_tokens)
+
+
+def record_generation(timings, prompt_tokens, generated_tokens, draft_tokens=0, accepted_draft_tokens=0):
+    """Report one generation's seconds per stage and token counts to the current trace and the metrics."""
+    for stage, seconds in timings.items():
+        metrics.record_stage(stage, seconds)
+    metrics.record_value("prompt_tokens", prompt_tokens)
+    metrics.record_value("generated_tokens", generated_tokens)
+    decode = timings.get("decode")
+    if decode:
+        metrics.record_value("tokens_per_s", round(max(generated_tokens - 1, 0) / decode, 1))
+    if metrics.METRICS_ENABLED:
+        metrics.PROMPT_TOKENS.observe(prompt_tokens)
+        metrics.GENERATED_TOKENS.observe(generated_tokens)
+        metrics.GENERATED_TOKENS_TOTAL.inc(generated_tokens)
+    if draft_tokens:
+        metrics.record_value("draft_tokens", draft_tokens)
+        metrics.record_value("accepted_draft_tokens", accepted_draft_tokens)
+        metrics.record_value("draft_acceptance", round(accepted_draft_tokens / draft_tokens, 3))
+        if metrics.METRICS_ENABLED:
+            metrics.DRAFT_TOKENS.inc(accepted_draft_tokens, result="accepted")
+            metrics.DRAFT_TOKENS.inc(draft_tokens - accepted_draft_tokens, result="rejected")
+
+
+class BatchScheduler:
+    """Queues generation requests and runs them through the model in padded batches.
+
+    A batch is started as soon as max_batch_size compatible requests are waiting,
+    or max_wait_ms after the oldest waiting request arrived. Requests are
+    compatible when they share generation parameters and fall in
+    the same prompt length bucket, which keeps the padding overhead small.
+    At most max_queue requests wait (0 for no limit), submitting more raises Overloaded.
+    A greedy request batched alone is decoded speculatively (utils/speculative.py)
+    with draft_model when given, a small causal LM with the same tokenizer,
+    starting at draft_tokens proposed tokens per pass.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8, max_wait_ms=20, length_bucket=256, prefix_cache=None,
+                 max_queue=0, draft_model=None, draft_tokens=5):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.length_bucket = length_bucket
+        self.max_queue = max_queue
+        # Optional utils.prefix_cache.PrefixCache, reuses the prefill of shared prompt prefixes
+        self.prefix_cache = prefix_cache
+        self.speculative_decoder = None
+        if draft_model is not None:
+            self.speculative_decoder = speculative.SpeculativeDecoder(model, draft_model, draft_tokens)
+
+        # Batches are left padded so every row's new tokens line up at the end
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+        # Fast tokenizers are not safe to call from several threads at once
+        self._tokenizer_lock = threading.Lock()
+        self._decode = make_decoder(tokenizer, self._tokenizer_lock)
+        self._pending = []
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name="llm-batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def queue_depth(self):
+        """Number of requests waiting for a batch slot."""
+        with self._condition:
+            return len(self._pending)
+
+    def encode(self, text):
+        """Token ids for text, safe to call from any thread."""
+        with self._tokenizer_lock:
+            return self.tokenizer.encode(text)
+
+    def decode(self, ids):
+        """Text for token ids, safe to call from any thread."""
+        return self._decode(ids)
+
+    def submit(self, prompt, stop_sequences, stream=False, deadline=None, cache_prefix=None, **params):
+        """Queue a prompt, returns the request whose future resolves to the generated text.
+
+        Generation ends at the first of the stop_sequences strings, which is not part of the text,
+        or at deadline (a time.monotonic() time). With a prefix cache, the key/values of the prompt's
+        cache_prefix (the part later prompts are expected to share) are kept for them.
+        """
+        if self.max_queue and self.queue_depth() >= self.max_queue:
+            raise Overloaded("Too many questions are waiting for the model, please try again in a moment.")
+        start = time.monotonic()
+        ids = self.encode(prompt)
+        cache_length = None
+        if cache_prefix and self.prefix_cache is not None:
+            # Tokens can merge across the end of the prefix, only the ones the prompt shares count
+            prefix_ids = self.encode(cache_prefix)
+            cache_length = next((i for i, (a, b) in enumerate(zip(ids, prefix_ids)) if a != b),
+                                min(len(ids), len(prefix_ids)))
+        request = _Request(prompt, len(ids), list(stop_sequences), params, stream, deadline, cache_length)
+        request.timings["tokenize"] = time.monotonic() - start
+        with self._condition:
+            self._pending.append(request)
+            self._condition.notify()
+        return request
+
+    def _check(self, request, is_cancelled):
+        """Cancel the request and raise once its caller stopped waiting or its deadline passed."""
+        if is_cancelled is not None and is_cancelled():
+            request.cancel()
+            raise RequestCancelled("Generation cancelled")
+        if request.deadline is not None and time.monotonic() > request.deadline:
+            request.cancel()
+            raise DeadlineExceeded("Generation did not finish before the deadline")
+
+    def generate(self, prompt, stop_sequences, deadline=None, is_cancelled=None, cache_prefix=None, **params):
+        """The generated text; is_cancelled() is polled while waiting and stops generation when it returns True."""
+        request = self.submit(prompt, stop_sequences, deadline=deadline, cache_prefix=cache_prefix, **params)
+        try:
+            while True:
+                try:
+                    return request.future.result(timeout=POLL_INTERVAL)
+                except FutureTimeout:
+                    self._check(request, is_cancelled)
+        finally:
+            request.record()
+
+    def stream(self, prompt, stop_sequences, deadline=None, is_cancelled=None, cache_prefix=None, **params):
+        """Yield text pieces for one prompt as its batch decodes them.
+
+        Closing the generator early (the client went away) stops the prompt's generation.
+        """
+        request = self.submit(prompt, stop_sequences, stream=True, deadline=deadline, cache_prefix=cache_prefix,
+                              **params)
+        try:
+            next_check = time.monotonic() + POLL_INTERVAL
+            while True:
+                try:
+                    text = request.stream.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    if request.future.done() and request.stream.empty():
+                        break
+                    text = None
+                # Checked while text flows too: a server that buffers the response does not fail the
+                # write to a closed connection, so the generator may never be closed early
+                if time.monotonic() >= next_check:
+                    self._check(request, is_cancelled)
+                    next_check = time.monotonic() + POLL_INTERVAL
+                if text is not None:
+                    yield text
+            # Surface generation errors to the caller
+            request.future.result()
+        finally:
+            if not request.future.done():
+                request.cancel()
+            request.record()
+
+    def _speculative(self, batch):
+        """Speculative decoding runs one greedy sequence at a time, a batch of several is decoded normally."""
+        return self.speculative_decoder is not None and len(batch) == 1 and speculative.supports(batch[0].params)
+
+    def _group_key(self, request):
+        return request.key, request.input_length // self.length_bucket
+
+    def _drop_abandoned(self):
+        """Remove queued requests nobody waits for any more, called with the condition held."""
+        abandoned = [r for r in self._pending if r.abandoned()]
+        if abandoned:
+            self._pending = [r for r in self._pending if r not in abandoned]
+            for request in abandoned:
+                _count_abandoned(request, "queue")
+                request.future.set_exception(request.abandoned_error())
+
+    def _next_batch(self):
+        with self._condition:
+            while True:
+                self._drop_abandoned()
+                if self._pending:
+                    break
+                self._condition.wait()
+
+            # Give the oldest request's group until its deadline to fill up
+            oldest = self._pending[0]
+            key = self._group_key(oldest)
+            deadline = oldest.arrival + self.max_wait
+            while True:
+                group = [r for r in self._pending if self._group_key(r) == key]
+                remaining = deadline - time.monotonic()
+                if len(group) >= self.max_batch_size or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            self._drop_abandoned()
+            group = [r for r in self._pending if self._group_key(r) == key]
+            if not group:
+                return []
+            batch = group[:self.max_batch_size]
+            self._pending = [r for r in self._pending if r not in batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                texts = self._generate_batch(batch)
+                for request, text in zip(batch, texts):
+                    # A row cut short is not an answer
+                    if request.stopped_early:
+                        request.future.set_exception(request.abandoned_error())
+                    else:
+                        request.future.set_result(text)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+
+    def _prefill(self, encoded, batch):
+        """Key/values for all but the last prompt token of every row, left padded like the prompts."""
+        if min(r.input_length for r in batch) < 2:
+            return None
+        return self.prefix_cache.prefill(self.model, encoded["input_ids"], encoded["attention_mask"],
+                                         [r.cache_length for r in batch])
+
+    def _generate_batch(self, batch):
+        tokenizer = self.tokenizer
+        started = time.monotonic()
+        for request in batch:
+            request.timings["queue"] = started - request.arrival
+        with self._tokenizer_lock:
+            encoded = tokenizer([r.prompt for r in batch], return_tensors="pt", padding=True)
+        encoded = {k: encoded[k].to(self.model.device) for k in ("input_ids", "attention_mask")}
+        tokenized = time.monotonic()
+
+        # Every row has its own stop strings and stops on its own, the batch
+        # ends once all rows are finished
+        matchers = [StopSequenceMatcher(r.stop_sequences, self._decode, tokenizer.eos_token_id) for r in batch]
+
+        def stream_new_text():
+            for request, matcher in zip(batch, matchers):
+                if request.stream is not None:
+                    text = matcher.new_text()
+                    if text:
+                        request.stream.put(text)
+
+        streaming = any(r.stream is not None for r in batch)
+        first_step = []
+
+        def on_step():
+            # The first step includes the prompt's forward pass, every later one decodes a single token
+            if not first_step:
+                first_step.append(time.monotonic())
+            # Abandoned rows count as finished, the batch stops early once only they are left
+            for request, matcher in zip(batch, matchers):
+                if not matcher.finished and request.abandoned():
+                    matcher.finished = True
+                    request.stopped_early = True
+                    _count_abandoned(request, "decode")
+            if streaming:
+                stream_new_text()
+
+        stop_criteria = StopSequenceCriteria(matchers, on_step=on_step, input_length=encoded["input_ids"].shape[1])
+
+        speculate = self._speculative(batch)
+        with torch.inference_mode():
+            past_key_values = self._prefill(encoded, batch) if self.prefix_cache is not None else None
+            if speculate:
+                output_ids, draft_tokens, accepted_draft_tokens = self.speculative_decoder.generate(
+                    encoded["input_ids"],
+                    **batch[0].params,
+                    past_key_values=past_key_values,
+                    stopping_criteria=stop_criteria,
+                )
+            else:
+                output_ids = self.model.generate(
+                    **encoded,
+                    **batch[0].params,
+                    past_key_values=past_key_values,
+                    pad_token_id=tokenizer.eos_token_id,
+                    stopping_criteria=StoppingCriteriaList([stop_criteria]),
+                )
+        stop_criteria.feed(output_ids)
+
+        finished = time.monotonic()
+        prefilled = first_step[0] if first_step else finished
+
+        # Rows that reached max_new_tokens without a stop string
+        for matcher in matchers:
+            matcher.flush()
+        if streaming:
+            stream_new_text()
+
+        for request, matcher in zip(batch, matchers):
+            request.timings["tokenize"] = request.timings.get("tokenize", 0.0) + tokenized - started
+            request.timings["prefill"] = prefilled - tokenized
+            request.timings["decode"] = finished - prefilled
+            request.generated_tokens = len(matcher.tokens)
+        if speculate:
+            batch[0].draft_tokens = draft_tokens
+            batch[0].accepted_draft_tokens = accepted_draft_tokens
+        if metrics.METRICS_ENABLED:
+            metrics.BATCH_SIZE.observe(len(batch))
+            decoded = sum(max(len(m.tokens) - 1, 0) for m in matchers)
+            if finished > prefilled and decoded:
+                metrics.DECODE_TOKENS_PER_SECOND.observe(decoded / (finished - prefilled))
+        return [matcher.result() for matcher in matchers]
+
+
+def _count_abandoned(request, where):
+    if metrics.METRICS_ENABLED:
+        metrics.ABANDONED_GENERATIONS.inc(reason="cancelled" if request.cancelled else "deadline", stage=where)
@@ -0,0 +1,77 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Assembles the retrieved context for a prompt. Candidates arrive best first;
+# they are packed greedily into a token budget (measured with the LLM
+# tokenizer) while skipping chunks that mostly repeat an already selected one.
+
+import re
+
+_words = re.compile(r"\w+")
+
+
+def shingles(text, size=3):
+    words = _words.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def overlap(a, b):
+    """Share of the smaller shingle set found in the other one."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def pack_context(candidates, encode, decode, budget_tokens, separator="\n\n", redundancy_threshold=0.8):
+    """Pick the best non-redundant candidates that fit in budget_tokens.
+
+    candidates are dicts with a "document" key, best first. encode/decode map
+    text to token ids and back. Returns (context text, selected candidates,
+    tokens used). When not even the best candidate fits it is truncated to
+    the budget instead of leaving the prompt without context. With no budget
+    at all nothing is selected, callers should check for that first.
+    """
+    separator_tokens = len(encode(separator))
+    selected = []
+    selected_shingles = []
+    used = 0
+
+    for candidate in candidates:
+        document = candidate["document"]
+        if not document:
+            continue
+        candidate_shingles = shingles(document)
+        if any(overlap(candidate_shingles, s) >= redundancy_threshold for s in selected_shingles):
+            continue
+
+        tokens = len(encode(document)) + (separator_tokens if selected else 0)
+        if used + tokens > budget_tokens:
+            # A smaller candidate further down may still fit
+            continue
+
+        selected.append(candidate)
+        selected_shingles.append(candidate_shingles)
+        used += tokens
+
+    best = next((c for c in candidates if c["document"]), None) if not selected else None
+    if best is not None and budget_tokens > 0:
+        best = dict(best)
+        ids = encode(best["document"])[:budget_tokens]
+        best["document"] = decode(ids)
+        best["truncated"] = True
+        return best["document"], [best], len(ids)
+
+    return separator.join(c["document"] for c in selected), selected, used
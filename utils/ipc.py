@@ -0,0 +1,442 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Small newline-delimited JSON protocol over a local unix socket.
+# Only uses the standard library and utils.serving (standard library only as
+# well) so it can be imported from both the main python environment and the
+# isolated chroma venv.
+# A handler that returns a generator streams its messages; the stream ends with
+# a message holding "done" or "error". A client that stops waiting closes its
+# connection, which long running handlers notice with client_disconnected().
+
+import json
+import os
+import queue
+import select
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+import types
+
+from utils.serving import POLL_INTERVAL
+
+
+class IPCError(Exception):
+    """Raised when a local service cannot be reached or returns an error."""
+
+
+def send_message(sock_file, message):
+    """Write one JSON message followed by a newline."""
+    sock_file.write((json.dumps(message) + "\n").encode("utf-8"))
+    sock_file.flush()
+
+
+def read_message(sock_file):
+    """Read one JSON message, returns None when the peer closed the connection."""
+    line = sock_file.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def error_response(error):
+    """Response for a handler that raised: the message, the exception's type and its retry_after if it has one."""
+    response = {"error": str(error), "error_type": type(error).__name__}
+    if getattr(error, "retry_after", None) is not None:
+        response["retry_after"] = error.retry_after
+    return response
+
+
+# The connection of the request each server thread is handling
+_local = threading.local()
+
+
+def client_disconnected():
+    """True once the client of the request this thread is handling has closed its connection."""
+    sock = getattr(_local, "connection", None)
+    if sock is None:
+        return False
+    # Clients send one request at a time and wait for its answer, so a readable socket means end of file
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        _local.connection = self.connection
+        # A connection serves any number of requests until the client closes it
+        while True:
+            try:
+                request = read_message(self.rfile)
+            except (ValueError, ConnectionError):
+                return
+            if request is None:
+                return
+
+            handler = self.server.handlers.get(request.get("op"))
+            if handler is None:
+                response = {"error": f"Unknown op: {request.get('op')}"}
+            else:
+                try:
+                    response = handler(request)
+                except Exception as e:
+                    response = error_response(e)
+
+            try:
+                if isinstance(response, types.GeneratorType):
+                    self.send_stream(response)
+                else:
+                    send_message(self.wfile, response)
+            except (BrokenPipeError, ConnectionError):
+                return
+
+    def send_stream(self, messages):
+        """Send every message of a streaming handler, closing it early when the client is gone."""
+        done = False
+        try:
+            for message in messages:
+                done = bool(message.get("done"))
+                send_message(self.wfile, message)
+        except (BrokenPipeError, ConnectionError):
+            raise
+        except Exception as e:
+            send_message(self.wfile, error_response(e))
+            return
+        finally:
+            messages.close()
+        if not done:
+            send_message(self.wfile, {"done": True})
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, handlers):
+    """Serve the given {op: callable(request) -> dict} handlers on socket_path until killed.
+
+    A "health" op answering {"status": "ok"} is added unless one is supplied.
+    """
+    handlers = dict(handlers)
+    handlers.setdefault("health", lambda request: {"status": "ok", "pid": os.getpid()})
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = _ThreadingUnixServer(socket_path, _RequestHandler)
+    server.handlers = handlers
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+class _Connection:
+    def __init__(self, socket_path, timeout, generation):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.timeout = timeout
+        self.buffer = bytearray()
+        self.generation = generation
+
+    def send(self, message):
+        self.sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def receive(self, poll=None):
+        """Read one message. poll() is called before it and every POLL_INTERVAL while waiting, it may raise to give up."""
+        deadline = time.monotonic() + self.timeout
+        if poll is not None:
+            poll()
+        while True:
+            end = self.buffer.find(b"\n")
+            if end >= 0:
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 1]
+                return json.loads(line)
+            if poll is not None:
+                readable, _, _ = select.select([self.sock], [], [], POLL_INTERVAL)
+                if not readable:
+                    if time.monotonic() > deadline:
+                        raise socket.timeout("timed out")
+                    poll()
+                    continue
+            data = self.sock.recv(1 << 16)
+            if not data:
+                raise ConnectionError("Service closed the connection")
+            self.buffer += data
+
+    def request(self, message, poll=None):
+        self.send(message)
+        return self.receive(poll)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ServiceClient:
+    """Keeps a local service process alive and hands out pooled connections to it.
+
+    The service is started with `command`, which must end up calling serve() on
+    `socket_path`. A background thread health checks the service and restarts it
+    when it crashed or stopped answering.
+    A shared service is used by several client processes: a client uses the one
+    that already answers on socket_path, whoever started it, and only starts its
+    own when none does. The command must then make sure only one of them serves.
+    """
+
+    def __init__(self, command, socket_path, name="service", pool_size=4, timeout=120,
+                 startup_timeout=300, health_interval=10, env=None, log_path=None, cwd=None, shared=False):
+        self.command = command
+        self.socket_path = socket_path
+        self.name = name
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.health_interval = health_interval
+        self.env = env
+        self.log_path = log_path
+        self.cwd = cwd
+        self.shared = shared
+
+        self._process = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._monitor = None
+        self._stopped = False
+
+    # ** Process management **
+    def start(self, wait=False):
+        """Start the service and its health monitor. Safe to call more than once."""
+        with self._lock:
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._monitor_loop, name=f"{self.name}-monitor", daemon=True)
+                self._monitor.start()
+        if wait:
+            self.wait_until_ready()
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout=None):
+        if not self._ready.wait(self.startup_timeout if timeout is None else timeout):
+            raise IPCError(f"{self.name} did not become ready")
+
+    def stop(self):
+        self._stopped = True
+        self._ready.clear()
+        self._wake.set()
+        with self._lock:
+            if self._process and self._process.poll() is None:
+                self._process.terminate()
+                try:
+                    self._process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+            self._process = None
+        self._drain_pool()
+
+    def _launch(self):
+        """(Re)start the service process. Caller must hold self._lock."""
+        if self.shared and (self._process is None or self._process.poll() is not None) and self._ping():
+            # Another client's service answers
+            self._drain_pool()
+            self._generation += 1
+            return
+        if self._process and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+        self._drain_pool()
+        self._generation += 1
+
+        print(f"Starting {self.name}: {' '.join(self.command)}")
+        log_file = open(self.log_path, "ab") if self.log_path else subprocess.DEVNULL
+        self._process = subprocess.Popen(self.command, env=self.env, cwd=self.cwd, stdout=log_file,
+                                         stderr=subprocess.STDOUT)
+        if self.log_path:
+            log_file.close()
+
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            # A shared service may answer from another client's process while this one stands by
+            if self._ping():
+                print(f"{self.name} is ready (pid {self._process.pid})")
+                return
+            if self._process.poll() is not None:
+                raise IPCError(f"{self.name} exited during startup with code {self._process.returncode}")
+            time.sleep(0.2)
+        raise IPCError(f"{self.name} did not answer health checks within {self.startup_timeout} seconds")
+
+    def _ping(self):
+        try:
+            conn = _Connection(self.socket_path, 5, self._generation)
+        except OSError:
+            return False
+        try:
+            return conn.request({"op": "health"}).get("status") == "ok"
+        except (OSError, ValueError):
+            return False
+        finally:
+            conn.close()
+
+    def _monitor_loop(self):
+        failures = 0
+        while not self._stopped:
+            alive = self._process is not None and self._process.poll() is None
+            if (alive or self.shared) and self._ping():
+                failures = 0
+                self._ready.set()
+            else:
+                failures += 1
+                # Restart right away when the process died, give a hung process a few chances
+                if not alive or failures >= 3:
+                    self._ready.clear()
+                    try:
+                        with self._lock:
+                            if self._stopped:
+                                return
+                            self._launch()
+                        failures = 0
+                        self._ready.set()
+                    except Exception as e:
+                        print(f"⚠️ Failed to start {self.name}: {e}")
+                        time.sleep(min(self.health_interval, 5))
+                        continue
+            self._wake.wait(self.health_interval)
+            self._wake.clear()
+
+    # ** Connection pool **
+    def _drain_pool(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _acquire(self):
+        try:
+            conn = self._pool.get_nowait()
+            if conn.generation == self._generation:
+                return conn
+            conn.close()
+        except queue.Empty:
+            pass
+        return _Connection(self.socket_path, self.timeout, self._generation)
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _unavailable(self):
+        """A connection level failure, the service may have crashed: let the monitor restart it."""
+        self._ready.clear()
+        self._wake.set()
+
+    def request(self, message, poll=None):
+        """Send one request and return the decoded response, retrying once after a restart.
+
+        poll() is called every POLL_INTERVAL while waiting; when it raises, the connection is
+        closed (telling the service the client is gone) and the exception propagates.
+        """
+        self.start()
+        self.wait_until_ready()
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise IPCError(f"Timed out waiting for a free {self.name} connection")
+        try:
+            for attempt in (1, 2):
+                try:
+                    conn = self._acquire()
+                except OSError as e:
+                    error = e
+                else:
+                    try:
+                        response = conn.request(message, poll)
+                        self._release(conn)
+                        return response
+                    except socket.timeout:
+                        conn.close()
+                        raise IPCError(f"{self.name} timed out after {self.timeout} seconds")
+                    except (OSError, ValueError) as e:
+                        conn.close()
+                        error = e
+                    except BaseException:
+                        conn.close()
+                        raise
+                self._unavailable()
+                if attempt == 1:
+                    self.wait_until_ready()
+            raise IPCError(f"{self.name} is unavailable: {error}")
+        finally:
+            self._slots.release()
+
+    def stream(self, message, poll=None):
+        """Send one request to a streaming op and yield its messages, up to the one holding "done" or "error".
+
+        Retried once after a restart only when the service failed before its first message,
+        later part of the stream may already have been used. Closing the generator early, or
+        poll() raising, closes the connection.
+        """
+        self.start()
+        self.wait_until_ready()
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise IPCError(f"Timed out waiting for a free {self.name} connection")
+        conn = None
+        try:
+            for attempt in (1, 2):
+                received = False
+                try:
+                    conn = self._acquire()
+                    conn.send(message)
+                    while True:
+                        response = conn.receive(poll)
+                        received = True
+                        if "done" in response or "error" in response:
+                            self._release(conn)
+                            conn = None
+                            yield response
+                            return
+                        yield response
+                except socket.timeout:
+                    raise IPCError(f"{self.name} timed out after {self.timeout} seconds")
+                except (OSError, ValueError) as e:
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+                    self._unavailable()
+                    if received or attempt == 2:
+                        raise IPCError(f"{self.name} is unavailable: {e}")
+                    self.wait_until_ready()
+        finally:
+            if conn is not None:
+                conn.close()
+            self._slots.release()
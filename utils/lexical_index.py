@@ -0,0 +1,170 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# BM25 inverted index over the knowledge base chunks, used next to the vector
+# search so exact product terms ("Iceberg", "ML Runtimes") are found even when
+# the embedding of a short question is not close to the right chunk.
+# The populate job rebuilds the index from the Chroma collection after every
+# run. On disk it is a directory of NumPy arrays that are memory mapped:
+#   terms.json         term -> [start, end) slice of the postings
+#   postings_docs.npy  uint32 document numbers, grouped by term
+#   postings_weights.npy  float16 BM25 weight of the term in each document
+#   ids.json           Chroma id of every document number
+#   meta.json          document count, BM25 parameters, build time
+# The BM25 weights are computed at build time, so a query only sums the
+# weights of its terms' postings.
+
+import json
+import math
+import os
+import re
+import shutil
+import time
+from collections import Counter
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+_token = re.compile(r"[a-z0-9]+")
+
+# Words that are in nearly every question or chunk and carry no meaning on their own
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it its may of on or so such
+that the their then there these this to was we what when where which who why will with you your
+""".split())
+
+
+def tokenize(text):
+    return [t for t in _token.findall(text.lower()) if t not in STOPWORDS]
+
+
+def build_index(documents, path, k1=1.2, b=0.75):
+    """Write a BM25 index of documents, an iterable of (id, text), to the directory path."""
+    ids = []
+    doc_lengths = []
+    postings = {}
+    for number, (doc_id, text) in enumerate(documents):
+        counts = Counter(tokenize(text or ""))
+        ids.append(doc_id)
+        doc_lengths.append(sum(counts.values()))
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((number, tf))
+
+    n = len(ids)
+    avgdl = (sum(doc_lengths) / n) if n else 0.0
+    lengths = np.asarray(doc_lengths, dtype=np.float32)
+    terms = {}
+    docs_parts, weight_parts = [], []
+    offset = 0
+    for term in sorted(postings):
+        entries = postings[term]
+        docs = np.fromiter((d for d, _ in entries), dtype=np.uint32, count=len(entries))
+        tf = np.fromiter((t for _, t in entries), dtype=np.float32, count=len(entries))
+        idf = math.log(1 + (n - len(entries) + 0.5) / (len(entries) + 0.5))
+        weights = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[docs] / max(avgdl, 1e-9)))
+        docs_parts.append(docs)
+        weight_parts.append(weights.astype(np.float16))
+        terms[term] = [offset, offset + len(entries)]
+        offset += len(entries)
+
+    # Build next to the final location and swap it in, readers never see a half written index
+    tmp_path = path.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "postings_docs.npy"),
+            np.concatenate(docs_parts) if docs_parts else np.zeros(0, dtype=np.uint32))
+    np.save(os.path.join(tmp_path, "postings_weights.npy"),
+            np.concatenate(weight_parts) if weight_parts else np.zeros(0, dtype=np.float16))
+    with open(os.path.join(tmp_path, "terms.json"), "w") as f:
+        json.dump(terms, f, separators=(",", ":"))
+    with open(os.path.join(tmp_path, "ids.json"), "w") as f:
+        json.dump(ids, f)
+    # meta.json last, its presence marks a complete index
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"format": FORMAT_VERSION, "documents": n, "terms": len(terms), "postings": offset,
+                   "k1": k1, "b": b, "avgdl": avgdl, "built": time.time()}, f, indent=2)
+
+    old_path = path.rstrip("/") + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return {"documents": n, "terms": len(terms), "postings": offset}
+
+
+class BM25Index:
+    """Read side of an index written by build_index, postings are memory mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported BM25 index format {self.meta.get('format')} in {path}")
+        with open(os.path.join(path, "terms.json"), "r") as f:
+            self.terms = json.load(f)
+        with open(os.path.join(path, "ids.json"), "r") as f:
+            self.ids = json.load(f)
+        self.docs = np.load(os.path.join(path, "postings_docs.npy"), mmap_mode="r")
+        self.weights = np.load(os.path.join(path, "postings_weights.npy"), mmap_mode="r")
+        self.version = self.meta["built"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k=10):
+        """[(id, score)] of the k best BM25 matches for query, best first."""
+        slices = [self.terms[t] for t in set(tokenize(query)) if t in self.terms]
+        if not slices or not self.ids:
+            return []
+        if len(slices) == 1:
+            start, end = slices[0]
+            docs, weights = self.docs[start:end], self.weights[start:end].astype(np.float32)
+        else:
+            docs = np.concatenate([self.docs[s:e] for s, e in slices])
+            weights = np.concatenate([self.weights[s:e] for s, e in slices]).astype(np.float32)
+        scores = np.bincount(docs, weights=weights, minlength=len(self.ids))
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+
+def open_index(path):
+    """The index at path, None when it has not been built yet."""
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return BM25Index(path)
+
+
+def index_version(path):
+    """Changes whenever build_index replaces the index at path."""
+    try:
+        return os.stat(os.path.join(path, "meta.json")).st_mtime_ns
+    except OSError:
+        return None
+
+
+def reciprocal_rank_fusion(rankings, k=60, limit=None):
+    """Fuse ranked lists of ids: each id scores sum(1 / (k + rank)) over the lists it appears in."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores, key=lambda doc_id: -scores[doc_id])
+    return [(doc_id, scores[doc_id]) for doc_id in fused[:limit]]
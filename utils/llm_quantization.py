@@ -0,0 +1,267 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# CPU inference backends for the LLM with quantized Linear weights.
+# - int8: PyTorch dynamic quantization (int8 weights, activations quantized per call)
+# - int4: weight only 4 bit quantization per group of input columns, run with
+#   PyTorch's packed int4 CPU kernel. Without the kernel the weights would have
+#   to be dequantized in every forward pass, slower than int8 for the same
+#   memory, so int4 is refused; Linear layers whose shape the kernel does not
+#   take are int8 instead.
+# Everything that is not a Linear layer (embeddings, layer norms) runs in float32.
+# Converting a multi-billion parameter checkpoint takes a while, so the quantized
+# weights are saved once next to the original (safetensors, no pickled code)
+# and the model is rebuilt from them afterwards.
+
+import json
+import os
+import time
+
+import torch
+import torch.nn as nn
+import transformers
+from safetensors.torch import load_file, save_file
+from transformers import AutoConfig, AutoModelForCausalLM, GenerationConfig
+
+BACKENDS = ("int8", "int4")
+
+_DynamicLinear = torch.ao.nn.quantized.dynamic.Linear
+
+
+def int4_kernel_available():
+    """Packed int4 matmul kernels for CPU, only in recent PyTorch versions."""
+    return (hasattr(torch.ops.aten, "_weight_int4pack_mm_for_cpu")
+            and hasattr(torch.ops.aten, "_convert_weight_to_int4pack_for_cpu"))
+
+
+class Int4Linear(nn.Module):
+    """Linear layer with asymmetric 4 bit weights, one scale and zero point per group of input columns.
+
+    The weights are packed for PyTorch's int4 CPU matmul kernel.
+    """
+
+    def __init__(self, in_features, out_features, bias=True, group_size=128):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.group_size = group_size if in_features % group_size == 0 else in_features
+        groups = in_features // self.group_size
+        # The kernel's own packed layout, set by from_float or when loading a saved model
+        self.register_buffer("packed", torch.zeros(0, dtype=torch.int32))
+        self.register_buffer("scales_and_zeros", torch.zeros(groups, out_features, 2))
+        self.register_buffer("bias", torch.zeros(out_features) if bias else None)
+
+    @classmethod
+    def from_float(cls, linear, group_size=128):
+        """The quantized layer, None when the kernel does not support its shape."""
+        weight = linear.weight.detach().float()
+        module = cls(linear.in_features, linear.out_features, linear.bias is not None, group_size)
+        grouped = weight.reshape(linear.out_features, -1, module.group_size)
+        w_min = grouped.amin(dim=-1, keepdim=True)
+        w_max = grouped.amax(dim=-1, keepdim=True)
+        scales = (w_max - w_min).clamp(min=1e-8) / 15
+        zeros = (-w_min / scales).round().clamp(0, 15)
+        quantized = (grouped / scales + zeros).round().clamp(0, 15).reshape(linear.out_features, -1)
+
+        try:
+            module.packed = torch.ops.aten._convert_weight_to_int4pack_for_cpu(quantized.to(torch.int32), 1)
+            # The kernel computes (q - 8) * scale + zero, zero is an offset in weight units
+            module.scales_and_zeros.copy_(torch.stack((scales, (8 - zeros) * scales), dim=-1)
+                                          .squeeze(2).transpose(0, 1))
+            expected = ((quantized.reshape_as(grouped) - zeros) * scales).reshape_as(weight)
+            check = torch.randn(2, linear.in_features)
+            if not torch.allclose(module._kernel_matmul(check), check @ expected.T, atol=1e-3, rtol=1e-3):
+                raise RuntimeError("int4 kernel results do not match")
+        except RuntimeError:
+            return None
+
+        if linear.bias is not None:
+            module.bias.copy_(linear.bias.detach().float())
+        return module
+
+    def dequantize(self):
+        # Multiplying the identity through the kernel unpacks its layout
+        return self._kernel_matmul(torch.eye(self.in_features)).T
+
+    def _kernel_matmul(self, x):
+        return torch.ops.aten._weight_int4pack_mm_for_cpu(x, self.packed, self.group_size, self.scales_and_zeros)
+
+    def forward(self, x):
+        output = self._kernel_matmul(x.reshape(-1, self.in_features).float().contiguous())
+        output = output.reshape(*x.shape[:-1], self.out_features).to(x.dtype)
+        return output + self.bias.to(x.dtype) if self.bias is not None else output
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, group_size={self.group_size}"
+
+
+def quantize_int8(linear):
+    linear = linear.float()
+    linear.qconfig = torch.ao.quantization.default_dynamic_qconfig
+    return _DynamicLinear.from_float(linear)
+
+
+def quantize_linear(linear, backend, group_size):
+    if backend == "int8":
+        return quantize_int8(linear)
+    if linear.in_features % 2:
+        return linear.float()
+    return Int4Linear.from_float(linear, group_size) or quantize_int8(linear)
+
+
+def quantize_model(model, backend, group_size=128):
+    """Replace every nn.Linear of model in place, one layer at a time to keep peak memory low."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown quantization backend {backend}, expected one of {', '.join(BACKENDS)}")
+    if backend == "int4" and not int4_kernel_available():
+        raise RuntimeError(f"LLM_BACKEND=int4 needs PyTorch's packed int4 CPU kernel, which torch "
+                           f"{torch.__version__} does not have. Use int8 or upgrade torch.")
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if type(child) is nn.Linear:
+                setattr(module, child_name, quantize_linear(child, backend, group_size))
+    return model.float().eval()
+
+
+# ** Saved quantized models **
+def save_quantized_model(model, cache_dir):
+    """Write model's tensors to model.safetensors and its quantized layers to modules.json in cache_dir."""
+    modules, tensors, skipped = {}, {}, set()
+    for name, module in model.named_modules():
+        if isinstance(module, Int4Linear):
+            modules[name] = {"type": "int4", "in_features": module.in_features, "out_features": module.out_features,
+                             "group_size": module.group_size, "bias": module.bias is not None}
+        elif isinstance(module, _DynamicLinear):
+            # Packed int8 weights are an opaque object, their integer values, scale and zero point are saved
+            weight, bias = module.weight(), module.bias()
+            modules[name] = {"type": "int8", "in_features": module.in_features, "out_features": module.out_features,
+                             "scale": weight.q_scale(), "zero_point": weight.q_zero_point(), "bias": bias is not None}
+            tensors[f"{name}.weight"] = weight.int_repr()
+            if bias is not None:
+                tensors[f"{name}.bias"] = bias.detach()
+            skipped.update(f"{name}.{key}" for key in module.state_dict())
+
+    # Tied weights (e.g. input and output embeddings) are saved once and tied again on load
+    seen = set()
+    for key, tensor in model.state_dict().items():
+        if key in skipped or key in tensors:
+            continue
+        if tensor.numel() and tensor.data_ptr() in seen:
+            continue
+        seen.add(tensor.data_ptr())
+        tensors[key] = tensor.contiguous()
+
+    # Write to temp files first so an interrupted conversion is never loaded
+    save_file(tensors, os.path.join(cache_dir, "model.safetensors.tmp"))
+    os.replace(os.path.join(cache_dir, "model.safetensors.tmp"), os.path.join(cache_dir, "model.safetensors"))
+    with open(os.path.join(cache_dir, "modules.json"), "w") as f:
+        json.dump(modules, f)
+    model.config.save_pretrained(cache_dir)
+    if model.generation_config is not None:
+        model.generation_config.save_pretrained(cache_dir)
+
+
+def _load_module(spec, tensors, name):
+    if spec["type"] == "int4":
+        module = Int4Linear(spec["in_features"], spec["out_features"], spec["bias"], spec["group_size"])
+        module.packed = tensors.pop(f"{name}.packed")
+        module.scales_and_zeros = tensors.pop(f"{name}.scales_and_zeros")
+        if spec["bias"]:
+            module.bias = tensors.pop(f"{name}.bias")
+        return module
+    module = _DynamicLinear(spec["in_features"], spec["out_features"], bias_=spec["bias"], dtype=torch.qint8)
+    weight = torch._make_per_tensor_quantized_tensor(tensors.pop(f"{name}.weight"), spec["scale"], spec["zero_point"])
+    module.set_weight_bias(weight, tensors.pop(f"{name}.bias") if spec["bias"] else None)
+    return module
+
+
+def load_saved_model(cache_dir):
+    """Rebuild the model save_quantized_model wrote to cache_dir."""
+    from accelerate import init_empty_weights
+
+    config = AutoConfig.from_pretrained(cache_dir)
+    # Parameters are not allocated, every one of them is in the saved tensors
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32)
+    tensors = load_file(os.path.join(cache_dir, "model.safetensors"))
+    with open(os.path.join(cache_dir, "modules.json"), "r") as f:
+        modules = json.load(f)
+    for name, spec in modules.items():
+        parent, _, child = name.rpartition(".")
+        setattr(model.get_submodule(parent), child, _load_module(spec, tensors, name))
+    # Assigned one by one, load_state_dict would ask the int8 layers for state they do not save
+    for key, tensor in tensors.items():
+        module_name, _, attribute = key.rpartition(".")
+        module = model.get_submodule(module_name)
+        if attribute in module._parameters:
+            module._parameters[attribute] = nn.Parameter(tensor, requires_grad=False)
+        elif attribute in module._buffers:
+            module._buffers[attribute] = tensor
+        else:
+            raise ValueError(f"The quantized model in {cache_dir} has an unexpected tensor {key}")
+    model.tie_weights()
+
+    missing = [name for name, tensor in [*model.named_parameters(), *model.named_buffers()] if tensor.is_meta]
+    if missing:
+        raise ValueError(f"The quantized model in {cache_dir} has no values for {', '.join(missing[:5])}")
+    if os.path.exists(os.path.join(cache_dir, "generation_config.json")):
+        model.generation_config = GenerationConfig.from_pretrained(cache_dir)
+    return model.eval()
+
+
+def cache_info(model_path, backend, group_size):
+    """Describes the checkpoint and library versions a cached quantized model was built from."""
+    weights = sorted(f for f in os.listdir(model_path) if f.endswith((".bin", ".safetensors", ".json")))
+    return {
+        "backend": backend,
+        "group_size": group_size if backend == "int4" else None,
+        "format": "safetensors",
+        "source": os.path.abspath(model_path),
+        "source_files": {f: os.path.getmtime(os.path.join(model_path, f)) for f in weights},
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+    }
+
+
+def load_quantized_model(model_path, backend, cache_dir=None, group_size=128):
+    """Load model_path quantized for CPU inference, converting and caching it on first use."""
+    cache_dir = cache_dir or f"{model_path.rstrip('/')}-{backend}"
+    info_file = os.path.join(cache_dir, "quantization.json")
+    info = cache_info(model_path, backend, group_size)
+
+    try:
+        with open(info_file, "r") as f:
+            cached = json.load(f) == info
+    except (OSError, ValueError):
+        cached = False
+
+    if cached and os.path.exists(os.path.join(cache_dir, "model.safetensors")):
+        print(f"Loading {backend} quantized LLM from {cache_dir}")
+        return load_saved_model(cache_dir)
+
+    print(f"🔧 Quantizing {model_path} to {backend}, this only happens once")
+    start = time.perf_counter()
+    model = AutoModelForCausalLM.from_pretrained(model_path, local_files_only=True, torch_dtype=torch.bfloat16,
+                                                 low_cpu_mem_usage=True)
+    model = quantize_model(model, backend, group_size)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    save_quantized_model(model, cache_dir)
+    with open(info_file, "w") as f:
+        json.dump(info, f, indent=2)
+    print(f"Quantized LLM saved to {cache_dir} in {time.perf_counter() - start:.1f}s")
+    # Rebuilt from the saved files, so the first start runs the same model as the later ones (buffers the
+    # checkpoint does not hold are then computed in float32 rather than bfloat16)
+    del model
+    return load_saved_model(cache_dir)
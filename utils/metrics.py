@@ -0,0 +1,307 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Lightweight request instrumentation: counters, gauges and histograms kept in
+# process and rendered in the Prometheus text format for the app's /metrics
+# route, without a client library. Request stages are timed with stage(),
+# which feeds the rag_stage_seconds histogram and, when a trace was started for
+# the request, the trace's own breakdown. With METRICS_TRACE_LOG=1 every
+# request logs one line with its trace id and where its time went.
+
+import contextvars
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+TRACE_LOG = os.getenv("METRICS_TRACE_LOG", "0") == "1"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a fast tokenization to a long CPU generation
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(name suffix, labels, value)] for the text format."""
+        with self._lock:
+            return [("", dict(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(("_bucket", dict(labels, le=_format_value(bound)), count))
+                samples.append(("_sum", labels, total))
+                samples.append(("_count", labels, counts[-1]))
+        return samples
+
+
+class CallbackMetric(_Metric):
+    """Value read when /metrics is scraped, from counts another component already keeps.
+
+    fn returns a number, or {label values tuple: number}. Returning None skips the metric.
+    """
+
+    def __init__(self, name, documentation, kind, fn, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            return [("", {}, values)]
+        return [("", dict(zip(self.labelnames, key)), value) for key, value in values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Modules imported twice (as a script and as a module) get the metric registered the first time
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return registry.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def callback(name, documentation, kind, fn, labelnames=()):
+    return registry.register(CallbackMetric(name, documentation, kind, fn, labelnames))
+
+
+# ** Metrics shared by the apps, the retrieval client and the batch scheduler **
+REQUESTS = counter("rag_requests_total", "Questions answered by route and outcome (ok, error, warming_up, shed, timeout, cancelled)",
+                   ("route", "outcome"))
+REQUEST_SECONDS = histogram("rag_request_seconds", "Question latency until the answer was complete", ("route",))
+STAGE_SECONDS = histogram("rag_stage_seconds", "Time spent in each stage of answering a question", ("stage",))
+PROMPT_TOKENS = histogram("llm_prompt_tokens", "Prompt length of each generation in tokens", buckets=TOKEN_BUCKETS)
+GENERATED_TOKENS = histogram("llm_generated_tokens", "Tokens generated per request", buckets=TOKEN_BUCKETS)
+GENERATED_TOKENS_TOTAL = counter("llm_generated_tokens_total", "Tokens generated over all requests")
+DECODE_TOKENS_PER_SECOND = histogram("llm_decode_tokens_per_second",
+                                     "Decode throughput of each batch, tokens per second over all its rows",
+                                     buckets=RATE_BUCKETS)
+DRAFT_TOKENS = counter("llm_draft_tokens_total",
+                       "Tokens proposed by the speculative decoding draft model, by whether the LLM accepted them",
+                       ("result",))
+BATCH_SIZE = histogram("llm_batch_size", "Requests per generation batch", buckets=(1, 2, 4, 8, 16, 32))
+ABANDONED_GENERATIONS = counter("llm_abandoned_generations_total",
+                                "Generations stopped because the client left (cancelled) or the deadline passed, "
+                                "while queued or mid-decode", ("reason", "stage"))
+
+
+# ** Per-request traces **
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+class Trace:
+    """Where one request's time went: seconds per stage plus counts like tokens."""
+
+    def __init__(self, trace_id=None, route=None):
+        self.id = trace_id or new_trace_id()
+        self.route = route
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.values = {}
+
+    def add(self, stage_name, seconds):
+        self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+    def summary(self):
+        parts = [f"trace={self.id}"]
+        if self.route:
+            parts.append(f"route={self.route}")
+        parts.append(f"total={time.perf_counter() - self.start:.3f}s")
+        parts += [f"{name}={seconds:.3f}s" for name, seconds in self.stages.items()]
+        parts += [f"{name}={value}" for name, value in self.values.items()]
+        return " ".join(parts)
+
+
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def start_trace(trace_id=None, route=None):
+    """Start timing a request on this thread, trace_id defaults to a new random id."""
+    trace = Trace(trace_id, route)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def finish_trace(outcome):
+    """Count the request, observe its latency and log its breakdown with METRICS_TRACE_LOG=1."""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    _current_trace.set(None)
+    if METRICS_ENABLED and trace.route:
+        REQUESTS.inc(route=trace.route, outcome=outcome)
+        REQUEST_SECONDS.observe(time.perf_counter() - trace.start, route=trace.route)
+    if TRACE_LOG:
+        print(f"{trace.summary()} outcome={outcome}")
+    return trace
+
+
+def record_stage(stage_name, seconds):
+    """Add seconds spent in a stage, for time measured elsewhere (another thread or process)."""
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage=stage_name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage_name, seconds)
+
+
+def record_value(name, value):
+    """Attach a value like a token count to the current trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.values[name] = value
+
+
+@contextmanager
+def stage(stage_name):
+    """Time the block as stage_name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage_name, time.perf_counter() - start)
+
+
+def trace_prefix():
+    """Log line prefix with the request's trace id when METRICS_TRACE_LOG=1, empty otherwise."""
+    trace = _current_trace.get()
+    return f"[trace={trace.id}] " if TRACE_LOG and trace is not None else ""
+
+
+def render():
+    return registry.render()
@@ -12,13 +12,71 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import inspect
+import json
+import os
+import threading
+import numpy as np
 import torch
 import torch.nn.functional as F
-from transformers import AutoTokenizer, AutoModel
+from transformers import AutoConfig, AutoTokenizer, AutoModel
+from utils.model_registry import loading_lock
 
-# Load the model stored in models/embedding-model
-tokenizer = AutoTokenizer.from_pretrained('models/embedding-model', local_files_only=True)
-model = AutoModel.from_pretrained('models/embedding-model', local_files_only=True)
+# Load the model stored in models/embedding-model, found from the project root so jobs
+# started from their own folder load the same model
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "embedding-model"))
+
+# Sentences per forward pass and CPU threads used by torch (unset keeps torch's default)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+if EMBEDDING_THREADS:
+    torch.set_num_threads(EMBEDDING_THREADS)
+
+# Inference backend: "torch", "onnx" (ONNX Runtime) or "onnx-int8" (ONNX Runtime, int8 dynamic quantization).
+# The ONNX models are exported from the PyTorch checkpoint the first time they are needed.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join(EMBEDDING_MODEL_PATH, "onnx"))
+# A freshly exported ONNX model is rejected when its embeddings drift further than this from PyTorch's
+EMBEDDING_ONNX_MIN_COSINE = float(os.getenv("EMBEDDING_ONNX_MIN_COSINE", "0.99"))
+
+# With MODEL_HOST=1 sentences are embedded by the node's shared model host (utils/model_host.py), which batches
+# the requests of every client together; this process only loads the tokenizer and config
+MODEL_HOST = os.getenv("MODEL_HOST", "0") == "1"
+
+with loading_lock:
+    tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_PATH, local_files_only=True)
+    config = AutoConfig.from_pretrained(EMBEDDING_MODEL_PATH, local_files_only=True)
+
+# PyTorch model, not loaded at all when an ONNX backend is used
+model = None
+onnx_sessions = {}
+
+def get_max_seq_length(model_path, default=256):
+    """Truncation length the sentence-transformers model was trained with."""
+    try:
+        with open(os.path.join(model_path, "sentence_bert_config.json"), "r") as f:
+            max_seq_length = json.load(f)["max_seq_length"]
+    except (OSError, ValueError, KeyError):
+        max_seq_length = default
+    return min(max_seq_length, tokenizer.model_max_length)
+
+# Default model will truncate the document and only gets embeddings of the first 256 tokens.
+# Semantic search will only be effective on these first 256 tokens.
+max_seq_length = get_max_seq_length(EMBEDDING_MODEL_PATH)
+
+# Fast tokenizers are not safe to call from several threads at once
+tokenizer_lock = threading.Lock()
+load_lock = threading.RLock()
+
+def load_torch_model():
+    global model
+    with load_lock:
+        if model is None:
+            with loading_lock:
+                model = AutoModel.from_pretrained(EMBEDDING_MODEL_PATH, local_files_only=True)
+            model.eval()
+    return model
 
 # Mean Pooling - Take attention mask into account for correct averaging
 def mean_pooling(model_output, attention_mask):
@@ -26,25 +84,136 @@ def mean_pooling(model_output, attention_mask):
     input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
     return torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
 
-# Create embeddings using chosen embedding-model
-def get_embeddings(sentence):
-    # Sentences we want sentence embeddings for
-    sentences = [sentence]
-    
-    # Tokenize sentences
-    # Default model will truncate the document and only gets embeddings of the first 256 tokens.
-    # Semantic search will only be effective on these first 256 tokens.
-    # Context loading in 4_app context will still include the ENTIRE document file
-    encoded_input = tokenizer(sentences, padding='max_length', truncation=True, return_tensors='pt')
+# ** ONNX Runtime backend **
+def onnx_model_path(quantized):
+    return os.path.join(EMBEDDING_ONNX_DIR, "model-int8.onnx" if quantized else "model.onnx")
 
-    # Compute token embeddings
+def export_onnx(path):
+    """Export the PyTorch model to ONNX with dynamic batch and sequence axes."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sample = tokenizer(["export sample sentence"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    # Newer torch versions default to the dynamo exporter, which needs extra packages
+    options = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+
+    # Write next to the target and rename, so concurrent processes never load a half written file
+    temporary_path = f"{path}.{os.getpid()}.tmp"
     with torch.no_grad():
-        model_output = model(**encoded_input)
+        torch.onnx.export(load_torch_model(), tuple(sample[name] for name in input_names), temporary_path,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=14, **options)
+    os.replace(temporary_path, path)
+
+def quantize_onnx(source_path, path):
+    """int8 dynamic quantization of the exported model's weights."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    quantize_dynamic(source_path, temporary_path, weight_type=QuantType.QInt8)
+    os.replace(temporary_path, path)
+
+def load_onnx_session(quantized):
+    """ONNX Runtime session for the embedding model, exported (and quantized) on first use."""
+    import onnxruntime
 
-    # Perform pooling
+    with load_lock:
+        if quantized in onnx_sessions:
+            return onnx_sessions[quantized]
+
+        path = onnx_model_path(quantized)
+        created = not os.path.exists(path)
+        if created:
+            print(f"🔧 Exporting embedding model to {path}")
+            if not os.path.exists(onnx_model_path(False)):
+                export_onnx(onnx_model_path(False))
+            if quantized:
+                quantize_onnx(onnx_model_path(False), path)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if EMBEDDING_THREADS:
+            options.intra_op_num_threads = EMBEDDING_THREADS
+        session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        onnx_sessions[quantized] = session
+
+    if created:
+        cosine = parity_check(quantized)
+        print(f"ONNX embedding model min cosine similarity to PyTorch: {cosine:.5f}")
+        if cosine < EMBEDDING_ONNX_MIN_COSINE:
+            with load_lock:
+                onnx_sessions.pop(quantized, None)
+            os.remove(path)
+            raise RuntimeError(f"Exported ONNX embedding model is not accurate enough ({cosine:.5f} < {EMBEDDING_ONNX_MIN_COSINE})")
+    return session
+
+def parity_check(quantized, sentences=None):
+    """Smallest cosine similarity between the ONNX and the PyTorch embeddings of sentences."""
+    sentences = sentences or [
+        "What are ML Runtimes?",
+        "How do data scientists use CML?",
+        "Iceberg tables support schema evolution, hidden partitioning and time travel queries from Spark.",
+        "Sessions, jobs, models and applications run as Kubernetes pods in a Cloudera Machine Learning workspace. " * 4,
+    ]
+    reference = get_embeddings_batch(sentences, backend="torch")
+    candidate = get_embeddings_batch(sentences, backend="onnx-int8" if quantized else "onnx")
+    return float(np.min(np.sum(reference * candidate, axis=1)))
+
+def _embed_onnx(encoded_input, quantized):
+    session = load_onnx_session(quantized)
+    feed = {i.name: encoded_input[i.name].astype(np.int64) for i in session.get_inputs()}
+    token_embeddings = session.run(["last_hidden_state"], feed)[0]
+    mask = encoded_input["attention_mask"][..., None].astype(np.float32)
+    sentence_embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    return sentence_embeddings / np.clip(np.linalg.norm(sentence_embeddings, axis=1, keepdims=True), 1e-12, None)
+
+def _embed_torch(encoded_input):
+    # Compute token embeddings
+    model_output = load_torch_model()(**encoded_input)
+
+    # Perform pooling and normalize embeddings
     sentence_embeddings = mean_pooling(model_output, encoded_input['attention_mask'])
+    return F.normalize(sentence_embeddings, p=2, dim=1).numpy()
 
-    # Normalize embeddings
-    sentence_embeddings = F.normalize(sentence_embeddings, p=2, dim=1)
+# Create embeddings for many sentences at once
+def get_embeddings_batch(sentences, batch_size=EMBEDDING_BATCH_SIZE, backend=None):
+    """Returns a contiguous (len(sentences), dim) float32 array of normalized embeddings, in input order.
+
+    Through the model host, batch_size and backend are the host's.
+    """
+    if MODEL_HOST:
+        from utils import model_host
+        return model_host.embed(sentences)
+    backend = backend or EMBEDDING_BACKEND
+    if backend not in ("torch", "onnx", "onnx-int8"):
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend}, expected torch, onnx or onnx-int8")
+    sentences = list(sentences)
+    embeddings = np.empty((len(sentences), config.hidden_size), dtype=np.float32)
+
+    # Sort by length so each micro-batch is padded only to its own longest sentence
+    order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]), reverse=True)
+
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            with tokenizer_lock:
+                encoded_input = tokenizer([sentences[i] for i in indices], padding=True, truncation=True,
+                                          max_length=max_seq_length, return_tensors='pt' if backend == "torch" else 'np')
+            if backend == "torch":
+                embeddings[indices] = _embed_torch(encoded_input)
+            else:
+                embeddings[indices] = _embed_onnx(encoded_input, quantized=backend == "onnx-int8")
+
+    return embeddings
+
+# Create embeddings using chosen embedding-model
+def get_embeddings(sentence):
+    return get_embeddings_batch([sentence])[0].tolist()
 
-    return (sentence_embeddings.tolist()[0])
\ No newline at end of file
+# Load the selected backend up front so a broken setup fails at startup, not on the first question
+if MODEL_HOST:
+    from utils import model_host
+    model_host.wait_for_model("embedding")
+elif EMBEDDING_BACKEND == "torch":
+    load_torch_model()
+else:
+    load_onnx_session(quantized=EMBEDDING_BACKEND == "onnx-int8")
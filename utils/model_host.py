@@ -0,0 +1,340 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# One process per node that owns the LLM and the embedding model. The apps,
+# the retrieval service and the populate job call generate and embed on it
+# over a unix socket (utils/ipc.py) instead of each loading their own copy.
+# Generations from every client go through the host's batch scheduler, and
+# embedding requests that arrive together are embedded as one batch.
+# The first client to need the host starts it, loading only the model that
+# client needs; later ones use the running one and the other model loads when
+# first used. If several start it at once, the first to take the lock file
+# serves and the others wait as standbys that take over if it dies.
+#
+# Run it by hand with: python -m utils.model_host [socket path] [models to load, e.g. llm,embedding]
+
+import base64
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from utils import ipc
+from utils.ipc import IPCError, ServiceClient
+from utils.serving import DeadlineExceeded, Overloaded, RequestCancelled
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODEL_HOST_SOCKET = os.getenv("MODEL_HOST_SOCKET", "/tmp/model-host.sock")
+MODEL_HOST_LOG = os.getenv("MODEL_HOST_LOG", "/tmp/model-host.log")
+# Python the host is started with, it needs the LLM's dependencies. Clients in the chroma venv (the
+# retrieval service and the populate job) get the main environment's from the process that starts them
+MODEL_HOST_PYTHON = os.getenv("MODEL_HOST_PYTHON", sys.executable)
+# Models loaded as soon as the host starts besides the one its starting client needs, the others load
+# when first used
+MODEL_HOST_PRELOAD = [name for name in os.getenv("MODEL_HOST_PRELOAD", "").split(",") if name]
+# Concurrent requests one client process sends to the host
+MODEL_HOST_CONNECTIONS = int(os.getenv("MODEL_HOST_CONNECTIONS", "16"))
+
+# Embedding requests arriving within this many milliseconds of each other run as one batch of at most
+# MODEL_HOST_EMBED_MAX_BATCH texts
+MODEL_HOST_EMBED_WAIT_MS = float(os.getenv("MODEL_HOST_EMBED_WAIT_MS", "5"))
+MODEL_HOST_EMBED_MAX_BATCH = int(os.getenv("MODEL_HOST_EMBED_MAX_BATCH", "256"))
+
+_ERRORS = {"Overloaded": Overloaded, "DeadlineExceeded": DeadlineExceeded, "RequestCancelled": RequestCancelled}
+
+
+# ** Host side **
+class EmbeddingBatcher:
+    """Embeds the texts of concurrent requests together, each request gets back its own rows."""
+
+    def __init__(self, embed, max_wait_ms=5, max_batch=256):
+        self.embed_fn = embed
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self._pending = []
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def embed(self, texts):
+        future = Future()
+        with self._condition:
+            self._pending.append((list(texts), future, time.monotonic()))
+            self._condition.notify()
+        return future.result()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            # Wait briefly for other clients unless the batch is already full
+            give_up = self._pending[0][2] + self.max_wait
+            while sum(len(texts) for texts, _, _ in self._pending) < self.max_batch:
+                remaining = give_up - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch, size = [], 0
+            while self._pending and (not batch or size + len(self._pending[0][0]) <= self.max_batch):
+                texts, future, _ = self._pending.pop(0)
+                batch.append((texts, future))
+                size += len(texts)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                embeddings = self.embed_fn([text for texts, _ in batch for text in texts])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            start = 0
+            for texts, future in batch:
+                future.set_result(embeddings[start:start + len(texts)])
+                start += len(texts)
+            self.texts += start
+
+    def stats(self):
+        return {"batches": self.batches, "requests": self.requests, "texts": self.texts}
+
+
+def encode_array(array):
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    return {"embeddings": base64.b64encode(array.tobytes()).decode("ascii"), "shape": list(array.shape)}
+
+
+def decode_array(response):
+    return np.frombuffer(base64.b64decode(response["embeddings"]), dtype=np.float32).reshape(response["shape"]).copy()
+
+
+def serve(socket_path=MODEL_HOST_SOCKET, preload=()):
+    """Load the preload models and answer generate and embed requests on socket_path until killed."""
+    import fcntl
+
+    # Only one host per socket, the others wait here and take over when it exits
+    lock_file = open(socket_path + ".lock", "w")
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+    # This process runs the models itself, and starts loading them when the host says so
+    os.environ["MODEL_HOST"] = "0"
+    os.environ["LLM_LAZY_LOAD"] = "1"
+    # Imported once here, transformers resolves these names lazily and the loader threads import them at once
+    import torch  # noqa: F401
+    from transformers import AutoConfig, AutoModel, AutoModelForCausalLM, AutoTokenizer  # noqa: F401
+    from utils import metrics
+    from utils.model_registry import ModelRegistry, peak_rss_mb
+
+    def load_llm():
+        import utils.model_llm_utils as model_llm
+        return model_llm.registry.get("llm")
+
+    def load_embedding():
+        import utils.model_embedding_utils as model_embedding
+        return EmbeddingBatcher(model_embedding.get_embeddings_batch, MODEL_HOST_EMBED_WAIT_MS,
+                                MODEL_HOST_EMBED_MAX_BATCH)
+
+    registry = ModelRegistry()
+    registry.register("llm", load_llm)
+    registry.register("embedding", load_embedding)
+    preload = list(dict.fromkeys([*preload, *MODEL_HOST_PRELOAD]))
+    for name in preload:
+        registry.start(name)
+
+    def deadline(request):
+        return time.monotonic() + request["timeout"] if request.get("timeout") is not None else None
+
+    def traced(generation):
+        """Run generation() in a trace and return the stages and token counts the scheduler recorded."""
+        metrics.start_trace()
+        try:
+            result = generation()
+        finally:
+            trace = metrics.finish_trace(None)
+        return result, {"stages": trace.stages, "values": trace.values}
+
+    def handle_generate(request):
+        llm = registry.get("llm")
+        text, report = traced(lambda: llm.scheduler.generate(
+            request["prompt"], request["stop"], deadline=deadline(request), is_cancelled=ipc.client_disconnected,
+            cache_prefix=request.get("cache_prefix"), **request["params"]))
+        return {"done": True, "text": text, **report}
+
+    def handle_stream(request):
+        llm = registry.get("llm")
+        metrics.start_trace()
+        try:
+            # A client that closes its connection stops the generation at the scheduler's next check
+            for text in llm.scheduler.stream(request["prompt"], request["stop"], deadline=deadline(request),
+                                             is_cancelled=ipc.client_disconnected,
+                                             cache_prefix=request.get("cache_prefix"), **request["params"]):
+                yield {"text": text}
+        finally:
+            trace = metrics.finish_trace(None)
+        yield {"done": True, "stages": trace.stages, "values": trace.values}
+
+    def handle_embed(request):
+        return encode_array(registry.get("embedding").embed(request["texts"]))
+
+    def handle_load(request):
+        registry.start(request["model"])
+        return {"status": "ok", "models": registry.status()}
+
+    def handle_health(request):
+        return {"status": "ok", "pid": os.getpid(), "models": registry.status()}
+
+    def handle_stats(request):
+        stats = {"pid": os.getpid(), "peak_rss_mb": round(peak_rss_mb(), 1), "models": registry.status()}
+        if registry.is_ready("llm"):
+            scheduler = registry.get("llm").scheduler
+            batches = {name: value for name, _, value in metrics.BATCH_SIZE.samples() if name in ("_sum", "_count")}
+            stats["llm"] = {"queue_depth": scheduler.queue_depth(), "batches": batches.get("_count", 0),
+                            "requests": int(batches.get("_sum", 0)),
+                            "prefix_cache": scheduler.prefix_cache.stats() if scheduler.prefix_cache else None}
+        if registry.is_ready("embedding"):
+            stats["embedding"] = registry.get("embedding").stats()
+        return stats
+
+    print(f"Model host serving on {socket_path} (pid {os.getpid()}), loading {', '.join(preload) or 'on demand'}")
+    sys.stdout.flush()
+    ipc.serve(socket_path, {"generate": handle_generate, "stream": handle_stream, "embed": handle_embed,
+                            "load": handle_load, "health": handle_health, "stats": handle_stats})
+
+
+# ** Client side **
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client(preload=()):
+    """The connection to this node's model host, started by the first client that needs it.
+
+    A host this process starts loads the preload models right away.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ServiceClient(
+                command=[MODEL_HOST_PYTHON, "-m", "utils.model_host", MODEL_HOST_SOCKET] +
+                        ([",".join(preload)] if preload else []),
+                socket_path=MODEL_HOST_SOCKET,
+                name="model host",
+                pool_size=MODEL_HOST_CONNECTIONS,
+                timeout=120,
+                log_path=MODEL_HOST_LOG,
+                cwd=ROOT,
+                shared=True,
+            )
+    return _client
+
+
+def raise_for_error(response):
+    if "error" in response:
+        error = _ERRORS.get(response.get("error_type"), IPCError)
+        if error is Overloaded:
+            raise Overloaded(response["error"], response.get("retry_after", 1))
+        raise error(response["error"])
+    return response
+
+
+def wait_for_model(name, poll_interval=0.5):
+    """Start the host if needed and wait until it has loaded name ("llm" or "embedding")."""
+    client = get_client(preload=[name])
+    client.start(wait=True)
+    while True:
+        state = raise_for_error(client.request({"op": "load", "model": name}))["models"][name]
+        if state["state"] == "ready":
+            return
+        if state["state"] == "failed":
+            raise IPCError(f"The model host failed to load {name}: {state['error']}")
+        time.sleep(poll_interval)
+
+
+def embed(texts):
+    """(len(texts), dim) float32 embeddings from the host's embedding model."""
+    return decode_array(raise_for_error(get_client().request({"op": "embed", "texts": list(texts)})))
+
+
+class RemoteScheduler:
+    """BatchScheduler's interface in front of the host's LLM, prompts are tokenized here only to count tokens."""
+
+    # The host keeps the prefix cache, its statistics are in the host's stats op
+    prefix_cache = None
+
+    def __init__(self, tokenizer, client=None):
+        from utils.stop_sequences import make_decoder
+
+        self.tokenizer = tokenizer
+        self.client = client or get_client()
+        self._tokenizer_lock = threading.Lock()
+        self._decode = make_decoder(tokenizer, self._tokenizer_lock)
+
+    def encode(self, text):
+        with self._tokenizer_lock:
+            return self.tokenizer.encode(text)
+
+    def decode(self, ids):
+        return self._decode(ids)
+
+    def queue_depth(self):
+        try:
+            return self.client.request({"op": "stats"}).get("llm", {}).get("queue_depth")
+        except IPCError:
+            return None
+
+    def _run(self, op, prompt, stop_sequences, deadline, is_cancelled, cache_prefix, params):
+        """Messages of one generation on the host, the last one with its stages and token counts."""
+        from utils.batch_scheduler import record_generation
+
+        def poll():
+            # Raising closes the connection, which stops the generation on the host
+            if is_cancelled is not None and is_cancelled():
+                raise RequestCancelled("Generation cancelled")
+            if deadline is not None and time.monotonic() > deadline:
+                raise DeadlineExceeded("Generation did not finish before the deadline")
+
+        message = {"op": op, "prompt": prompt, "stop": list(stop_sequences), "cache_prefix": cache_prefix,
+                   "params": params, "timeout": deadline - time.monotonic() if deadline is not None else None}
+        for response in self.client.stream(message, poll):
+            raise_for_error(response)
+            if response.get("done"):
+                values = response["values"]
+                record_generation(response["stages"], values.get("prompt_tokens", 0), values.get("generated_tokens", 0),
+                                  values.get("draft_tokens", 0), values.get("accepted_draft_tokens", 0))
+            yield response
+
+    def generate(self, prompt, stop_sequences, deadline=None, is_cancelled=None, cache_prefix=None, **params):
+        for response in self._run("generate", prompt, stop_sequences, deadline, is_cancelled, cache_prefix, params):
+            if response.get("done"):
+                return response["text"]
+
+    def stream(self, prompt, stop_sequences, deadline=None, is_cancelled=None, cache_prefix=None, **params):
+        for response in self._run("stream", prompt, stop_sequences, deadline, is_cancelled, cache_prefix, params):
+            if "text" in response:
+                yield response["text"]
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else MODEL_HOST_SOCKET,
+          [name for name in sys.argv[2].split(",") if name] if len(sys.argv) > 2 else ())
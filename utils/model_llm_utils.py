@@ -12,38 +12,183 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from transformers import pipeline, AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+from types import SimpleNamespace
+import os
 import torch
 
-class KeywordsStoppingCriteria(StoppingCriteria):
-    def __init__(self, keywords_ids:list):
-        self.keywords = keywords_ids
+from utils import metrics
+from utils.batch_scheduler import BatchScheduler
+from utils.model_registry import ModelRegistry, convert_to_safetensors, loading_lock
+from utils.prefix_cache import PrefixCache
 
-    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
-        if input_ids[0][-1] in self.keywords:
-            return True
-        return False
+LLM_MODEL_PATH = 'models/llm-model'
+# Every backend loads the checkpoint in bfloat16 (the quantized ones before converting it)
+LLM_LOAD_DTYPE = torch.bfloat16
 
-# Load the model stored in models/llm-model
-print(f"Starting to load the LLM model")
-model = AutoModelForCausalLM.from_pretrained('models/llm-model', local_files_only=True, torch_dtype=torch.bfloat16, device_map="auto")
+# Inference backend: "bf16" loads the model in bfloat16 on the GPU(s) when available,
+# "int8" / "int4" run quantized weights on CPU-only nodes (see utils/llm_quantization.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "bf16")
+if os.getenv("LLM_THREADS"):
+    torch.set_num_threads(int(os.getenv("LLM_THREADS")))
 
-print(f"Starting to load the LLM tokenizer")
-tokenizer = AutoTokenizer.from_pretrained('models/llm-model', local_files_only=True, padding_side="left")
+# Optional small causal LM with the LLM's tokenizer for speculative decoding of greedy requests that run
+# alone (see utils/batch_scheduler.py). Used when the folder exists, LLM_SPECULATIVE=0 turns it off.
+LLM_DRAFT_MODEL_PATH = os.getenv("LLM_DRAFT_MODEL_PATH", 'models/llm-draft-model')
+LLM_SPECULATIVE = os.getenv("LLM_SPECULATIVE", "1") == "1"
 
-print(f"Finished loading the model and tokenizer")
+# With MODEL_HOST=1 the LLM runs in the node's shared model host (utils/model_host.py), which batches the
+# generations of every app together; this process only loads the tokenizer to count prompt tokens
+MODEL_HOST = os.getenv("MODEL_HOST", "0") == "1"
 
-# Now create a generator and a prompting function to ask a question to the LLM where the prompt sets context and attempts to massage some instructions to answer the question
-generator = pipeline('text-generation', model=model, tokenizer=tokenizer)
+def load_llm():
+    """Load the model and tokenizer stored in models/llm-model and start the batch scheduler."""
+    # Legacy .bin checkpoints are converted once, safetensors are memory mapped instead of unpickled
+    if os.getenv("LLM_CONVERT_SAFETENSORS", "1") == "1":
+        convert_to_safetensors(LLM_MODEL_PATH, LLM_LOAD_DTYPE)
+
+    print(f"Starting to load the LLM model ({LLM_BACKEND})")
+    with loading_lock:
+        if LLM_BACKEND == "bf16":
+            model = AutoModelForCausalLM.from_pretrained(LLM_MODEL_PATH, local_files_only=True, torch_dtype=LLM_LOAD_DTYPE, device_map="auto")
+        else:
+            from utils.llm_quantization import load_quantized_model
+            model = load_quantized_model(LLM_MODEL_PATH, LLM_BACKEND, cache_dir=os.getenv("LLM_QUANTIZED_DIR"),
+                                         group_size=int(os.getenv("LLM_INT4_GROUP_SIZE", "128")))
+
+    print(f"Starting to load the LLM tokenizer")
+    with loading_lock:
+        tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_PATH, local_files_only=True, padding_side="left")
+
+    print(f"Finished loading the model and tokenizer")
+
+    draft_model = load_draft_model(model, tokenizer) if LLM_SPECULATIVE and os.path.isdir(LLM_DRAFT_MODEL_PATH) else None
+
+    # Requests from concurrent users are queued and run together as padded batches
+    # instead of contending for the model one generate call at a time
+    scheduler = BatchScheduler(
+        model,
+        tokenizer,
+        max_batch_size=int(os.getenv("LLM_MAX_BATCH_SIZE", "8")),
+        max_wait_ms=float(os.getenv("LLM_MAX_WAIT_MS", "20")),
+        prefix_cache=PrefixCache.from_env(),
+        # Requests waiting beyond this are refused with utils.serving.Overloaded (0 for no limit)
+        max_queue=int(os.getenv("LLM_MAX_QUEUE", "32")),
+        draft_model=draft_model,
+        draft_tokens=int(os.getenv("LLM_DRAFT_TOKENS", "5")),
+    )
+
+    # Prompt plus generated tokens must fit in the model's context window
+    max_context_tokens = getattr(model.config, "max_position_embeddings", 2048)
+    return SimpleNamespace(model=model, tokenizer=tokenizer, scheduler=scheduler, max_context_tokens=max_context_tokens)
+
+def load_draft_model(model, tokenizer):
+    """Load the draft model for speculative decoding next to the LLM, it must share the LLM's vocabulary."""
+    print(f"Starting to load the draft model from {LLM_DRAFT_MODEL_PATH}")
+    with loading_lock:
+        draft_tokenizer = AutoTokenizer.from_pretrained(LLM_DRAFT_MODEL_PATH, local_files_only=True)
+        if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+            raise ValueError(f"The draft model in {LLM_DRAFT_MODEL_PATH} does not use the LLM's tokenizer")
+        # The quantized backends run on CPU-only nodes, where a small model is fastest in float32
+        dtype = LLM_LOAD_DTYPE if LLM_BACKEND == "bf16" else torch.float32
+        draft_model = AutoModelForCausalLM.from_pretrained(LLM_DRAFT_MODEL_PATH, local_files_only=True, torch_dtype=dtype)
+    draft_model.to(model.device)
+    draft_model.eval()
+    return draft_model
+
+def connect_llm():
+    """Wait for the model host to load the LLM and talk to it through a RemoteScheduler."""
+    from utils import model_host
+    model_host.wait_for_model("llm")
+    with loading_lock:
+        tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_PATH, local_files_only=True, padding_side="left")
+        config = AutoConfig.from_pretrained(LLM_MODEL_PATH, local_files_only=True)
+    print(f"Using the LLM of the model host on {model_host.MODEL_HOST_SOCKET}")
+    return SimpleNamespace(model=None, tokenizer=tokenizer, scheduler=model_host.RemoteScheduler(tokenizer),
+                           max_context_tokens=getattr(config, "max_position_embeddings", 2048))
+
+# The model loads in a background thread as soon as this module is imported, so apps can
+# start serving (and report that they are warming up) right away. With LLM_LAZY_LOAD=1
+# loading starts on the first request instead.
+registry = ModelRegistry()
+registry.register("llm", connect_llm if MODEL_HOST else load_llm)
+if os.getenv("LLM_LAZY_LOAD", "0") != "1":
+    registry.start("llm")
+
+def is_ready():
+    return registry.is_ready("llm")
+
+def wait_until_ready(timeout=None):
+    registry.get("llm", timeout)
+
+# ** Metrics read from the scheduler and prefix cache when /metrics is scraped **
+def _loaded_scheduler():
+    return registry.get("llm").scheduler if is_ready() else None
+
+def _queue_depth():
+    scheduler = _loaded_scheduler()
+    return scheduler.queue_depth() if scheduler else None
+
+def _prefix_cache_stats():
+    scheduler = _loaded_scheduler()
+    if scheduler is None or scheduler.prefix_cache is None:
+        return None
+    return scheduler.prefix_cache.stats()
+
+def _prefix_cache_lookups():
+    stats = _prefix_cache_stats()
+    return {("hit",): stats["hits"], ("miss",): stats["misses"]} if stats else None
+
+def _prefix_cache_reused_tokens():
+    stats = _prefix_cache_stats()
+    return stats["reused_tokens"] if stats else None
+
+metrics.callback("llm_queue_depth", "Generation requests waiting for a batch slot", "gauge", _queue_depth)
+metrics.callback("llm_prefix_cache_lookups_total", "Prompt prefix cache lookups by result", "counter",
+                 _prefix_cache_lookups, ("result",))
+metrics.callback("llm_prefix_cache_reused_tokens_total", "Prompt tokens whose prefill came from the prefix cache",
+                 "counter", _prefix_cache_reused_tokens)
+
+# model, tokenizer, scheduler and max_context_tokens are still available as module
+# attributes, reading one waits until the model is loaded
+def __getattr__(name):
+    if name in ("model", "tokenizer", "scheduler", "max_context_tokens"):
+        return getattr(registry.get("llm"), name)
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
+def encode(text):
+    return registry.get("llm").scheduler.encode(text)
+
+def decode(ids):
+    return registry.get("llm").scheduler.decode(ids)
+
+def get_generation_kwargs(temperature, max_new_tokens, top_p, top_k, repetition_penalty, do_sample):
+    generation_kwargs = dict(max_new_tokens=max_new_tokens, do_sample=do_sample, repetition_penalty=repetition_penalty)
+    # Sampling knobs only matter (and only get validated) when sampling
+    if do_sample:
+        generation_kwargs.update(temperature=temperature, top_p=top_p, top_k=top_k)
+    return generation_kwargs
 
 # Generate text using loaded LLM model
 # Total prompt size is limited to 2048 tokens with the included model
 # the prompt includes (prompt template, user input, retrieved context)
-def get_llm_generation(prompt, stop_words, temperature=0.7, max_new_tokens=256, top_p=0.85, top_k=70, repetition_penalty=1.07, do_sample=False):
-    stop_ids = [tokenizer.encode(w)[0] for w in stop_words]
-    stop_criteria = KeywordsStoppingCriteria(stop_ids)
-
-    generated_text = generator(prompt, max_new_tokens=max_new_tokens, do_sample=do_sample, temperature=temperature, top_p=top_p, top_k=top_k, repetition_penalty=repetition_penalty, pad_token_id=tokenizer.eos_token_id, stopping_criteria=StoppingCriteriaList([stop_criteria]),)[0]
+# Generation stops at deadline (a time.monotonic() time) or once is_cancelled() returns True,
+# raising utils.serving.DeadlineExceeded or RequestCancelled
+# cache_prefix is the start of the prompt later prompts share (e.g. template and context), its
+# key/values are kept by the prefix cache
+def get_llm_generation(prompt, stop_words, temperature=0.7, max_new_tokens=256, top_p=0.85, top_k=70, repetition_penalty=1.07, do_sample=False,
+                       deadline=None, is_cancelled=None, cache_prefix=None):
+    generation_kwargs = get_generation_kwargs(temperature, max_new_tokens, top_p, top_k, repetition_penalty, do_sample)
 
     #return a response that cuts out the prompt
-    return generated_text['generated_text'][len(prompt):]
+    return registry.get("llm").scheduler.generate(prompt, stop_words, deadline=deadline, is_cancelled=is_cancelled,
+                                                  cache_prefix=cache_prefix, **generation_kwargs)
+
+# Same as get_llm_generation but yields text pieces as soon as they are decoded,
+# so callers can show the first tokens instead of waiting for the whole answer
+def stream_llm_generation(prompt, stop_words, temperature=0.7, max_new_tokens=256, top_p=0.85, top_k=70, repetition_penalty=1.07, do_sample=False,
+                          deadline=None, is_cancelled=None, cache_prefix=None):
+    generation_kwargs = get_generation_kwargs(temperature, max_new_tokens, top_p, top_k, repetition_penalty, do_sample)
+
+    yield from registry.get("llm").scheduler.stream(prompt, stop_words, deadline=deadline, is_cancelled=is_cancelled,
+                                                    cache_prefix=cache_prefix, **generation_kwargs)
@@ -0,0 +1,182 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Models are loaded in background threads so an app can bind its port and
+# report that it is alive (and still warming up) while multi-GB checkpoints load.
+# Legacy pytorch_model*.bin checkpoints are converted to safetensors once: those
+# are memory mapped instead of unpickled, so loading is faster, needs no second
+# copy of the weights and later starts read pages from the OS page cache.
+
+import json
+import os
+import threading
+import time
+
+import torch
+
+
+class ModelNotReady(Exception):
+    pass
+
+
+# Models, tokenizers and configs are loaded one at a time: transformers imports model classes lazily, which
+# races between threads, and while accelerate loads with device_map or low_cpu_mem_usage it patches module
+# construction process wide, so a model built meanwhile in another thread ends up on the meta device
+loading_lock = threading.RLock()
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (Linux VmHWM, ru_maxrss elsewhere)."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _Entry:
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.state = "registered"
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.peak_rss_mb = None
+        self.thread = None
+        self.done = threading.Event()
+
+
+class ModelRegistry:
+    """Named models loaded once, in a background thread, by a loader function."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        with self._lock:
+            self._entries[name] = _Entry(name, loader)
+
+    def start(self, name):
+        """Start loading name in the background. Safe to call more than once."""
+        with self._lock:
+            entry = self._entries[name]
+            if entry.thread is None:
+                entry.state = "loading"
+                entry.thread = threading.Thread(target=self._load, args=(entry,), name=f"load-{name}", daemon=True)
+                entry.thread.start()
+        return entry
+
+    def _load(self, entry):
+        start = time.perf_counter()
+        try:
+            entry.value = entry.loader()
+            entry.state = "ready"
+        except Exception as e:
+            entry.error = f"{type(e).__name__}: {e}"
+            entry.state = "failed"
+            print(f"⚠️ Loading {entry.name} failed: {entry.error}")
+        entry.load_seconds = round(time.perf_counter() - start, 2)
+        entry.peak_rss_mb = round(peak_rss_mb(), 1)
+        if entry.state == "ready":
+            print(f"{entry.name} ready in {entry.load_seconds}s (peak RSS {entry.peak_rss_mb} MB)")
+        entry.done.set()
+
+    def get(self, name, timeout=None):
+        """The loaded model, starting the load if needed and waiting up to timeout seconds (None waits forever)."""
+        entry = self.start(name)
+        if not entry.done.wait(timeout):
+            raise ModelNotReady(f"{name} is still loading")
+        if entry.state != "ready":
+            raise ModelNotReady(f"{name} failed to load: {entry.error}")
+        return entry.value
+
+    def is_ready(self, name):
+        return self._entries[name].state == "ready"
+
+    def failed(self):
+        return [name for name, entry in self._entries.items() if entry.state == "failed"]
+
+    def status(self):
+        return {
+            name: {"state": e.state, "error": e.error, "load_seconds": e.load_seconds, "peak_rss_mb": e.peak_rss_mb}
+            for name, e in self._entries.items()
+        }
+
+
+# ** Checkpoint conversion **
+def _convert_file(source, target, dtype=None):
+    from safetensors.torch import save_file
+
+    try:
+        state_dict = torch.load(source, map_location="cpu", weights_only=True)
+    except TypeError:  # torch < 1.13
+        state_dict = torch.load(source, map_location="cpu")
+
+    # safetensors refuses tensors that share memory (e.g. tied embeddings), store a copy of each
+    seen = set()
+    for key, tensor in state_dict.items():
+        storage = tensor.untyped_storage().data_ptr() if hasattr(tensor, "untyped_storage") else tensor.storage().data_ptr()
+        if storage in seen:
+            tensor = tensor.clone()
+        seen.add(storage)
+        if dtype is not None and tensor.is_floating_point():
+            tensor = tensor.to(dtype)
+        state_dict[key] = tensor.contiguous()
+
+    save_file(state_dict, target + ".tmp", metadata={"format": "pt"})
+    os.replace(target + ".tmp", target)
+
+
+def convert_to_safetensors(model_path, dtype=None):
+    """Write safetensors weights next to a pytorch_model*.bin checkpoint, once. Returns True when it converted.
+
+    With dtype the weights are stored in the dtype they are loaded with, so loading
+    uses the memory mapped tensors as they are instead of converting them into a copy.
+    """
+    if os.path.exists(os.path.join(model_path, "model.safetensors")) or \
+            os.path.exists(os.path.join(model_path, "model.safetensors.index.json")):
+        return False
+
+    start = time.perf_counter()
+    index_file = os.path.join(model_path, "pytorch_model.bin.index.json")
+    if os.path.exists(index_file):
+        with open(index_file, "r") as f:
+            index = json.load(f)
+        shards = {shard: shard.replace("pytorch_model", "model").replace(".bin", ".safetensors")
+                  for shard in sorted(set(index["weight_map"].values()))}
+        print(f"🔧 Converting {len(shards)} checkpoint shards in {model_path} to safetensors")
+        # One shard in memory at a time
+        for shard, target in shards.items():
+            _convert_file(os.path.join(model_path, shard), os.path.join(model_path, target), dtype)
+        # The index is written last, transformers only switches over once it exists
+        index = {"metadata": index.get("metadata", {}),
+                 "weight_map": {key: shards[shard] for key, shard in index["weight_map"].items()}}
+        with open(os.path.join(model_path, "model.safetensors.index.json.tmp"), "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(os.path.join(model_path, "model.safetensors.index.json.tmp"),
+                   os.path.join(model_path, "model.safetensors.index.json"))
+    elif os.path.exists(os.path.join(model_path, "pytorch_model.bin")):
+        print(f"🔧 Converting {model_path} to safetensors")
+        _convert_file(os.path.join(model_path, "pytorch_model.bin"), os.path.join(model_path, "model.safetensors"), dtype)
+    else:
+        return False
+
+    print(f"Converted {model_path} to safetensors in {time.perf_counter() - start:.1f}s")
+    return True
@@ -0,0 +1,146 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Near-duplicate detection for knowledge base chunks. Documentation pages repeat
+# the same navigation, footer and boilerplate blocks, which would otherwise be
+# embedded and stored once per page and come back as "context".
+# Every chunk gets a MinHash signature of its word shingles; the share of equal
+# signature values estimates the Jaccard similarity of two chunks' shingle sets.
+# Signatures are split into bands for locality sensitive hashing, so a chunk is
+# only compared with the kept chunks it shares a band with. Chunks are checked
+# in a fixed order and the first of a group of near-duplicates is kept.
+
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+_word = re.compile(r"[a-z0-9]+")
+
+# Smallest prime above 2**32, the universal hash family works modulo it
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+def shingles(text, words=5):
+    """Set of the runs of `words` consecutive lowercase words in text."""
+    tokens = _word.findall(text.lower())
+    if len(tokens) <= words:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + words]) for i in range(len(tokens) - words + 1)}
+
+
+class MinHasher:
+    """MinHash signatures of num_perm uint32 values over word shingles."""
+
+    def __init__(self, num_perm=128, shingle_words=5, seed=1):
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        rng = np.random.RandomState(seed)
+        # (a * x + b) mod p stays below 2**64 for 32 bit a, b and x
+        self.a = rng.randint(1, 2 ** 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, 2 ** 32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text, self.shingle_words)),
+                             dtype=np.uint64)
+        if not len(hashes):
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint32)
+        values = (np.outer(hashes, self.a) + self.b) % _PRIME
+        return (values.min(axis=0) & _MAX_HASH).astype(np.uint32)
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return float(np.count_nonzero(signature == other)) / len(signature)
+
+
+def lsh_params(threshold, num_perm, recall=0.95):
+    """(bands, rows) with the fewest bands that still make chunks at threshold candidates with probability recall."""
+    for rows in sorted((r for r in range(1, num_perm + 1) if num_perm % r == 0), reverse=True):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            return bands, rows
+    return num_perm, 1
+
+
+class NearDuplicateIndex:
+    """Kept chunks' signatures in LSH buckets; check() keeps a chunk or names the kept chunk it duplicates."""
+
+    def __init__(self, threshold=0.85, num_perm=128):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = {}
+        self.order = {}
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def find(self, signature):
+        """The kept chunk most similar to signature at or above the threshold, None when there is none."""
+        candidates = set()
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        best, best_similarity = None, -1.0
+        # In the order chunks were kept, so ties go to the earliest one
+        for key in sorted(candidates, key=self.order.__getitem__):
+            value = similarity(self.signatures[key], signature)
+            if value >= self.threshold and value > best_similarity:
+                best, best_similarity = key, value
+        return best
+
+    def add(self, key, signature):
+        self.signatures[key] = signature
+        self.order[key] = len(self.order)
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+    def check(self, key, signature):
+        """None when the chunk is kept (and added), otherwise the key of the kept chunk it duplicates."""
+        canonical = self.find(signature)
+        if canonical is None:
+            self.add(key, signature)
+        return canonical
+
+
+# ** State kept between populate job runs **
+def save_state(path, settings, chunks, canonical):
+    """chunks is {id: (signature, text bytes)}, canonical {duplicate id: kept id}."""
+    ids = list(chunks)
+    num_perm = settings["num_perm"]
+    signatures = np.stack([chunks[i][0] for i in ids]) if ids else np.zeros((0, num_perm), dtype=np.uint32)
+    # Written next to path and swapped in, like the manifest it has to agree with
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, ids=np.array(ids, dtype=str), signatures=signatures,
+                 sizes=np.array([chunks[i][1] for i in ids], dtype=np.uint32),
+                 canonical=np.array([canonical.get(i, "") for i in ids], dtype=str),
+                 settings=np.array(json.dumps(settings, sort_keys=True)))
+    os.replace(tmp_path, path)
+
+
+def load_state(path):
+    """(settings, chunks, canonical) saved by save_state, None when there is no state."""
+    try:
+        with np.load(path, allow_pickle=False) as state:
+            settings = json.loads(str(state["settings"]))
+            ids = [str(i) for i in state["ids"]]
+            chunks = {i: (signature, int(size)) for i, signature, size in zip(ids, state["signatures"], state["sizes"])}
+            canonical = {i: str(c) for i, c in zip(ids, state["canonical"]) if c}
+        return settings, chunks, canonical
+    except FileNotFoundError:
+        return None
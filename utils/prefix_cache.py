@@ -0,0 +1,199 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Reuse of the attention key/values of prompt prefixes between generations.
+# Every prompt shares the template preamble, and follow-up questions about the
+# same retrieved context share the whole context, so their prefill is mostly
+# work that was already done. The key/values of a prompt are kept up to its
+# cache boundary (the end of the retrieved context, given by the caller), keyed
+# by the token ids before it; the question after it is rarely asked again. A
+# new prompt is matched against every entry: the key/values of the longest
+# common token prefix are sliced out of that entry (attention is causal, so
+# they do not depend on what followed) and only the rest of the prompt runs
+# through the model, one padded forward pass for the whole batch. Entries are
+# evicted least recently used first to stay under a memory budget.
+
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def past_nbytes(past):
+    return sum(t.nbytes for layer in past for t in layer)
+
+
+def slice_past(past, length):
+    return tuple(tuple(t[:, :, :length] for t in layer) for layer in past)
+
+
+def left_pad_past(pasts, length):
+    """Stack batch-1 key/values of different lengths into one left padded batch of length."""
+    layers = []
+    for layer in zip(*pasts):
+        tensors = []
+        for i in range(len(layer[0])):
+            padded = []
+            for row in layer:
+                t = row[i]
+                pad = length - t.shape[2]
+                if pad:
+                    t = torch.cat((t.new_zeros(t.shape[0], t.shape[1], pad, *t.shape[3:]), t), dim=2)
+                padded.append(t)
+            tensors.append(torch.cat(padded, dim=0))
+        layers.append(tuple(tensors))
+    return tuple(layers)
+
+
+class _Entry:
+    def __init__(self, ids, past):
+        self.ids = ids
+        self.past = past
+        self.size = past_nbytes(past)
+
+
+class PrefixCache:
+    """LRU cache of prompt key/values under max_bytes, looked up by longest common token prefix.
+
+    Prefixes shorter than min_tokens are not worth a lookup and are prefilled from scratch, the
+    default lets the RAG template's preamble (about 11 tokens) be reused for a new context.
+    """
+
+    def __init__(self, max_bytes=2 * 1024 ** 3, min_tokens=8):
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a cache configured by the PREFIX_CACHE_* environment variables, None when disabled."""
+        if os.getenv("PREFIX_CACHE_ENABLED", "1") != "1":
+            return None
+        return cls(
+            max_bytes=int(float(os.getenv("PREFIX_CACHE_MAX_MB", "2048")) * 1024 * 1024),
+            min_tokens=int(os.getenv("PREFIX_CACHE_MIN_TOKENS", "8")),
+        )
+
+    # ** Lookups **
+    def lookup(self, ids):
+        """(length, key/values) of the longest cached prefix of the 1-d token tensor ids, (0, None) without one."""
+        best_key, best_length = None, 0
+        with self._lock:
+            for key, entry in self._entries.items():
+                n = min(len(entry.ids), len(ids))
+                if n <= best_length:
+                    continue
+                mismatch = (entry.ids[:n] != ids[:n]).nonzero()
+                length = int(mismatch[0]) if len(mismatch) else n
+                if length > best_length:
+                    best_key, best_length = key, length
+
+            if best_key is None or best_length < self.min_tokens:
+                self.misses += 1
+                return 0, None
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            return best_length, slice_past(self._entries[best_key].past, best_length)
+
+    def put(self, ids, past):
+        """Cache the key/values past of the 1-d token tensor ids."""
+        entry = _Entry(ids, past)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            for key, other in list(self._entries.items()):
+                n = min(len(other.ids), len(ids))
+                if not torch.equal(other.ids[:n], ids[:n]):
+                    continue
+                if len(other.ids) >= len(ids):
+                    # Already covered by a longer entry
+                    self._entries.move_to_end(key)
+                    return
+                # The new entry covers this one
+                self._bytes -= self._entries.pop(key).size
+
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+
+    # ** Prefill **
+    def prefill(self, model, input_ids, attention_mask, boundaries=None):
+        """Key/values for all but the last column of a left padded batch, reusing the longest cached prefixes.
+
+        generate() is then called with the full batch and these key/values and only runs the last token.
+        boundaries holds, for every row, the number of its leading tokens to cache (None for nothing).
+        """
+        target = input_ids.shape[1] - 1
+        # Entries keep their ids on the CPU, comparing them does not wait for the GPU
+        rows = [ids[mask.bool()] for ids, mask in zip(input_ids.cpu(), attention_mask.cpu())]
+        lengths = [len(ids) - 1 for ids in rows]
+        found = [self.lookup(ids[:length]) for ids, length in zip(rows, lengths)]
+
+        # The new tokens of every row are run in one forward pass, so they must start at the same column:
+        # rows whose cached prefix ends before that column recompute its tail, like padding they are masked
+        start = min(target - length + cached for length, (cached, _) in zip(lengths, found))
+        reused = [max(0, length - target + start) for length in lengths]
+        with self._lock:
+            self.reused_tokens += sum(reused)
+            self.prefilled_tokens += sum(lengths) - sum(reused)
+
+        past = None
+        if start:
+            # The longest rows reuse start tokens, rows that reuse none get only padding
+            empty = slice_past(next(p for _, p in found if p is not None), 0)
+            past = left_pad_past([slice_past(p, n) if n else empty for (_, p), n in zip(found, reused)], start)
+        if start < target:
+            mask = attention_mask[:, :target]
+            # Positions count real tokens only, as generate() numbers them for left padded rows
+            position_ids = (mask.long().cumsum(-1) - 1).clamp(min=0)
+            output = model(input_ids=input_ids[:, start:target], attention_mask=mask, past_key_values=past,
+                           position_ids=position_ids[:, start:], use_cache=True)
+            past = tuple(tuple(t for t in layer) for layer in output.past_key_values)
+
+        for row, (ids, length) in enumerate(zip(rows, lengths)):
+            boundary = min(boundaries[row], length) if boundaries and boundaries[row] else 0
+            # Prefixes that came from the cache are there already
+            if boundary >= self.min_tokens and boundary > found[row][0]:
+                # A copy, a view would keep the whole batch's key/values alive
+                begin = target - length
+                self.put(ids[:boundary].clone(), tuple(tuple(t[row:row + 1, :, begin:begin + boundary].clone()
+                                                             for t in layer) for layer in past))
+        return past
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "mb": round(self._bytes / 1024 / 1024, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "reused_tokens": self.reused_tokens,
+                "prefilled_tokens": self.prefilled_tokens,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
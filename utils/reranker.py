@@ -0,0 +1,188 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Cross-encoder re-ranking of the retrieved chunks. The embedding model scores
+# the question and a chunk separately, a cross-encoder reads them together and
+# ranks much better, but costs a forward pass per (question, chunk) pair. It is
+# therefore only run over the top candidates of the vector/hybrid search, in
+# batches, under a per-query time budget: when scoring all candidates would
+# take longer than the budget only the best ranked ones that fit are scored,
+# they are re-ranked among the places they held and the others keep theirs.
+# Scores of (question, chunk) pairs are cached, so a repeated question costs
+# no forward passes at all.
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from utils.model_registry import loading_lock
+
+RERANKER_MODEL_PATH = os.getenv("RERANKER_MODEL_PATH", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "reranker-model"))
+
+
+class ScoreCache:
+    """LRU cache of cross-encoder scores keyed by (question, chunk)."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(question, document):
+        # Chunks are hashed rather than keyed by id, an id keeps its name when the populate job changes its text
+        return hashlib.sha1(f"{question}\0{document}".encode("utf-8")).digest()
+
+    def get(self, key):
+        with self.lock:
+            score = self.entries.get(key)
+            if score is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return score
+
+    def put(self, key, score):
+        with self.lock:
+            self.entries[key] = score
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class CrossEncoderReranker:
+    """Scores (question, chunk) pairs with a sequence classification model and re-orders candidates."""
+
+    def __init__(self, model_path=RERANKER_MODEL_PATH, batch_size=8, max_length=256, budget_ms=250,
+                 cache_entries=10000):
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.budget = budget_ms / 1000.0
+        with loading_lock:
+            self.tokenizer = AutoTokenizer.from_pretrained(model_path, local_files_only=True)
+            self.model = AutoModelForSequenceClassification.from_pretrained(model_path, local_files_only=True)
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model.to(self.device).eval()
+        self.max_length = min(max_length, self.tokenizer.model_max_length)
+        self.cache = ScoreCache(cache_entries)
+        # Running estimate of the seconds a forward pass takes per pair, used to stop before the budget is blown
+        self.seconds_per_pair = None
+        self.fallbacks = 0
+        self.partial = 0
+        self.queries = 0
+        # One query at a time: the model is not shared across threads and torch already uses all cores
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Reranker configured by RERANK_* environment variables, None when disabled or no model is downloaded."""
+        enabled = os.getenv("RERANK_ENABLED", "auto")
+        if enabled == "0":
+            return None
+        if enabled == "auto" and not os.path.exists(os.path.join(RERANKER_MODEL_PATH, "config.json")):
+            return None
+        return cls(model_path=RERANKER_MODEL_PATH,
+                   batch_size=int(os.getenv("RERANK_BATCH_SIZE", "8")),
+                   max_length=int(os.getenv("RERANK_MAX_LENGTH", "256")),
+                   budget_ms=float(os.getenv("RERANK_BUDGET_MS", "250")),
+                   cache_entries=int(os.getenv("RERANK_CACHE_ENTRIES", "10000")))
+
+    def _score_batch(self, question, documents):
+        encoded = self.tokenizer([question] * len(documents), documents, padding=True, truncation="only_second",
+                                 max_length=self.max_length, return_tensors="pt").to(self.device)
+        logits = self.model(**encoded).logits
+        # ms-marco style models have a single relevance logit, two label models score the "relevant" class
+        scores = logits[:, 0] if logits.shape[1] == 1 else logits.softmax(-1)[:, -1]
+        return scores.float().tolist()
+
+    def score(self, question, documents, deadline=None):
+        """Scores for documents, None for those not scored before deadline (a perf_counter time)."""
+        keys = [ScoreCache.key(question, d) for d in documents]
+        scores = [self.cache.get(k) for k in keys]
+        pending = [i for i, s in enumerate(scores) if s is None]
+        if not pending:
+            return scores
+
+        with self.lock, torch.inference_mode():
+            # A forward pass can not be interrupted, so only start the ones expected to end before the deadline.
+            # When not all pairs fit, the best ranked candidates are still scored: they are re-ranked among
+            # themselves, the cost estimate stays current and a repeated question gets further.
+            if deadline is not None and self.seconds_per_pair is not None:
+                fits = int((deadline - time.perf_counter()) / self.seconds_per_pair)
+                pending = pending[:max(fits, 0)]
+            # Longest first, so each batch is padded only to its own longest chunk
+            pending.sort(key=lambda i: len(documents[i]), reverse=True)
+
+            for start in range(0, len(pending), self.batch_size):
+                indices = pending[start:start + self.batch_size]
+                # Batches of long chunks cost more than the average, so check the time left before each one
+                if deadline is not None and self.seconds_per_pair is not None and \
+                        time.perf_counter() + len(indices) * self.seconds_per_pair > deadline:
+                    break
+                began = time.perf_counter()
+                batch_scores = self._score_batch(question, [documents[i] for i in indices])
+                per_pair = (time.perf_counter() - began) / len(indices)
+                self.seconds_per_pair = per_pair if self.seconds_per_pair is None else \
+                    0.8 * self.seconds_per_pair + 0.2 * per_pair
+                for i, score in zip(indices, batch_scores):
+                    scores[i] = score
+                    self.cache.put(keys[i], score)
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+        return scores
+
+    def rerank(self, question, candidates, top_k=None):
+        """candidates (dicts with a "document") best first by cross-encoder score, plus whether all were re-ranked.
+
+        Past the time budget the candidates that were scored are re-ranked among the places they held
+        and the others keep their original place.
+        """
+        self.queries += 1
+        if not candidates:
+            return candidates, True
+        scores = self.score(question, [c["document"] or "" for c in candidates],
+                            deadline=time.perf_counter() + self.budget)
+        scored = [i for i, score in enumerate(scores) if score is not None]
+        if len(scored) < len(candidates):
+            self.fallbacks += 1
+            self.partial += bool(scored)
+        order = list(range(len(candidates)))
+        for place, i in zip(scored, sorted(scored, key=lambda i: -scores[i])):
+            order[place] = i
+        reranked = [candidates[i] if scores[i] is None else dict(candidates[i], rerank_score=round(scores[i], 6))
+                    for i in order[:top_k]]
+        return reranked, len(scored) == len(candidates)
+
+    def stats(self):
+        return {"queries": self.queries, "fallbacks": self.fallbacks, "partial": self.partial,
+                "budget_ms": self.budget * 1000,
+                "ms_per_pair": round(self.seconds_per_pair * 1000, 3) if self.seconds_per_pair else None,
+                "cache": self.cache.stats()}
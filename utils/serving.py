@@ -0,0 +1,216 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Admission control for the apps' question routes. At most max_active questions
+# are answered at once and at most max_waiting more wait for a slot; anything
+# beyond that is refused right away with 503 instead of piling up behind a
+# model that is already saturated. An admitted question gets a Ticket with its
+# deadline, which blocking work (retrieval in an executor, generation in the
+# batch scheduler) checks while it waits, so a question stops once it is past
+# its deadline or its client has disconnected.
+
+import contextvars
+import math
+import os
+import select
+import socket
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+# How often blocking waits check the deadline and whether the client is still there
+POLL_INTERVAL = 0.1
+
+
+class Overloaded(Exception):
+    """No capacity for the request, answered with 503 and Retry-After."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The request ran past its deadline, answered with 504."""
+
+
+class RequestCancelled(Exception):
+    """The client disconnected, there is nobody left to answer."""
+
+
+class Ticket:
+    """An admitted request: its deadline, whether its client is still connected and its slot."""
+
+    def __init__(self, controller, deadline, is_disconnected=None):
+        self.controller = controller
+        self.deadline = deadline
+        self._is_disconnected = is_disconnected
+        self._disconnected = False
+        self._released = False
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def expired(self):
+        return time.monotonic() > self.deadline
+
+    def disconnected(self):
+        if not self._disconnected and self._is_disconnected is not None:
+            self._disconnected = bool(self._is_disconnected())
+        return self._disconnected
+
+    def cancelled(self):
+        """True once the request should stop: past its deadline or its client is gone."""
+        return self.expired() or self.disconnected()
+
+    def check(self):
+        if self.disconnected():
+            raise RequestCancelled("Client disconnected")
+        if self.expired():
+            raise DeadlineExceeded("The request took too long, please try again")
+
+    def call(self, executor, fn, *args, **kwargs):
+        """Run blocking fn in executor and wait for it, giving up at the deadline or when the client leaves.
+
+        fn runs in a copy of this thread's context, so its metrics land in the request's trace.
+        A call that is given up on can not be interrupted, it finishes in the executor and is discarded.
+        """
+        future = executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        while True:
+            try:
+                return future.result(timeout=POLL_INTERVAL)
+            except FutureTimeout:
+                try:
+                    self.check()
+                except Exception:
+                    future.cancel()
+                    raise
+
+    def release(self):
+        """Give the slot back, safe to call more than once."""
+        if not self._released:
+            self._released = True
+            self.controller._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """Bounds the questions answered at once and the ones waiting for a slot."""
+
+    def __init__(self, max_active=16, max_waiting=32, queue_timeout=5, request_timeout=120):
+        self.max_active = max(1, max_active)
+        self.max_waiting = max(0, max_waiting)
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        # Requests refused (queue_full, queue_timeout) or stopped early (deadline, cancelled)
+        self.outcomes = {"queue_full": 0, "queue_timeout": 0, "deadline": 0, "cancelled": 0}
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_active=int(os.getenv("SERVING_MAX_ACTIVE", "16")),
+                   max_waiting=int(os.getenv("SERVING_MAX_WAITING", "32")),
+                   queue_timeout=float(os.getenv("SERVING_QUEUE_TIMEOUT", "5")),
+                   request_timeout=float(os.getenv("SERVING_REQUEST_TIMEOUT", "120")))
+
+    def count(self, outcome):
+        """Count a request stopped early, "deadline" or "cancelled"."""
+        with self._condition:
+            self.outcomes[outcome] += 1
+
+    def admit(self, is_disconnected=None):
+        """Ticket for a slot, waiting up to queue_timeout for one; raises Overloaded when there is none.
+
+        The request's deadline starts counting on arrival, so time spent waiting for a slot counts against it.
+        """
+        arrival = time.monotonic()
+        deadline = arrival + self.request_timeout
+        retry_after = max(1, math.ceil(self.queue_timeout))
+        with self._condition:
+            if self.active >= self.max_active:
+                # Shed right away when the waiting line is full, a slot will not free up in time for everyone
+                if self.waiting >= self.max_waiting:
+                    self.outcomes["queue_full"] += 1
+                    raise Overloaded("The server is busy, please try again in a moment.", retry_after)
+                self.waiting += 1
+                try:
+                    give_up = min(deadline, arrival + self.queue_timeout)
+                    while self.active >= self.max_active:
+                        remaining = give_up - time.monotonic()
+                        if remaining <= 0:
+                            self.outcomes["queue_timeout"] += 1
+                            raise Overloaded("The server is busy, please try again in a moment.", retry_after)
+                        self._condition.wait(min(remaining, POLL_INTERVAL))
+                        if is_disconnected is not None and is_disconnected():
+                            self.outcomes["cancelled"] += 1
+                            raise RequestCancelled("Client disconnected while waiting for a slot")
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+        return Ticket(self, deadline, is_disconnected)
+
+    def _release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {"active": self.active, "waiting": self.waiting, "max_active": self.max_active,
+                    "max_waiting": self.max_waiting, "admitted": self.admitted, **self.outcomes}
+
+
+def disconnect_checker(environ):
+    """is_disconnected() for a WSGI request, None when the server gives no way to tell."""
+    # waitress checks its channel itself when channel_request_lookahead > 0
+    if "waitress.client_disconnected" in environ:
+        return environ["waitress.client_disconnected"]
+    sock = environ.get("werkzeug.socket")
+    if sock is None:
+        return None
+
+    def is_disconnected():
+        # A closed connection reads as end of file; request bodies are consumed before answering,
+        # so anything else readable is a pipelined request, not a disconnect
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            return bool(readable) and sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+        except BlockingIOError:
+            return False
+        except (OSError, ValueError):
+            return True
+    return is_disconnected
+
+
+def serve_production(app, host, port, threads):
+    """Serve app with waitress, or Werkzeug's threaded server when waitress is not installed."""
+    try:
+        import waitress
+    except ImportError:
+        print("⚠️ waitress is not installed, serving with the threaded Werkzeug server")
+        from werkzeug.serving import make_server
+        make_server(host, port, app, threaded=True).serve_forever()
+        return
+    # channel_request_lookahead lets waitress notice clients that disconnect while their request runs
+    waitress.serve(app, host=host, port=port, threads=threads, channel_request_lookahead=1,
+                   connection_limit=max(100, threads * 2), ident=None)
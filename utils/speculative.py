@@ -0,0 +1,119 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Speculative decoding for greedy generation of one sequence. A small draft
+# model with the same tokenizer proposes a few tokens one at a time, then the
+# model scores all of them in a single forward pass. Proposed tokens are kept
+# up to the first one the model would not have picked, and the model's own
+# choice at that position is added, so each pass keeps at least one token and
+# the text is the one greedy decoding produces. The repetition penalty is
+# applied at every position, including the one after the last kept draft token
+# (transformers' assisted generation skips it there, which changes the text).
+# The number of proposed tokens grows by 2 after a pass that kept all of them
+# and shrinks by 1 otherwise, like transformers' heuristic.
+
+import torch
+from transformers import LogitsProcessorList, RepetitionPenaltyLogitsProcessor
+
+from utils.prefix_cache import slice_past
+
+# Generation parameters the speculative path implements, anything else is decoded normally
+SUPPORTED_PARAMS = {"max_new_tokens", "do_sample", "repetition_penalty"}
+
+
+def supports(params):
+    """True when generation with params is greedy and uses nothing the speculative path does not implement."""
+    return not params.get("do_sample") and set(params) <= SUPPORTED_PARAMS
+
+
+def _past_length(past):
+    return past[0][0].shape[2] if past is not None else 0
+
+
+class SpeculativeDecoder:
+    """Greedy decoding of one sequence with model, sped up by draft_model's guesses."""
+
+    def __init__(self, model, draft_model, draft_tokens=5):
+        self.model = model
+        self.draft_model = draft_model
+        self.draft_tokens = max(1, draft_tokens)
+
+    def _propose(self, ids, draft_past, count, processors, eos_token_id):
+        """Up to count greedy tokens from the draft model after ids, and the draft's updated key/values."""
+        candidate = ids
+        for _ in range(count):
+            outputs = self.draft_model(candidate[:, _past_length(draft_past):], past_key_values=draft_past,
+                                       use_cache=True)
+            draft_past = outputs.past_key_values
+            token = processors(candidate, outputs.logits[:, -1, :]).argmax(dim=-1, keepdim=True)
+            candidate = torch.cat((candidate, token), dim=-1)
+            if token.item() == eos_token_id:
+                break
+        return candidate[:, ids.shape[1]:], draft_past
+
+    def generate(self, input_ids, max_new_tokens, repetition_penalty=1.0, past_key_values=None,
+                 stopping_criteria=None, **kwargs):
+        """Returns (prompt and generated ids, tokens proposed, tokens accepted).
+
+        past_key_values may hold the model's key/values for all but the last prompt token.
+        stopping_criteria(ids, None) is called after every pass and ends generation when True.
+        """
+        processors = LogitsProcessorList()
+        if repetition_penalty is not None and repetition_penalty != 1.0:
+            processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+        eos_token_id = self.model.generation_config.eos_token_id
+        max_length = input_ids.shape[1] + max_new_tokens
+
+        ids = input_ids
+        past, draft_past = past_key_values, None
+        count = self.draft_tokens
+        proposed = accepted = 0
+        while ids.shape[1] < max_length:
+            # The model adds one token of its own after the kept draft tokens
+            draft = ids[:, :0]
+            if max_length - ids.shape[1] > 1:
+                draft, draft_past = self._propose(ids, draft_past, min(count, max_length - ids.shape[1] - 1),
+                                                  processors, eos_token_id)
+            candidate = torch.cat((ids, draft), dim=-1)
+
+            # Logits after the last kept token and after every draft token, in one pass
+            outputs = self.model(candidate[:, _past_length(past):], past_key_values=past, use_cache=True)
+            logits = outputs.logits[:, -draft.shape[1] - 1:, :]
+            length = ids.shape[1]
+            kept = 0
+            while True:
+                token = processors(candidate[:, :length + kept], logits[:, kept, :]).argmax(dim=-1, keepdim=True)
+                if kept == draft.shape[1] or token.item() != draft[0, kept].item():
+                    break
+                kept += 1
+            new_tokens = torch.cat((draft[:, :kept], token), dim=-1)
+            proposed += draft.shape[1]
+            accepted += kept
+            count = count + 2 if kept == draft.shape[1] and kept else max(1, count - 1)
+
+            # Tokens past an end of sequence token are dropped
+            eos = (new_tokens[0] == eos_token_id).nonzero()
+            if len(eos):
+                new_tokens = new_tokens[:, :eos[0].item() + 1]
+            ids = torch.cat((ids, new_tokens), dim=-1)
+            # Key/values stay valid up to the last kept token, the newest token is fed on the next pass
+            past = slice_past(outputs.past_key_values, ids.shape[1] - 1)
+            if draft_past is not None:
+                draft_past = slice_past(draft_past, min(_past_length(draft_past), ids.shape[1] - 1))
+
+            if stopping_criteria is not None and stopping_criteria(ids, None):
+                break
+            if len(eos):
+                break
+        return ids, proposed, accepted
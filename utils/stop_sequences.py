@@ -0,0 +1,155 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Stop sequences matched on the decoded text of each generated sequence.
+# A stop string like "\n<bot>:" is several tokens and can be tokenized
+# differently depending on the text before it, so matching on token ids misses
+# it or stops on any token it starts with. Each sequence is detokenized
+# incrementally (only the last few tokens are decoded per step) and the new
+# text is searched together with just enough of the previous text to catch a
+# stop string that spans token boundaries. Generation halts as soon as every
+# sequence in the batch has hit a stop string or the end of sequence token,
+# and the stop string itself is cut from the answer.
+
+import threading
+
+from transformers import StoppingCriteria
+
+
+class StopSequenceMatcher:
+    """Incremental detokenizer and stop string matcher for one generated sequence."""
+
+    def __init__(self, stop_sequences, decode, eos_token_id=None):
+        self.stop_sequences = [s for s in stop_sequences if s]
+        self.decode = decode
+        self.eos_token_id = eos_token_id
+        self.tokens = []
+        self.text = ""
+        self.stop_index = None
+        self.finished = False
+        self._prefix_offset = 0
+        self._read_offset = 0
+        self._sent = 0
+
+    def add(self, token):
+        """Feed the next generated token, returns True once the sequence is finished."""
+        if self.finished:
+            return True
+        if token == self.eos_token_id:
+            self.finished = True
+            return True
+        self.tokens.append(token)
+
+        # Decode from a few tokens back so merges across the boundary come out right
+        prefix_text = self.decode(self.tokens[self._prefix_offset:self._read_offset])
+        new_text = self.decode(self.tokens[self._prefix_offset:])
+        # An incomplete multi-byte character shows up as U+FFFD until its last byte arrives
+        if len(new_text) <= len(prefix_text) or new_text.endswith("�"):
+            return False
+        delta = new_text[len(prefix_text):]
+        self._prefix_offset = self._read_offset
+        self._read_offset = len(self.tokens)
+
+        start = len(self.text)
+        self.text += delta
+        for stop in self.stop_sequences:
+            index = self.text.find(stop, max(0, start - len(stop) + 1))
+            if index != -1 and (self.stop_index is None or index < self.stop_index):
+                self.stop_index = index
+        if self.stop_index is not None:
+            self.finished = True
+        return self.finished
+
+    def _held_back(self):
+        """Length of the end of text that could be the start of a stop string."""
+        longest = 0
+        for stop in self.stop_sequences:
+            for length in range(min(len(stop) - 1, len(self.text)), longest, -1):
+                if self.text.endswith(stop[:length]):
+                    longest = length
+                    break
+        return longest
+
+    def new_text(self):
+        """Text to stream since the last call, without anything that may turn out to be a stop string."""
+        if self.stop_index is not None:
+            end = self.stop_index
+        elif self.finished:
+            end = len(self.text)
+        else:
+            end = len(self.text) - self._held_back()
+        if end <= self._sent:
+            return ""
+        text = self.text[self._sent:end]
+        self._sent = end
+        return text
+
+    def result(self):
+        """The whole generated text, cut before the first stop string."""
+        text = self.decode(self.tokens)
+        for stop in self.stop_sequences:
+            index = text.find(stop)
+            if index != -1:
+                text = text[:index]
+        return text
+
+    def flush(self):
+        """Called when generation ends: whatever is left counts as final text."""
+        if self.stop_index is None and self._read_offset < len(self.tokens):
+            prefix_text = self.decode(self.tokens[self._prefix_offset:self._read_offset])
+            self.text += self.decode(self.tokens[self._prefix_offset:])[len(prefix_text):]
+            self._read_offset = len(self.tokens)
+        self.finished = True
+
+
+class StopSequenceCriteria(StoppingCriteria):
+    """Feeds each row's new tokens to its matcher, stops once every row is finished.
+
+    A step usually adds one token, a speculative one can add several; pass the
+    prompt length as input_length so those are all fed. on_step is called after
+    every step, e.g. to stream the rows' new text.
+    """
+
+    def __init__(self, matchers, on_step=None, input_length=None):
+        self.matchers = matchers
+        self.on_step = on_step
+        self.input_length = input_length
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        self.feed(input_ids)
+        if self.on_step is not None:
+            self.on_step()
+        return all(matcher.finished for matcher in self.matchers)
+
+    def feed(self, input_ids):
+        """Feed the tokens added since the last call. Also called with generate's output, because
+        the criteria after one that stops generation (like max_new_tokens) do not see the last step."""
+        start = self.input_length if self.input_length is not None else input_ids.shape[1] - 1
+        if input_ids.shape[1] <= start:
+            return
+        self.input_length = input_ids.shape[1]
+        for matcher, tokens in zip(self.matchers, input_ids[:, start:].tolist()):
+            for token in tokens:
+                if matcher.add(token):
+                    break
+
+
+def make_decoder(tokenizer, lock=None):
+    """decode(ids) for tokenizer, serialized with lock (fast tokenizers are not thread safe)."""
+    lock = lock or threading.Lock()
+
+    def decode(ids):
+        with lock:
+            return tokenizer.decode(ids, skip_special_tokens=True)
+    return decode
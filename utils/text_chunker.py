@@ -0,0 +1,206 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Streaming chunker for knowledge base documents.
+# Text is scanned once for sentence and paragraph boundaries; the resulting
+# units are measured with the embedding tokenizer (in batches) and packed into
+# chunks of at most max_tokens, preferring to break at paragraphs and headings
+# and repeating up to overlap_tokens of trailing sentences in the next chunk.
+# Input can be an iterable of text pieces (e.g. a file read in blocks) and
+# chunks are yielded lazily, so memory stays bounded for very large files.
+
+import re
+from collections import namedtuple
+
+# A chunk of the document, start/end are character offsets into the whole input
+Chunk = namedtuple("Chunk", "text start end tokens")
+
+# A sentence or paragraph, paragraph is True when a blank line follows it and
+# heading when it is a short line without closing punctuation (kept with the text after it)
+_Unit = namedtuple("_Unit", "text start end tokens paragraph heading")
+
+# Sentence end (optionally followed by closing quotes/brackets) or a blank line
+_boundary = re.compile(r"[ \t]*\n[ \t]*\n\s*|(?<=[.!?])[\"')\]]*\s+")
+_whitespace = re.compile(r"\s+")
+_heading_max_chars = 120
+
+# Units are measured this many at a time with one batched tokenizer call
+_count_batch_size = 256
+
+
+class TextChunker:
+    """Splits text into chunks of at most max_tokens.
+
+    tokenizer is a Hugging Face tokenizer used to count tokens; without one
+    length_function (default len, i.e. characters) is used instead.
+    """
+
+    def __init__(self, tokenizer=None, max_tokens=254, overlap_tokens=32, min_fill=0.5,
+                 length_function=len, max_unit_chars=100000):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.min_fill = min_fill
+        self.length_function = length_function
+        self.max_unit_chars = max_unit_chars
+        # Units are joined with a space or blank line, which only costs characters
+        self.join_cost = 0 if tokenizer is not None else 2
+
+    # ** Scanning **
+    def _units(self, pieces):
+        """Yield (start, end, paragraph) for every sentence / paragraph in a single pass."""
+        buffer = ""
+        offset = 0  # document offset of buffer[0]
+        for piece in pieces:
+            # The buffer only ever holds the unfinished tail of the previous piece
+            buffer = buffer + piece if buffer else piece
+            consumed = 0
+            for match in _boundary.finditer(buffer):
+                if match.end() == len(buffer):
+                    break  # The boundary may continue in the next piece
+                if match.start() > consumed:
+                    yield offset + consumed, buffer[consumed:match.start()], "\n" in match.group()
+                consumed = match.end()
+
+            # No boundary for a very long stretch, cut at the last whitespace to bound memory
+            if len(buffer) - consumed > self.max_unit_chars:
+                cut = buffer.rfind(" ", consumed, len(buffer) - 1)
+                cut = cut if cut > consumed else len(buffer)
+                yield offset + consumed, buffer[consumed:cut], False
+                consumed = cut
+
+            buffer = buffer[consumed:]
+            offset += consumed
+
+        if buffer.strip():
+            text = buffer.rstrip()
+            yield offset + len(buffer) - len(buffer.lstrip()), text.lstrip(), True
+
+    def _count(self, texts):
+        if self.tokenizer is None:
+            return [self.length_function(text) for text in texts]
+        backend = getattr(self.tokenizer, "backend_tokenizer", None)
+        if backend is not None:
+            # Fast tokenizers: skip the Python side of __call__, only the lengths are needed
+            return [len(encoding.ids) for encoding in backend.encode_batch(texts, add_special_tokens=False)]
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def _measured_units(self, pieces):
+        batch = []
+        for start, text, paragraph in self._units(pieces):
+            text = _whitespace.sub(" ", text).strip() if "\n" in text or "  " in text else text
+            if text:
+                batch.append((start, text, paragraph))
+            if len(batch) >= _count_batch_size:
+                yield from self._measure(batch)
+                batch = []
+        if batch:
+            yield from self._measure(batch)
+
+    def _measure(self, batch):
+        for (start, text, paragraph), tokens in zip(batch, self._count([text for _, text, _ in batch])):
+            heading = paragraph and len(text) <= _heading_max_chars and text[-1] not in ".!?:;,"
+            yield _Unit(text, start, start + len(text), tokens, paragraph, heading)
+
+    def _split_long_unit(self, unit):
+        """Hard split a single sentence longer than max_tokens."""
+        if self.tokenizer is not None:
+            encoded = self.tokenizer(unit.text, add_special_tokens=False, return_offsets_mapping=True)
+            offsets = encoded["offset_mapping"]
+            for i in range(0, len(offsets), self.max_tokens):
+                window = offsets[i:i + self.max_tokens]
+                start, end = window[0][0], window[-1][1]
+                yield Chunk(unit.text[start:end], unit.start + start, unit.start + end, len(window))
+        else:
+            position = 0
+            while position < len(unit.text):
+                end = position + self.max_tokens
+                if end < len(unit.text):
+                    space = unit.text.rfind(" ", position, end)
+                    end = space if space > position else end
+                end = min(end, len(unit.text))
+                text = unit.text[position:end].strip()
+                if text:
+                    yield Chunk(text, unit.start + position, unit.start + end, self.length_function(text))
+                position = end
+
+    # ** Packing **
+    def _make_chunk(self, units, tokens):
+        parts = []
+        for i, unit in enumerate(units):
+            parts.append(unit.text)
+            if i < len(units) - 1:
+                parts.append("\n\n" if unit.paragraph else " ")
+        return Chunk("".join(parts), units[0].start, units[-1].end, tokens)
+
+    def _size(self, units):
+        return sum(unit.tokens for unit in units) + self.join_cost * max(len(units) - 1, 0)
+
+    def _overlap(self, units):
+        """Trailing units of the previous chunk to repeat at the start of the next one."""
+        tail, tokens = [], 0
+        for unit in reversed(units):
+            if tokens + unit.tokens + self.join_cost > self.overlap_tokens:
+                break
+            tail.insert(0, unit)
+            tokens += unit.tokens + self.join_cost
+        # A chunk made only of overlap would repeat forever
+        if len(tail) == len(units):
+            return [], 0
+        return tail, tokens
+
+    def chunks(self, text_or_pieces):
+        """Yield Chunk tuples for a string or an iterable of text pieces."""
+        pieces = (text_or_pieces,) if isinstance(text_or_pieces, str) else text_or_pieces
+
+        current, tokens = [], 0
+        for unit in self._measured_units(pieces):
+            if unit.tokens > self.max_tokens:
+                if current:
+                    yield self._make_chunk(current, tokens)
+                current, tokens = [], 0
+                yield from self._split_long_unit(unit)
+                continue
+
+            cost = unit.tokens + (self.join_cost if current else 0)
+            # Prefer to end a reasonably full chunk where a paragraph ends, but never right after a heading
+            paragraph_break = (current and current[-1].paragraph and not current[-1].heading
+                               and tokens >= self.min_fill * self.max_tokens)
+            if current and (tokens + cost > self.max_tokens or paragraph_break):
+                # A heading at the very end moves on to the chunk with its text
+                carried = []
+                while len(current) > 1 and current[-1].heading:
+                    carried.insert(0, current.pop())
+                yield self._make_chunk(current, self._size(current))
+                overlap = self._overlap(current)[0] if not carried else []
+                # The next chunk must still fit: the overlap gives way first, then the headings get a chunk of their own
+                while overlap and self._size(overlap + [unit]) > self.max_tokens:
+                    overlap.pop(0)
+                if carried and self._size(carried + [unit]) > self.max_tokens:
+                    yield self._make_chunk(carried, self._size(carried))
+                    carried = []
+                current = overlap + carried
+                tokens = self._size(current)
+                cost = unit.tokens + (self.join_cost if current else 0)
+
+            current.append(unit)
+            tokens += cost
+
+        if current:
+            yield self._make_chunk(current, tokens)
+
+
+def read_in_blocks(file, block_size=1 << 20):
+    """Iterate a text file in blocks, for feeding TextChunker.chunks."""
+    return iter(lambda: file.read(block_size), "")
@@ -0,0 +1,190 @@
+# Copyright 2025 Cloudera Government Solutions, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Exact nearest neighbour search over the knowledge base chunks without
+# chromadb. A few thousand chunks fit in a few MB, so scoring every chunk with
+# one matrix-vector product is as fast as an HNSW lookup and exact, and the
+# index opens by memory mapping its files instead of starting a database.
+# The populate job exports the Chroma collection to a directory of:
+#   vectors.npy    (n, dim) L2 normalized embeddings, float32, float16 or int8
+#   scales.npy     float32 scale of every row, int8 only
+#   ids.json       Chroma id of every row
+#   records.jsonl  {"document", "metadata"} of every row, one per line
+#   offsets.npy    uint64 byte offset of every row's record, plus the end
+#   meta.json      row count, dimension, dtype, Chroma's distance metric, build time
+# Only the records of the rows a query returns are read and parsed.
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+DTYPES = ("float32", "float16", "int8")
+
+# Rows scored per block when the vectors are stored in a compact dtype, converted to float32 on the fly
+BLOCK_ROWS = 4096
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def distance_from_similarity(similarity, metric):
+    """Chroma's distance for the cosine similarity of normalized vectors, so both backends report the same."""
+    if metric == "l2":
+        # Squared euclidean distance between unit vectors
+        return np.maximum(2.0 - 2.0 * similarity, 0.0)
+    return 1.0 - similarity
+
+
+def build_index(rows, path, dtype="float32", metric="l2"):
+    """Write an index of rows, an iterable of (id, embedding, document, metadata), to the directory path."""
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported vector index dtype {dtype}, expected one of {DTYPES}")
+
+    tmp_path = path.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    ids, vectors, offsets = [], [], [0]
+    with open(os.path.join(tmp_path, "records.jsonl"), "wb") as f:
+        for doc_id, embedding, document, metadata in rows:
+            ids.append(doc_id)
+            vectors.append(np.asarray(embedding, dtype=np.float32))
+            f.write(json.dumps({"document": document, "metadata": metadata}).encode("utf-8") + b"\n")
+            offsets.append(f.tell())
+
+    vectors = normalize(np.stack(vectors)) if vectors else np.zeros((0, 0), dtype=np.float32)
+    if dtype == "int8":
+        # Symmetric per row quantization: row = int8 values * scale
+        scales = np.maximum(np.abs(vectors).max(axis=1, initial=0.0), 1e-12) / 127.0
+        np.save(os.path.join(tmp_path, "scales.npy"), scales.astype(np.float32))
+        vectors = np.round(vectors / scales[:, None]).astype(np.int8)
+    np.save(os.path.join(tmp_path, "vectors.npy"), vectors.astype(dtype))
+    np.save(os.path.join(tmp_path, "offsets.npy"), np.asarray(offsets, dtype=np.uint64))
+    with open(os.path.join(tmp_path, "ids.json"), "w") as f:
+        json.dump(ids, f)
+    # meta.json last, its presence marks a complete index
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump({"format": FORMAT_VERSION, "count": len(ids), "dim": int(vectors.shape[1]) if ids else 0,
+                   "dtype": dtype, "metric": metric, "built": time.time()}, f, indent=2)
+
+    # Swap it in next to the final location, readers never see a half written index
+    old_path = path.rstrip("/") + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return {"count": len(ids), "dim": int(vectors.shape[1]) if ids else 0, "dtype": dtype,
+            "bytes": index_size(path)}
+
+
+class VectorIndex:
+    """Read side of an index written by build_index, vectors and records are memory mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported vector index format {self.meta.get('format')} in {path}")
+        with open(os.path.join(path, "ids.json"), "r") as f:
+            self.ids = json.load(f)
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r") if self.meta["dtype"] == "int8" else None
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.records = np.memmap(os.path.join(path, "records.jsonl"), dtype=np.uint8, mode="r") \
+            if self.meta["count"] else None
+        self.metric = self.meta["metric"]
+        self.version = self.meta["built"]
+        self._rows = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, doc_id):
+        """Row number of a Chroma id, None when it is not in the index."""
+        if self._rows is None:
+            self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        return self._rows.get(doc_id)
+
+    def similarities(self, query):
+        """Cosine similarity of query to every row."""
+        query = normalize(query)
+        if self.vectors.dtype == np.float32:
+            return self.vectors @ query
+        scores = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), BLOCK_ROWS):
+            scores[start:start + BLOCK_ROWS] = self.vectors[start:start + BLOCK_ROWS].astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def record(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self.records[start:end].tobytes())
+
+    def candidate(self, row, distance=None):
+        record = self.record(row)
+        return {"id": self.ids[row], "document": record["document"], "metadata": record["metadata"],
+                "distance": distance}
+
+    def query(self, embedding, k=10):
+        """[candidate] of the k nearest rows, best first, with Chroma's distance."""
+        if not self.ids:
+            return []
+        scores = self.similarities(embedding)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        distances = distance_from_similarity(scores[top], self.metric)
+        return [self.candidate(int(row), float(d)) for row, d in zip(top, distances)]
+
+    def get(self, ids):
+        """[candidate] for the ids in the index, without a distance."""
+        rows = [self.row(doc_id) for doc_id in ids]
+        return [self.candidate(row) for row in rows if row is not None]
+
+
+def open_index(path):
+    """The index at path, None when it has not been built yet."""
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    return VectorIndex(path)
+
+
+def index_version(path):
+    """Changes whenever build_index replaces the index at path."""
+    try:
+        return os.stat(os.path.join(path, "meta.json")).st_mtime_ns
+    except OSError:
+        return None
+
+
+def index_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def index_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))